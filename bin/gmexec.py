@@ -10,7 +10,8 @@ import argparse
 parser = argparse.ArgumentParser()
 
 parser.add_argument("-p", "--port", help="The serial port that the motion controllers are connected to.", type=str, metavar='port', required=True)
-parser.add_argument("-l", "--logfile", help="Log binary communications to the given logfile.  Useful for debugging.", type=str, metavar='logfile', required=False)
+parser.add_argument("-l", "--logfile", help="Log device status updates to the given logfile.  Useful for debugging.", type=str, metavar='logfile', required=False)
+parser.add_argument("-c", "--capture", help="Record binary communications to the given capture file, for replay with gmreplay.py.  Useful for debugging.", type=str, metavar='capfile', required=False)
 parser.add_argument("-s", "--simulate", help="Use simulated dummy motor controllers (--port value ignored).  Useful for testing if your code compiles.", action="store_true", required=False)
 parser.add_argument("script", help="GeckoMotion script to compile and execute.", type=str)
 
@@ -18,6 +19,7 @@ args = parser.parse_args()
 
 port = args.port
 log_file_path = args.logfile
+capture_path = args.capture
 script_path = args.script
 simulate = args.simulate
 
@@ -31,6 +33,9 @@ if simulate:
 print(">> Connecting to controllers...")
 drv = gm_api.GeckoDriver(log_file_path, None, simulate)
 
+if capture_path is not None:
+    drv.start_capture(capture_path)
+
 if not drv.connect(port):
     print("Error: failed to connect to motor controllers on port %s" % port)
     drv.shutdown()
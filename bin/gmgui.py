@@ -1480,8 +1480,9 @@ class UI:
 
 	def estop_clicked(self, button):
 		print("Estop")
+		self.devs.fast_estop()
 		self.serial_control_lock.acquire()
-		self.devs.estop()
+		self.devs.reconcile_estop()
 		self.serial_control_lock.release()
 		self.pause_toggle.set_active(False)
 		self.update()
@@ -1536,8 +1537,14 @@ class UI:
 		if not top_tab:
 			return
 		self.get_project_settings(self.pp)
+		if self.devs.can_assemble():
+			# Assemble without holding the lock, since this can take long enough for the devices to
+			# drop the connection.  Only swapping in the new code is done under the lock.
+			code = self.devs.compile(top_tab, self.pp)
+			self.serial_control_lock.acquire()
+			self.devs.install_code(code)
+			self.serial_control_lock.release()
 		self.serial_control_lock.acquire()
-		self.devs.assemble(top_tab, self.pp)
 		listing = self.tab_mgr.get_ro_tab("listing", True)
 		if listing:
 			print("Listing")
@@ -2067,6 +2074,13 @@ class UI:
 		"""Post-command word transmit delay in seconds"""
 		#return self.cmd_delay.get_value() * 0.001
 		return 0.01
+	def get_adaptive_timeout(self):
+		"""If true, response timeouts are learned from measured response times (up to get_resp_timeout()),
+		so that a missing or short response does not always cost the full timeout."""
+		return True
+	def get_burst_limit(self):
+		"""Max number of consecutive instant instructions sent in one idle pass (0 to disable)"""
+		return 100
 	def get_poll_rate(self):
 		"""Polling rate in seconds"""
 		#return self.poll_rate.get_value() * 0.001
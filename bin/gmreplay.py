@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+from geckomoped import capture
+import argparse
+
+# Utility program for replaying a binary communications capture (made with gmexec.py --capture, or
+# GeckoDriver.start_capture()) through the driver's decoders, without any hardware.
+
+# arg parsing
+# ------------------------------------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-r", "--repeat", help="Replay the capture this many times (for benchmarking the decoders).", type=int, default=1, required=False)
+parser.add_argument("-d", "--dump", help="Print each record in the capture instead of replaying it.", action="store_true", required=False)
+parser.add_argument("capfile", help="Capture file to replay.", type=str)
+
+args = parser.parse_args()
+
+# replay
+# ------------------------------------------------------------------------------------------------------------------
+
+if args.dump:
+    t0 = None
+    for direction, t, data in capture.CaptureReader(args.capfile):
+        if t0 is None:
+            t0 = t
+        print("%12.6f %-6s %s" % ((t - t0) * 1e-9, ("TX", "RX", "TX_RAW")[direction], ' '.join(["%02X" % c for c in data])))
+    exit(0)
+
+for n in range(args.repeat):
+    summary = capture.Replayer(args.capfile).run()
+    stats = summary['stats']
+
+    print(">> Replayed %d records (%d command frames) in %.3f s (%.0f frames/s)" %
+          (summary['records'], summary['frames'], summary['elapsed'], summary['frames_per_second'] or 0))
+    print(">> Divergences: %d, captured RX bytes not read: %d" % (summary['divergences'], summary['rx_skipped']))
+    print(">> Timeouts: %d, short reads: %d, resyncs: %d, not responding: %d, inconsistent pc: %d, rediscoveries: %d" %
+          (stats['timeouts'], stats['short_reads'], stats['resyncs'], stats['not_responding'], stats['inconsistent_pc'],
+           stats['rediscoveries']))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+from geckomoped import gm_api, server
+import argparse
+import time
+
+# Utility program which owns the motor controllers' bus and serves it to other processes (see geckomoped.server
+# for the protocol, and server.GMClient for a client).
+
+# arg parsing
+# ------------------------------------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser()
+
+parser.add_argument("-p", "--port", help="The serial port that the motion controllers are connected to.", type=str, metavar='port', required=True)
+parser.add_argument("-u", "--unix-socket", help="Serve on this unix domain socket path (default %s)." % server.DEFAULT_SOCKET, type=str, metavar='path', default=server.DEFAULT_SOCKET, required=False)
+parser.add_argument("-t", "--tcp-port", help="Serve on this TCP port instead (e.g. %d).  Clients need the token, which is saved in the token file." % server.DEFAULT_PORT, type=int, metavar='tcpport', required=False)
+parser.add_argument("--host", help="Address to serve TCP on (default localhost only).", type=str, default="127.0.0.1", required=False)
+parser.add_argument("--token-file", help="Where to save the token for TCP clients (default %s)." % server.DEFAULT_TOKEN_FILE, type=str, metavar='path', default=server.DEFAULT_TOKEN_FILE, required=False)
+parser.add_argument("--allow-python", help="Allow clients' programs to contain Python ({{{ }}} sections and {...} macros), which runs in this process.", action="store_true", required=False)
+parser.add_argument("-i", "--status-interval", help="Minimum seconds between status messages to subscribed clients.", type=float, default=.05, required=False)
+parser.add_argument("-l", "--logfile", help="Log device status updates to the given logfile.  Useful for debugging.", type=str, metavar='logfile', required=False)
+parser.add_argument("-s", "--simulate", help="Use simulated dummy motor controllers (--port value ignored).", action="store_true", required=False)
+
+args = parser.parse_args()
+
+# serve
+# ------------------------------------------------------------------------------------------------------------------
+
+if args.simulate:
+    print(">> [running in simulated mode]")
+
+print(">> Connecting to controllers...")
+drv = gm_api.GeckoDriver(args.logfile, None, args.simulate)
+
+if not drv.connect(args.port):
+    print("Error: failed to connect to motor controllers on port %s" % args.port)
+    drv.shutdown()
+    exit(1)
+
+print(">> Connected!")
+
+try:
+    srv = server.GMServer(drv, args.unix_socket, args.host, args.tcp_port, args.status_interval,
+                          allow_python=args.allow_python)
+    if srv.unix_socket is None:
+        server.write_token_file(srv.token, args.token_file)
+except OSError as ex:
+    print("Error: failed to start server: %s" % str(ex))
+    drv.shutdown()
+    exit(1)
+
+srv.start()
+print(">> Serving on %s" % (srv.unix_socket if srv.unix_socket is not None else "%s:%d (token in %s)" % (srv.address[0], srv.address[1], args.token_file)))
+
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    print("Caught keyboard interrupt, stopping...")
+    if drv.is_running():
+        drv.stop()
+
+srv.stop()
+drv.shutdown()
@@ -0,0 +1,48 @@
+from geckomoped import gm_api
+import random
+import threading
+import time
+
+# Measures emergency stop latency (time from calling estop() to the command being written to the serial port)
+# while the driver is busy running a program, and while another thread is keeping the CPU busy.
+
+drv = gm_api.GeckoDriver(None, None)
+
+drv.connect('/dev/ttyUSB0')
+
+program = """
+x configure: 4 amps, idle at 50% after 1 seconds
+x velocity 100
+loop:
+x+1000
+x-1000
+goto loop
+"""
+
+drv.load_program(program)
+
+# background load, so that the comms thread has to compete for the GIL
+stop_load = False
+def load():
+    while not stop_load:
+        sum(range(10000))
+load_thread = threading.Thread(target=load)
+load_thread.start()
+
+latencies = []
+for n in range(50):
+    drv.run()
+    time.sleep(random.uniform(.05, .3))
+    latency = drv.estop()
+    if latency is not None:
+        latencies.append(latency)
+
+stop_load = True
+load_thread.join()
+
+latencies.sort()
+if latencies:
+    print("estop latency over %d runs: min %.3f ms, median %.3f ms, max %.3f ms" %
+          (len(latencies), latencies[0]*1000, latencies[len(latencies)//2]*1000, latencies[-1]*1000))
+
+drv.shutdown()
@@ -0,0 +1,84 @@
+from geckomoped import transport
+from geckomoped.devices import RS485Devices
+import argparse
+import os
+import socket
+import struct
+import threading
+import time
+import tty
+
+# Measures command round-trip time (write a status query, read the response) through each transport.
+#
+# With no arguments, compares a local pseudo-terminal (standing in for a direct tty) with a TCP connection
+# on localhost, each with a loopback responder which answers like a bus of devices, so the figures are the
+# transports' own overhead.  Give real port names and/or tcp://host:port URLs to measure real hardware or a
+# serial-to-Ethernet bridge instead.
+
+parser = argparse.ArgumentParser()
+parser.add_argument("ports", help="Serial ports and/or tcp://host:port URLs to measure.", nargs="*")
+parser.add_argument("-n", "--count", help="Round trips per transport.", type=int, default=2000)
+parser.add_argument("-a", "--axes", help="Number of devices on the bus (sets the response length).", type=int, default=4)
+args = parser.parse_args()
+
+query = struct.pack("<H", RS485Devices.CMD_QLONG)
+response = bytes(2 + 10 * args.axes)
+
+def respond(read, write):
+    """Loopback responder: answer each 2-byte query."""
+    try:
+        while True:
+            data = b""
+            while len(data) < 2:
+                chunk = read(2 - len(data))
+                if not chunk:
+                    return
+                data += chunk
+            write(response)
+    except OSError:
+        pass
+
+def pty_loopback():
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    t = threading.Thread(target=respond, args=(lambda n: os.read(master, n), lambda d: os.write(master, d)))
+    t.daemon = True
+    t.start()
+    return name
+
+def tcp_loopback():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    def serve():
+        conn, _ = listener.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        respond(conn.recv, conn.sendall)
+    t = threading.Thread(target=serve)
+    t.daemon = True
+    t.start()
+    return "tcp://127.0.0.1:%d" % listener.getsockname()[1]
+
+def measure(name):
+    port = transport.open_transport(name)
+    times = []
+    short = 0
+    for n in range(args.count):
+        t0 = time.perf_counter()
+        port.write(query)
+        port.flush()
+        x = port.read(len(response), 0.05)
+        times.append(time.perf_counter() - t0)
+        if len(x) < len(response):
+            short += 1
+    port.close()
+    times.sort()
+    pct = lambda p: times[min(len(times) - 1, int(p * len(times)))] * 1e6
+    print("%-28s mean %7.1f us   p50 %7.1f us   p99 %7.1f us   max %7.1f us   short reads %d" %
+          (name, sum(times) / len(times) * 1e6, pct(.5), pct(.99), times[-1] * 1e6, short))
+
+ports = args.ports or [pty_loopback(), tcp_loopback()]
+print("%d round trips of a %d byte query and %d byte response:" % (args.count, len(query), len(response)))
+for name in ports:
+    measure(name)
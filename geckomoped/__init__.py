@@ -11,5 +11,5 @@ _icondir = os.path.join(thisdir, "images")
 _version = "1.0.32"
 _app_fullname = "geckomoped-" + _version
  
-__all__ = ['assemble.py', 'devices.py', 'mockui.py', 'gm_api.py']
+__all__ = ['assemble.py', 'devices.py', 'mockui.py', 'gm_api.py', 'events.py', 'stats.py', 'metrics.py', 'capture.py', 'asynclog.py', 'scheduler.py', 'statusblock.py', 'engine.py', 'server.py', 'transport.py', 'framing.py', 'discovery.py', 'flashing.py', 'streaming.py']
 
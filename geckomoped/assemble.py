@@ -1,4 +1,4 @@
-import re, os, math, sys, traceback, tokenize, io, struct
+import re, os, math, sys, traceback, tokenize, io, struct, ast
 
 
 class CodeError(Exception):
@@ -686,6 +686,23 @@ class WaitInsn(Insn):
     def is_fast(self):
         return False
 
+class EndInsn(Insn):
+    """End of a program linked with others (see Code.link()), so that running off its end stops there
+    rather than running on into the next program.  Not sent to the devices: binary_from_address()
+    treats it as the end of the code.  In flash, where the terminator can't be used (it would end
+    programming), it is a GOTO to itself, which holds the devices there until they are stopped.
+    """
+    def __init__(self, line, tab):
+        super(EndInsn, self).__init__(line, tab)
+        self.set_upper_8(0x03)  # GOTO
+        self.set_command_data(0)
+    def set_addr(self, addr):
+        super(EndInsn, self).set_addr(addr)
+        if addr is not None:
+            self.set_branch_field(addr)
+    def is_end_of_block(self):
+        return True
+
 
 class CodeBlock(object):
     """Maintain list of Insn (and Label definition points).  The code block ends at the last
@@ -741,6 +758,7 @@ class Namespace(AddressMark):
         self.namespaces = {}    # Nested namespaces (by 'as' name)
         self.blocks = [CodeBlock()]        # List of CodeBlock, with 1st one
         self.cblock = 0         # Current index in blocks
+        self.includes = []      # Namespaces whose labels are also found unqualified (see Code.link())
     def get_filename(self):
         return self.filename
     def namespace_filename(self, nsname):
@@ -791,7 +809,22 @@ class Namespace(AddressMark):
         # not qualified, look in self
         if qlabelname in self.labels:
             return self.labels[qlabelname], self
+        found = self.find_included_label(qlabelname, set())
+        if found is not None:
+            return found
         raise CodeError(for_insn, "Could not find label '%s'" % qlabelname)
+    def find_included_label(self, labelname, seen):
+        """Look for unqualified labelname in included namespaces.  Returns (label, namespace) or None."""
+        seen.add(id(self))
+        for ns in self.includes:
+            if id(ns) in seen:
+                continue
+            if labelname in ns.labels:
+                return ns.labels[labelname], ns
+            found = ns.find_included_label(labelname, seen)
+            if found is not None:
+                return found
+        return None
     def get_namespace(self, nsname, for_insn):
         """Similar to get_label(), except look for (unqualified) namespace"""
         if nsname in self.namespaces:
@@ -802,6 +835,15 @@ class AxisMask:
     """Dummy class for denoting axis mask in instruction parse template"""
     pass
 
+class ParamBinding(object):
+    """An Insn with one or more ${name} parameter operands, and the ctor args (excluding line and tab)
+    it was created with.  Code.set_params() creates the Insn again with new args, so values are checked
+    exactly as when assembling.
+    """
+    def __init__(self, insn, args):
+        self.insn = insn
+        self.args = args
+
 class Code:
     """Represents mapping between source text and object code.
     Retains reference to original GtkSource.TextBuffer(s) so that it can
@@ -829,6 +871,8 @@ class Code:
     fpat = re.compile(r"^([+-]?[0-9]+(?:[.][0-9]*))(.*)$")  # g1 = float, g2=remainder
     qlpat = re.compile(r"^([A-Za-z_]\w*(?:\s*[.]\s*[A-Za-z_]\w*)*)(.*)$")
     uqlpat = re.compile(r"^([A-Za-z_]\w*)(.*)$")
+    # Parameter operand ${name} or ${name=default}: g1=name, g2=default (see scan_asm())
+    ppat = re.compile(r"\$\{\s*([A-Za-z_]\w*)\s*(?:=([^}\n]*))?\}")
     
     def __init__(self):
         self.obj = []       # List of Insn objects (indexed by address 0,1,...)
@@ -837,10 +881,17 @@ class Code:
         self.err = None     # Step/run error message
         self.assembled = False
         self.mod_asm = True # True when source modified w.r.t. object code
+        self.encoded = None # Cache of binary_from_address() results, by address (see encode())
+        self.image = None   # Cache of the flash image (see get_image())
+        self.params = {}    # Parameter name -> list of (ParamBinding, arg index, type) where it is used
+        self.param_values = {}  # Parameter name -> current value
+        self.entries = {}   # Program name -> start address, for linked programs (see link())
+        self.linking = False
+        self.allow_python = True    # False to refuse {{{ }}} sections and {...} macros (for untrusted source)
         # Some stuff to make parsing more efficient:
         self.axisnames = dict(x=0, y=1, z=2, w=3, X=0, Y=1, Z=2, W=3)
         self._setup_opcode_table()
-    def assemble(self, tab, options):
+    def assemble(self, tab, options, params=None):
         """Assemble text program to convert to object code.
         Text should be disabled for editing when connected but
         not ready state of Devices, since we want consistency when the Devices
@@ -852,24 +903,17 @@ class Code:
         
         options is a PersistentProject object (which contains all project settings).
         
+        params is a dict of values for ${name} parameters (see scan_asm()), which override their defaults.
+        
         Tab objects contain TextBuffer objects, which contain the text to be assembled.
         """
         #print "Assembling"
-        self.top_tab = tab
-        self.options = options
-        self.tab_mgr = tab.get_mgr()
-        self.obj = []           # List of Insn
-        self.nsblocks = []      # list of tuple (namespace, codeblock)
+        self.start_assembly(tab, options, params)
         topfilename = os.path.abspath(tab.get_filename_str())
         self.root = Namespace(0, tab, topfilename)    # New top-level namespace
         self.root.add_label("<boot>", Label(0, tab, 0)) # Dummy "boot" label at org 0.
                                                         # - marks initial code as 'reachable'
-        self.setup_execdict()   # Set up local+global dict for pycode evaluation
-        self.pycode_names = {}  # ...and internal pycode section names to (sourcefilename, lineno)
-        self.pycode_nx = 0      # Reset name index
-        self.clear_errors()
         self.importfiles = {topfilename : self.root}   # Dict mapping all absolute import files to namespace object
-        self.org = None     # Catch errors using org before valid
         try:
             self.scan(tab, self.root)
             self.org = 0
@@ -878,6 +922,73 @@ class Code:
         except CodeError:
             # Get here if fatal error raised somewhere
             pass
+        return self.finish_assembly()
+
+    def link(self, programs, options, params=None):
+        """Assemble several top-level programs into one object code image, so that switching between
+        them is just a matter of setting the program counter.  programs is a list of (name, tab), and
+        options and params are as for assemble().
+
+        Each program is scanned into a namespace of its own, so programs may use the same labels, and
+        is reached from the top-level namespace by its name (e.g. label "loop" of program "cut_panel"
+        is "cut_panel.loop").  The programs are located in order, each followed by the blocks it needs
+        which have not been located already, so a library imported by several programs is assembled
+        once and shared.  An EndInsn is added where each program's text ends, so that running off the
+        end of one does not run into the next.  entries maps each name to its program's start address.
+        """
+        tab = programs[0][1]
+        self.start_assembly(tab, options, params)
+        self.linking = True
+        self.root = Namespace(0, tab, "")
+        self.importfiles = {}
+        namespaces = []
+        try:
+            for name, ptab in programs:
+                filename = os.path.abspath(ptab.get_filename_str())
+                ns = Namespace(0, ptab, filename)
+                ns.add_label("<entry>", Label(0, ptab))   # Start of the program's first block
+                try:
+                    self.root.add_namespace(name, ns)
+                except CodeError as e:
+                    self.handle_error(e)
+                    continue
+                self.importfiles.setdefault(filename, ns)
+                namespaces.append((name, ns))
+                self.scan(ptab, ns)
+                buf = ptab.buf()
+                text = buf.get_text(buf.get_start_iter(), buf.get_end_iter(), False)
+                ns.add_insn(EndInsn(text.rstrip().count('\n'), ptab))
+            self.org = 0
+            for name, ns in namespaces:
+                self.locate(ns, 0)
+                self.entries[name] = ns.labels["<entry>"].get_addr()
+            self.resolve()
+        except CodeError:
+            # Get here if fatal error raised somewhere
+            pass
+        return self.finish_assembly()
+
+    def start_assembly(self, tab, options, params):
+        """Reset state for assemble() or link()."""
+        self.top_tab = tab
+        self.options = options
+        self.tab_mgr = tab.get_mgr()
+        self.obj = []           # List of Insn
+        self.encoded = None
+        self.image = None
+        self.params = {}
+        self.param_values = dict(params or {})
+        self.entries = {}
+        self.linking = False
+        self.nsblocks = []      # list of tuple (namespace, codeblock)
+        self.setup_execdict()   # Set up local+global dict for pycode evaluation
+        self.pycode_names = {}  # ...and internal pycode section names to (sourcefilename, lineno)
+        self.pycode_nx = 0      # Reset name index
+        self.clear_errors()
+        self.org = None     # Catch errors using org before valid
+
+    def finish_assembly(self):
+        """Return the result of assemble() or link(), showing any errors."""
         # if all success...
         if not self.semantic_error_count():
             self.assembled = True
@@ -887,9 +998,56 @@ class Code:
             self.show_semantic_errors()
             return False
             
+    def assemble_line(self, text, tab):
+        """Assemble a single line of source on its own, outside of any program (e.g. for immediate
+        execution), and return the list of Insn objects for it: one, or several chained e.g. "x+100, y+50".
+        tab holds the line, for error locations.
+
+        There is no program for a label to refer to, so labels, imports and control flow are not
+        allowed.  {...} macros are evaluated in a fresh macro namespace.  Errors raise CodeError (rather
+        than being added to the error list, as for assemble()).
+        """
+        self.setup_execdict()
+        self.params = {}
+        self.param_values = {}
+        ns = Namespace(0, tab, "")
+        self.s_tab = tab
+        self.s_namespace = ns
+        self.s_line = 0
+        src = self.gpat.match(text).group(1).strip()
+        try:
+            ss = self.ss_linestart
+            for tokid, tokstr, _, _, _ in tokenize.generate_tokens(io.StringIO(src + "\n").readline):
+                if tokid in (tokenize.INDENT, tokenize.DEDENT, tokenize.NL, tokenize.ENDMARKER):
+                    continue
+                if ss == self.ss_colon_or_operand and self.s_opcode.lower() == 'import':
+                    raise ScanError("Import is not allowed here")
+                ss = ss(tokid, tokstr)
+        except ScanError as se:
+            se.set_line_tab(0, tab)
+            raise
+        except (tokenize.TokenError, IndentationError):
+            raise LineError(0, tab, "Could not parse '%s'" % src)
+        except TypeError:
+            # Insn ctor called with too few args
+            raise LineError(0, tab, "Missing operand in '%s'" % src)
+        if ns.labels:
+            raise LineError(0, tab, "Labels are not allowed here")
+        insns = [insn for block in ns.blocks for insn in block.get_insn_list()]
+        if not insns:
+            raise LineError(0, tab, "No instruction")
+        for insn in insns:
+            if isinstance(insn, ControlFlowInsn):
+                raise CodeError(insn, "Control flow is not allowed here")
+        if insns[-1].is_chained() or len(insns) > 4:
+            raise CodeError(insns[0], "Too many axes (%d) in instruction" % len(insns))
+        return insns
+
     def setup_execdict(self):
         self.uniq_label = 0
-        self.execdict = {'_code' : self, 'emit' : self.emit, 'label' : self.label}
+        self.execdict = {'_code' : self, 'emit' : self.emit, 'label' : self.label, '_param' : self._param}
+        self.s_params = []      # (name, arg index, type) of parameters in the operands of the current insn
+        self.s_params_used = [] # Parameters evaluated in the current macro
         for name, v in list(globals().items()):
             if name.endswith('Insn'):
                 self.execdict[name] = v
@@ -914,6 +1072,60 @@ class Code:
             self.uniq_label += 1
         self.add_label(labelstr, Label(self.s_line, self.s_tab), self.s_namespace)        
         return labelstr
+    def _param(self, name, default=None):
+        """Value of a ${name} parameter operand (see scan_asm())."""
+        if name in self.param_values:
+            value = self.param_values[name]
+        elif default is not None:
+            value = self.param_values[name] = default
+        else:
+            raise ScanError("Parameter '%s' has no value" % name)
+        self.s_params_used.append(name)
+        return value
+
+    def get_params(self):
+        """Return dict of the current values of the parameters used in the code."""
+        return dict((name, self.param_values[name]) for name in self.params)
+    def set_params(self, values):
+        """Change the values of parameters (dict by name), patching the insns which use them in place, so
+        that the code need not be assembled again.  Each insn is created again with its new operands, so
+        values are checked exactly as when assembling; nothing is changed unless they are all valid.
+        Raises KeyError for a parameter which is not used, or CodeError.
+        """
+        new_args = {}
+        new_values = {}
+        for name, value in values.items():
+            if name not in self.params:
+                raise KeyError("No parameter '%s'" % name)
+            for binding, index, typ in self.params[name]:
+                # (Converted for each use, as a parameter may be a float operand in one insn and an int in another)
+                arg = float(value) if typ == float and isinstance(value, int) else value
+                if not isinstance(arg, typ) or isinstance(arg, bool):
+                    raise CodeError(binding.insn, "Parameter '%s' should be %s, got %r" % (name, typ.__name__, value))
+                new_args.setdefault(binding, list(binding.args))[index] = arg
+            new_values[name] = value
+        patches = []
+        for binding, args in new_args.items():
+            insn = binding.insn
+            new = type(insn)(insn.line, insn.tab, *args)
+            if new.is_end_of_block() != insn.is_end_of_block():
+                raise CodeError(insn, "Parameter changes the program structure, so it must be assembled again")
+            word = new.get_binary()
+            if isinstance(insn, ControlFlowInsn):
+                # Keep the resolved branch address
+                word = word & 0xFFFF0000 | insn.get_branch_field()
+            patches.append((binding, args, word))
+        for binding, args, word in patches:
+            binding.insn.insn = word
+            binding.args = args
+            addr = binding.insn.get_addr()
+            if self.encoded is not None and addr is not None:
+                # Also invalidate chains which this insn ends
+                for a in range(max(addr - 3, 0), min(addr + 1, len(self.encoded))):
+                    self.encoded[a] = None
+        if patches:
+            self.image = None
+        self.param_values.update(new_values)
     
     def clear_errors(self):
         self.err = None
@@ -989,11 +1201,24 @@ class Code:
         return None
     def get_obj_len(self):
         return len(self.obj)
+    def address_of_label(self, qlabelname):
+        """Return the address of a (possibly qualified) label in the top-level namespace, or None
+        if there is no such label.
+        """
+        if self.root is None:
+            return None
+        try:
+            label, ns = self.root.get_label(qlabelname, None)
+        except CodeError:
+            return None
+        return label.get_addr()
     def binary_from_address(self, addr):
         """Return instruction code (list of 32-bit int) given address.
         Can return None if no (or incomplete) insn at given address.
         Also returns whether instruction is "fast", "instant", and next addr and list of insn objects.
         """
+        if self.encoded is not None and 0 <= addr < len(self.encoded) and self.encoded[addr] is not None:
+            return self.encoded[addr]
         bincode = []
         insnlist = []
         cont = True
@@ -1003,6 +1228,8 @@ class Code:
         nxtaddr = 0
         while a < len(self.obj) and cont:
             insn = self.obj[a]
+            if isinstance(insn, EndInsn):
+                break
             insnlist.append(insn)
             bincode.append(insn.get_binary())
             cont = insn.is_chained()
@@ -1011,7 +1238,9 @@ class Code:
                 instant, nxtaddr = insn.is_instant()
             a += 1
         if cont or len(bincode) > 4 or len(bincode) == 0:
-            if len(bincode) == 0:
+            if len(bincode) == 0 and self.is_end_at(addr):
+                self.err = "End of program at address "+str(addr)
+            elif len(bincode) == 0:
                 self.err = "No instruction at address "+str(addr)
             elif len(bincode) > 4:
                 self.err = "Too many axes ("+str(len(bincode))+") in instruction at address "+str(addr)
@@ -1019,7 +1248,42 @@ class Code:
                 self.err = "Instruction not terminated at address "+str(addr)
             return None, False, False, 0, None
         return bincode, fast, instant, nxtaddr, insnlist
-        
+    def encode(self):
+        """Pre-compute binary_from_address() for every address, so that dispatching the program
+        does no per-insn work beyond a lookup.  Done once the assembly is complete (e.g. while a
+        previous program is still running).  Addresses with no valid insn are left to be
+        evaluated (and reported) as usual.
+        """
+        encoded = []
+        err = self.err
+        for addr in range(len(self.obj)):
+            result = self.binary_from_address(addr)
+            encoded.append(result if result[0] is not None else None)
+        self.err = err
+        self.encoded = encoded
+    def is_end_at(self, addr):
+        """Return whether addr is the end of a program: past the end of the code, or an EndInsn."""
+        return addr >= len(self.obj) or isinstance(self.obj[addr], EndInsn)
+    def address_of_entry(self, name):
+        """Return the start address of a linked program (see link()), else the address of label name
+        (as address_of_label()), or None.
+        """
+        if name in self.entries:
+            return self.entries[name]
+        return self.address_of_label(name)
+    def is_instant_at(self, addr):
+        """Return whether the (possibly chained) instruction at addr is instant, i.e. can be
+        dispatched without waiting for a status round-trip.  Unlike binary_from_address(), this
+        does not set the error message if there is no valid instruction at addr.
+        """
+        a = addr
+        while 0 <= a < len(self.obj):
+            insn = self.obj[a]
+            if not insn.is_chained():
+                return insn.is_instant()[0]
+            a += 1
+        return False
+
     def scan(self, tab, namespace):
         """Main token scanner and parser driver.  This is called for pass 1 which creates
         namespaces, labels therein, and Insn objects.
@@ -1049,7 +1313,10 @@ class Code:
             el = sl + t.count('\n', soffs, eoffs)
             self.scan_asm(tab, namespace, t, soffs, eoffs, sl)
             # Now handle the Python code
-            self.run_pycode(tab, namespace, m.group(2), el-1, m.group(1))
+            if self.allow_python:
+                self.run_pycode(tab, namespace, m.group(2), el-1, m.group(1))
+            else:
+                self.handle_error(LineError(el, tab, "Python code is not allowed here"))
             sl = el + t.count('\n', eoffs, m.end())
             soffs = m.end()
         # The tail part (if any) is also asm
@@ -1080,8 +1347,12 @@ class Code:
         
         Each ss method sees the next token only, thus we must be able to parse with
         single token look-ahead.
+        
+        A parameter operand ${name} (or ${name=default}) is turned into a macro {_param(...)} which
+        takes its value from the params passed to assemble() (else the default), and the Insn and operand
+        are recorded so that Code.set_params() can patch them later.
         """
-        sio = io.StringIO(t[soffs:eoffs])
+        sio = io.StringIO(self.ppat.sub(self._param_macro, t[soffs:eoffs]))
         tokiter = tokenize.generate_tokens(sio.readline)
         ss = self.ss_linestart
         self.s_tab = tab
@@ -1122,6 +1393,24 @@ class Code:
             se = ScanError("Indentation error")
             se.set_line_tab(self.s_line, tab)
             self.handle_error(se)            
+    def _eval_param_macro(self, text):
+        """Evaluate the {_param(...)} macro for a ${name} parameter operand without eval(), when
+        allow_python is False: a default must then be a literal.  Any other macro raises ScanError.
+        """
+        try:
+            call = ast.parse(text, mode='eval').body
+            if not (isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == '_param'
+                    and not call.keywords):
+                raise ValueError(text)
+            args = [ast.literal_eval(a) for a in call.args]
+        except (SyntaxError, ValueError):
+            raise ScanError("Macros are not allowed here")
+        return self._param(*args)
+    def _param_macro(self, m):
+        default = m.group(2)
+        if default is not None and default.strip():
+            return "{_param(%r, %s)}" % (m.group(1), default.strip())
+        return "{_param(%r)}" % (m.group(1),)
     def ss_linestart(self, tokid, tokstr):
         # Expect a name (label or opcode)
         if tokid == tokenize.NEWLINE:
@@ -1176,6 +1465,7 @@ class Code:
                 args = []
             else:
                 args = [self.s_axis]
+            self.s_params = []
             tidx = self.gen_insns(self.s_template, 0, self.s_accum, args)
             if tidx < len(self.s_accum):
                 raise ScanError("Extraneous operands starting at '%s'" % self.s_accum[tidx][1])
@@ -1198,12 +1488,20 @@ class Code:
                     tid, tstr = toklist[tidx]
                     tidx += 1
                     if tstr == '}':
+                        self.s_params_used = []
                         try:
-                            po = eval(''.join(s), self.execdict, self.execdict)
+                            if self.allow_python:
+                                po = eval(''.join(s), self.execdict, self.execdict)
+                            else:
+                                po = self._eval_param_macro(''.join(s))
                             if typ == float and isinstance(po, int):
                                 po = float(po)
                             if isinstance(po, typ):
                                 args.append(po)
+                                if self.s_params_used:
+                                    if len(self.s_params_used) > 1 or s[0] != '_param':
+                                        raise ScanError("A parameter must be a whole operand")
+                                    self.s_params.append((self.s_params_used[0], len(args) - 1, typ))
                             else:
                                 raise ScanError("Macro evaluation did not return expected type %s, got %s" % \
                                         (str(typ), str(type(po))))
@@ -1284,7 +1582,13 @@ class Code:
                     args.append(val)
             elif isinstance(obj, type(Insn)):
                 #print "Emit", self.s_opcode, obj, args
-                self.add_insn(obj(self.s_line, self.s_tab, *args), self.s_namespace)
+                insn = obj(self.s_line, self.s_tab, *args)
+                if self.s_params:
+                    binding = ParamBinding(insn, list(args))
+                    for name, index, typ in self.s_params:
+                        self.params.setdefault(name, []).append((binding, index, typ))
+                    self.s_params = []
+                self.add_insn(insn, self.s_namespace)
                 args = []
             elif callable(obj):
                 #print "Call", self.s_opcode, obj, args
@@ -1452,8 +1756,11 @@ class Code:
         
         If filename is absolute, then exactly that file is imported.  Otherwise, we search
         the defined list of library folders in order, looking for the first one which
-        contains the named file.
+        contains the named file.  Without allow_python, only files in the library folders may be imported.
         """
+        if not self.allow_python and (os.path.isabs(rawfilename) or rawfilename.startswith("{")
+                                      or os.pardir in rawfilename.replace("\\", "/").split("/")):
+            raise LineError(line, tab, "Import '%s' is not allowed here (only from the library search path)" % rawfilename)
         filename = self.substitute_path(line, tab, rawfilename)
         if filename is None:
             raise LineError(line, tab, "Could not substitute '%s'" % rawfilename)
@@ -1504,6 +1811,15 @@ class Code:
                 else:
                     subnamespace = self.importfiles[filename]   # Alias to existing model
                 ns.add_namespace(nsname, subnamespace)
+            elif self.linking:
+                # Programs being linked each have a namespace of their own, so rather than merging the file
+                # into the importer's, give it one too and include that (see link())
+                if doscan:
+                    subnamespace = Namespace(line, tab, filename)
+                else:
+                    subnamespace = self.importfiles[filename]
+                if subnamespace is not ns and subnamespace not in ns.includes:
+                    ns.includes.append(subnamespace)
             else:
                 # Merge into current namespace (no 'as name')
                 subnamespace = ns
@@ -1661,6 +1977,28 @@ org    binary      source line
         except Exception as e:
             self.handle_pycode_error(e, tab, openline, modname)
                         
+    def get_image(self):
+        """Return the whole object code as bytes, as programmed to flash (4 bytes per address, high 16 bits
+        first).  Encoded once, then cached.
+        """
+        if self.image is None:
+            t = [insn.get_binary() for insn in self.obj]
+            t = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in t]
+            self.image = struct.pack("<%dI" % len(t), *t)
+        return self.image
+    def get_flash_blocks(self, n=64):
+        """Return list of the blocks of n insns to program to flash, as get_block(addr, n) for addr = 0, n, 2n...
+        The last block always ends with the 0xFFFF terminator (so is just that, if the code is a multiple of n
+        insns long).
+        """
+        image = self.get_image()
+        size = 4*n
+        blocks = [image[i:i+size] for i in range(0, len(image), size)]
+        if blocks and len(blocks[-1]) < size:
+            blocks[-1] += struct.pack('H', 0xFFFF)
+        else:
+            blocks.append(struct.pack('H', 0xFFFF))
+        return blocks
     def get_block(self, addr, n, add_ff=True):
         """Return string of object bytes suitable for programming to flash.
         addr is insn address, n is number of insns.  
@@ -1677,14 +2015,10 @@ org    binary      source line
             term = struct.pack('H', 0xFFFF)
             if addr >= len(self.obj):
                 return term
-            elif addr+n > len(self.obj):
-                t = [self.obj[x].get_binary() for x in range(addr, len(self.obj))]
-                t = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in t]
-                t = struct.pack("<"+"I"*(len(self.obj)-addr), *t)
+            t = self.get_image()[4*addr:4*(addr+n)]
+            if addr+n > len(self.obj):
                 return t+term
-            t = [self.obj[x].get_binary() for x in range(addr, addr+n)]
-            t = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in t]
-            return struct.pack("<"+"I"*n, *t)
+            return t
         else:
             fill = 0x03000000
             if addr >= len(self.obj):
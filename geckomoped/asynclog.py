@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Asynchronous log writer, so that the comms thread never blocks on a slow terminal or disk.
+
+Callers only append a compact record (the format string and its arguments, unformatted) to a bounded ring.
+A writer thread formats and writes the records in batches.  If the ring fills up, or more than rate_limit
+records per second are logged, records are dropped (and counted) rather than holding up the caller, and a
+note of how many were dropped is written in their place.
+"""
+from collections import deque
+from threading import Thread, Event
+import atexit
+import sys
+import time
+import traceback
+
+
+class hexbytes(object):
+    """Wrapper for bytes, which are formatted as hex only if the record is actually written."""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return ' '.join(["%02X" % c for c in self.data])
+
+
+class AsyncLog(object):
+    """Bounded ring of log records, written to out by a background thread.
+
+    log(), exception() and call() may be called from any thread.  They never block, and never do any
+    formatting or I/O themselves.
+    """
+    LOG = 0
+    EXC = 1
+    CALL = 2
+
+    def __init__(self, out=None, capacity=4096, rate_limit=1000, batch_interval=0.05):
+        self.out = out          # File to write to (None for sys.stdout at the time of writing)
+        self.capacity = capacity
+        self.rate_limit = rate_limit
+        self.batch_interval = batch_interval
+        self.logged = 0         # Records accepted
+        self.written = 0        # Records written (or called)
+        self.dropped_full = 0   # Records dropped because the ring was full
+        self.dropped_rate = 0   # Records dropped by the rate limit
+        self.errors = 0         # Exceptions while formatting or writing
+        self._ring = deque()
+        self._wake = Event()
+        self._idle = Event()
+        self._idle.set()
+        self._closed = False
+        self._reported_drops = 0
+        self._thread = None
+
+    def _put(self, rec):
+        if len(self._ring) >= self.capacity:
+            self.dropped_full += 1
+            return
+        self.logged += 1
+        self._idle.clear()
+        self._ring.append(rec)
+        if self._thread is None:
+            self._start()
+
+    def log(self, fmt, *args):
+        """Log a line, which will be formatted as fmt % args."""
+        self._put((self.LOG, time.time(), fmt, args))
+
+    def exception(self, fmt, *args):
+        """Log a line followed by the traceback of the exception currently being handled."""
+        self._put((self.EXC, time.time(), fmt, (args, sys.exc_info())))
+
+    def call(self, fn, *args):
+        """Call fn(*args) from the writer thread (e.g. to write to some other log file)."""
+        self._put((self.CALL, time.time(), fn, args))
+
+    def _start(self):
+        self._thread = Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _format(self, rec):
+        typ, t, fmt, args = rec
+        if typ == self.CALL:
+            fmt(*args)
+            return None
+        if typ == self.EXC:
+            args, exc_info = args
+            return (fmt % args if args else fmt) + "\n" + "".join(traceback.format_exception(*exc_info))
+        return (fmt % args if args else fmt) + "\n"
+
+    def _write_batch(self):
+        ring = self._ring
+        lines = []
+        budget = self.rate_limit * self.batch_interval
+        while ring:
+            rec = ring.popleft()
+            if budget <= 0:
+                self.dropped_rate += 1
+                continue
+            budget -= 1
+            try:
+                s = self._format(rec)
+                if s is not None:
+                    lines.append(s)
+                self.written += 1
+            except Exception:
+                self.errors += 1
+                lines.append("Log formatting error:\n" + traceback.format_exc())
+        dropped = self.dropped_full + self.dropped_rate
+        if dropped != self._reported_drops:
+            lines.append("[%d log records dropped]\n" % (dropped - self._reported_drops,))
+            self._reported_drops = dropped
+        if lines:
+            out = self.out or sys.stdout
+            try:
+                out.write("".join(lines))
+                out.flush()
+            except Exception:
+                self.errors += 1
+
+    def _writer(self):
+        while True:
+            self._wake.wait(self.batch_interval)
+            self._wake.clear()
+            self._write_batch()
+            if not self._ring:
+                self._idle.set()
+            if self._closed:
+                return
+
+    def flush(self, timeout=1.):
+        """Wait (up to timeout seconds) until everything logged so far has been written."""
+        if self._thread is not None:
+            self._wake.set()
+            self._idle.wait(timeout)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        self._wake.set()
+
+    def get_stats(self):
+        return {
+            'logged': self.logged,
+            'written': self.written,
+            'dropped_full': self.dropped_full,
+            'dropped_rate': self.dropped_rate,
+            'errors': self.errors,
+            'queued': len(self._ring),
+            }
+
+
+_default_log = None
+
+
+def default_log():
+    """Return the shared AsyncLog (writing to stdout) used by Devices objects unless given another."""
+    global _default_log
+    if _default_log is None:
+        _default_log = AsyncLog()
+    return _default_log
+
+
+def reset_default_log():
+    """Discard the shared AsyncLog, e.g. in a forked child process (where its writer thread does not exist)."""
+    global _default_log
+    _default_log = None
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Binary capture of serial traffic, and offline replay of captures through RS485Devices.
+
+A capture file is the 8-byte MAGIC header, followed by one record per chunk of traffic:
+
+    <BQH    direction, time.monotonic_ns(), length
+    data    length bytes
+
+direction is TX (one complete command frame, as written by RS485Devices._send_cmd()), TX_RAW (data written
+outside of a command frame, i.e. flash blocks) or RX (the bytes returned by one read of the port).  Records
+are written by a background thread, so capturing costs the comms thread one deque append per chunk.
+
+Replayer feeds a capture back through the RS485Devices decoders against a ReplayPort, with all delays and
+timeouts set to zero, so a problem session can be turned into a repeatable test case, or used to benchmark
+the decoders against real traffic.
+"""
+from collections import deque
+from threading import Thread, Event
+import struct
+import time
+
+from .devices import RS485Devices, Devices
+from .mockui import MockUI
+from .transport import Transport
+
+
+MAGIC = b"GMCAP\x00\x01\x00"
+
+TX = 0
+RX = 1
+TX_RAW = 2
+
+_HDR = struct.Struct("<BQH")
+
+
+class CaptureWriter(object):
+    """Append-only capture file writer.  record() may be called from any thread."""
+
+    def __init__(self, path, flush_interval=0.1):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.f = open(path, "wb")
+        self.f.write(MAGIC)
+        self.records = 0
+        self._pending = deque()
+        self._wake = Event()
+        self._closed = False
+        self._thread = Thread(target=self._writer)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, direction, data):
+        if data:
+            self._pending.append((direction, time.monotonic_ns(), bytes(data)))
+
+    def tx(self, data):
+        self.record(TX, data)
+
+    def tx_raw(self, data):
+        self.record(TX_RAW, data)
+
+    def rx(self, data):
+        self.record(RX, data)
+
+    def _drain(self):
+        pending = self._pending
+        chunks = []
+        while pending:
+            direction, t, data = pending.popleft()
+            # Max record length is 64k, which is far more than any single read or command frame
+            chunks.append(_HDR.pack(direction, t, len(data)))
+            chunks.append(data)
+            self.records += 1
+        if chunks:
+            self.f.write(b"".join(chunks))
+
+    def _writer(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._drain()
+        self._drain()
+        self.f.close()
+
+    def close(self):
+        """Write out everything recorded so far, and close the file."""
+        if not self._closed:
+            self._closed = True
+            self._wake.set()
+            self._thread.join()
+
+
+class CaptureReader(object):
+    """Iterates over the records in a capture file, as (direction, monotonic_ns, data) tuples."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a GeckoMoped capture file" % self.path)
+            while True:
+                hdr = f.read(_HDR.size)
+                if len(hdr) < _HDR.size:
+                    return  # End of file (or truncated by a crash, in which case the last record is lost)
+                direction, t, n = _HDR.unpack(hdr)
+                data = f.read(n)
+                if len(data) < n:
+                    return
+                yield direction, t, data
+
+    def read_all(self):
+        return list(self)
+
+
+class ReplayPort(Transport):
+    """Fake transport which plays back the RX side of a capture.
+
+    The port keeps a cursor into the capture.  Each write is matched against the TX record at the cursor,
+    and moves the cursor past it, so that subsequent reads return the RX data which followed it in the
+    original session.  Reads never return data past the next TX record; in that case they return short,
+    as the real port would have timed out.  A write which does not match the capture is counted as a
+    divergence, and the cursor skips ahead to the next matching TX record (if one is close enough).
+    """
+    LOOKAHEAD = 64      # Records to search for a match after a divergence
+
+    def __init__(self, records):
+        self.records = records
+        self.pos = 0            # Index of the next record
+        self.rx_offset = 0      # Bytes already read from records[pos] (if it is RX)
+        self.divergences = 0
+        self.rx_skipped = 0     # Captured RX bytes which the replay never read
+
+    def at_end(self):
+        return self.pos >= len(self.records)
+
+    def next_direction(self):
+        return self.records[self.pos][0] if self.pos < len(self.records) else None
+
+    def _skip_rx(self):
+        while self.pos < len(self.records) and self.records[self.pos][0] == RX:
+            self.rx_skipped += len(self.records[self.pos][2]) - self.rx_offset
+            self.rx_offset = 0
+            self.pos += 1
+
+    def write(self, data):
+        self._skip_rx()
+        data = bytes(data)
+        if self.pos < len(self.records) and self.records[self.pos][2] == data:
+            self.pos += 1
+            return len(data)
+        self.divergences += 1
+        for n in range(self.pos, min(self.pos + self.LOOKAHEAD, len(self.records))):
+            if self.records[n][0] != RX and self.records[n][2] == data:
+                self.pos = n + 1
+                break
+        return len(data)
+
+    def read(self, n, timeout=0.):
+        out = b""
+        while len(out) < n and self.pos < len(self.records) and self.records[self.pos][0] == RX:
+            data = self.records[self.pos][2]
+            take = data[self.rx_offset:self.rx_offset + n - len(out)]
+            out += take
+            self.rx_offset += len(take)
+            if self.rx_offset >= len(data):
+                self.rx_offset = 0
+                self.pos += 1
+        return out
+
+class ReplayUI(MockUI):
+    """UI for replay: no delays, timeouts or logging."""
+    log_file = None
+
+    def get_resp_timeout(self):
+        return 0.
+    def get_cmd_delay(self):
+        return 0.
+    def get_verbose(self):
+        return False
+
+
+class Replayer(object):
+    """Replays a capture through the RS485Devices decoders.
+
+    Command frames from the capture are re-issued through RS485Devices._send_cmd(), with the query responses
+    going through the real qlong/qshort handlers (so device state, events and stats are updated just as they
+    were in the original session).  RX data which arrived outside of a command round-trip is picked up by
+    idle_func(), as it would have been originally.
+    """
+
+    def __init__(self, path, devices=None):
+        self.records = CaptureReader(path).read_all()
+        self.port = ReplayPort(self.records)
+        self.devices = devices or RS485Devices()
+        self.devices.set_ui(ReplayUI())
+        self.devices.f = self.port
+        self.devices.insim_state = 0
+        self.devices.state = Devices.READY
+        self.frames = 0
+        self.elapsed = 0.
+
+    def _send_frame(self, frame):
+        d = self.devices
+        cmd = struct.unpack("<H", frame[0:2])[0]
+        if cmd == d.CMD_QLONG:
+            d._send_qlong()
+        elif cmd == d.CMD_QSHORT:
+            d._send_qshort()
+        else:
+            # Everything else: just consume whatever response followed it
+            n = self.port.pos + 1
+            nrx = 0
+            while n < len(self.records) and self.records[n][0] == RX:
+                nrx += len(self.records[n][2])
+                n += 1
+            args = frame[2:]
+            d._send_cmd(cmd, nrx, d.discard, bindata=args if args else None)
+
+    def run(self):
+        """Replay the whole capture.  Returns stats as per summary()."""
+        d = self.devices
+        port = self.port
+        t0 = time.perf_counter()
+        while not port.at_end():
+            direction, t, data = self.records[port.pos]
+            if direction == TX:
+                self._send_frame(data)
+                self.frames += 1
+            elif direction == TX_RAW:
+                d._write(data)
+            else:
+                pos = port.pos, port.rx_offset
+                d.idle_func()
+                if (port.pos, port.rx_offset) == pos:
+                    # idle_func() did not read it (e.g. in flash mode), so drop it
+                    port._skip_rx()
+            del d.gui_data.actions[:]
+        self.elapsed = time.perf_counter() - t0
+        return self.summary()
+
+    def summary(self):
+        return {
+            'records': len(self.records),
+            'frames': self.frames,
+            'divergences': self.port.divergences,
+            'rx_skipped': self.port.rx_skipped,
+            'elapsed': self.elapsed,
+            'frames_per_second': self.frames / self.elapsed if self.elapsed else None,
+            'stats': self.devices.stats.snapshot(),
+            }
@@ -1,6 +1,12 @@
 from .assemble import *
+from .events import status_events
+from .stats import CommsStats, ResponseTimeouts
+from .asynclog import default_log, hexbytes
+from .transport import open_transport, stable_port_path
+from .framing import QlongFramer
+from .flashing import FlashJob, FlashImageStore, PAGE_INSNS, PAGE_BYTES, page_hash
 import serial, struct, sys, time
-import traceback
+from threading import Lock, Condition, Event
 
 #from multiprocessing import Process, Pipe
 
@@ -65,6 +71,7 @@ class Device(object):
     FLG_OUT2 = 0x2000
     FLG_OUT3 = 0x4000
     MASK_OUTPUTS = FLG_OUT1|FLG_OUT2|FLG_OUT3
+    MASK_EVENTS = FLG_BUSY|MASK_ERROR|MASK_INPUTS|MASK_OUTPUTS    # Flags which generate DeviceEvents
 
     def __init__(self, axisname, axisnum):
         self.axisname = axisname
@@ -78,6 +85,7 @@ class Device(object):
         self.reset_offset()
         self.pos_valid = True   # Whether position is meaningful
         self.vel_valid = True   # Whether velocity is meaningful
+        self.has_status = False # Whether flags and pc have been received from the device yet
 
     def is_busy(self):
         return (self.flags & Device.FLG_BUSY) != 0
@@ -87,6 +95,9 @@ class Device(object):
         return (self.flags & Device.MASK_INPUTS) >> 5 ^ 0x07
     def output_state(self):
         return (self.flags & Device.MASK_OUTPUTS) >> 12
+    def input_active(self, n):
+        """Return whether input n (1..3) is on.  Note: input flags are inverted."""
+        return not (self.flags & (Device.FLG_IN1, Device.FLG_IN2, Device.FLG_IN3)[n-1])
     def reset_offset(self):
         self.offset = -388608  # Default device position offset (added to reported pos before displaying to user)
     def set_offset(self, o):
@@ -145,6 +156,8 @@ class Devices(object):
     RUN_UNTIL_BREAK_OR_ADDRMATCH = 3
     STEP_RETURN = 4
     STEP_CURSOR = 5
+    RUN_FLASH = 6       # Devices running the program in their flash on their own (see run_flash())
+    IMMEDIATE = 7       # Executing an insn from outside the program (see execute_immediate())
 
     def __init__(self):
         self.devname = None     # Serial port device name
@@ -160,6 +173,18 @@ class Devices(object):
         self.insim_state = 0 #note: "insim" = "input simulation"
         self.insn_len = 1
         self.send_next_command = False
+        self.halt_error = None          # Why the last run halted, if not at the end of the program (see send_command())
+        self.state_time = time.time()   # When state last changed
+        self.status_cond = Condition()  # Notified whenever new status is available (see _notify_status())
+        self.status_seq = 0
+        self.program_id = 0             # Incremented each time a new program is installed
+        self.event_sink = None          # If set, called with each DeviceEvent (see _update_device())
+        self.rx_time = 0.               # time.monotonic() when the last response was received
+        self.stats = CommsStats()       # Comms instrumentation (replaced, not cleared, to reset it)
+        self.capture = None             # If set, a capture.CaptureWriter recording all serial traffic
+        self.alog = default_log()       # asynclog.AsyncLog for all diagnostic output (see _log())
+        self.lost_snapshot = None       # State when the link was lost unexpectedly (see RS485Devices.recover())
+        self.immediate_addr = 0         # Program counter to go back to after execute_immediate()
         
         # Stores the data from the device that will be passed to the GUI
         self.gui_data=GUIData()
@@ -199,12 +224,14 @@ class Devices(object):
     def connect(self, devname):
         if self.state != Devices.DISCONNECTED:
             self.disconnect()
+        self.lost_snapshot = None
         if self._connect(devname):
             self.devname = devname
             return True
         return False
     def disconnect(self):
         self._disconnect()
+        self.lost_snapshot = None
         self.devname = None
     def reconnect(self, devname=None):
         if devname is None:
@@ -215,6 +242,7 @@ class Devices(object):
 
     def set_code(self, c):
         self.code = c
+        self.program_id += 1
     def get_code(self):
         return self.code
     def mod_asm(self, yes):
@@ -240,12 +268,45 @@ class Devices(object):
         if newstate == self._state:
             return
         if self.ui.get_trace():
-            print("set_state:", Devices.states[self._state], "->", Devices.states[newstate])
+            self._log("set_state: %s -> %s", Devices.states[self._state], Devices.states[newstate])
         self._state = newstate
+        self.state_time = time.time()
         if self.deferred_done and newstate == Devices.RUNNING:
             self.deferred_done = False
             self._done()
         self.update_status_button()
+        self._notify_status()
+
+    def _log(self, fmt, *args):
+        """Log diagnostic message fmt % args.  Formatting and output are done by the log writer thread,
+        so this is safe to call from the comms thread.
+        """
+        self.alog.log(fmt, *args)
+
+    def _log_exc(self, fmt, *args):
+        """As _log(), followed by the traceback of the exception being handled."""
+        self.alog.exception(fmt, *args)
+
+    def _update_device(self, dev, flags, pc):
+        """Store newly received flags and pc for dev.  If event_sink is set, any changes from the previous
+        response are passed to it as DeviceEvents.  This is called for every device on every poll, so
+        nothing is allocated unless something has actually changed.
+        """
+        if self.event_sink is not None and dev.has_status and \
+                ((flags ^ dev.flags) & Device.MASK_EVENTS or (pc != dev.pc and dev.axisnum == 0)):
+            for ev in status_events(dev, flags, pc, self.rx_time):
+                self.event_sink(ev)
+        dev.flags = flags
+        dev.pc = pc
+        dev.has_status = True
+
+    def _notify_status(self):
+        """Called after state changes, and whenever new status has been read from the devices.
+        Wakes up any threads waiting on status_cond.
+        """
+        with self.status_cond:
+            self.status_seq += 1
+            self.status_cond.notify_all()
 
     def is_connected(self):
         # True if RS485 link open and have communication
@@ -278,6 +339,13 @@ class Devices(object):
             # PAUSED.
             self.deferred_done = True
             return
+        if self.stepping == Devices.IMMEDIATE:
+            # Put the program counter back where the program was
+            if self.addr != self.immediate_addr:
+                self._send_pgm_ctr(self.immediate_addr)
+            self.stepping = Devices.STOPPED
+            self.state = Devices.READY
+            return
         err = None
         if not self.hit_breakpoint() and \
                     (self.stepping == Devices.RUN_UNTIL_BREAK or
@@ -300,6 +368,8 @@ class Devices(object):
         # Base class just works instantly... (do what I/O would normally do)
         self.next_addr = self.addr + (nxtaddr if instant else len(binlist))
         #self._done()   <-- not so fast: this recurses for each insn in RUN mode, so caller needs to do this
+    def _send_direct(self, data):
+        pass
     def _send_pause(self):
         pass
     def _send_resume(self):
@@ -308,6 +378,15 @@ class Devices(object):
         pass
     def _send_estop(self):
         pass
+    def fast_estop(self):
+        """Emergency stop which may be called without holding the lock which serializes the
+        other methods (c.f. RS485Devices).  Base class just does a normal estop.
+        Returns call-to-wire latency in seconds, or None if nothing was sent.
+        """
+        self.estop()
+        return None
+    def reconcile_estop(self):
+        pass
 
     def update_exec_pointer(self, scroll=True):
         """Move the text buffer 'next instruction' indicator to self.addr line.
@@ -375,8 +454,9 @@ class Devices(object):
             self.state = Devices.READY
             err = self.code.err
             self.code.err = None
+            self.halt_error = None if self.code.is_end_at(self.addr) else err
             if print_err:
-                print(err)
+                self._log("%s", err)
             return err
         else:
             self.state = Devices.RUNNING
@@ -467,12 +547,37 @@ class Devices(object):
 
         if self.can_step():
             self.stepping = typ or Devices.RUN_UNTIL_BREAK
+            self.halt_error = None
             while self.stepping == Devices.RUN_UNTIL_BREAK and self.send_command(False) is None:
                 self._dummy_done()
             self.stepping = Devices.STOPPED
+            self._notify_status()
+
+    def compile_line(self, text, tab):
+        """Assemble a single line of source in tab (see Code.assemble_line()) for execute_immediate().  As for
+        compile(), the loaded code is not touched.
+        """
+        return Code().assemble_line(text, tab)
+    def _send_immediate(self, insns):
+        self.immediate_addr = self.addr
+        self.stepping = Devices.IMMEDIATE
+        self.state = Devices.RUNNING
+        for d in self.devs:
+            if d is not None:
+                d.executing_insns(insns)
+        self._write_insn([insn.get_binary() for insn in insns], insns[-1].is_fast(), False, 0)
+    def execute_immediate(self, insns):
+        """Execute insns (from compile_line()) now, outside of the loaded program, which is left as it was: once they
+        complete, the program counter is put back.  Returns False if the devices are not ready.
+        """
+        if not self.is_ready():
+            return False
+        self._send_immediate(insns)
+        self._dummy_done()
+        return True
 
     def stop(self):
-        if self.is_connected() and not self.is_ready():
+        if self.is_connected() and not self.is_ready() and self.stepping != Devices.IMMEDIATE:
             self.stepping = Devices.STOPPED
     def pause(self):
         if self.state == Devices.READY or self.state == Devices.RUNNING:
@@ -495,28 +600,64 @@ class Devices(object):
         search order).
         """
         if self.can_assemble():
-            self.ui.clear_error_list()
-            self.ui.hide_error_list()
-            self.ui.unhighlight_error()
-            self.code.assemble(top_tab, options)
-            # Add errors to ui error list (tree view model)
-            for ei in range(0,self.code.semantic_error_count()):
-                line = self.code.get_error_line(ei)
-                msg = self.code.get_error_text(ei)
-                tab = self.code.get_error_tab(ei)
-                self.ui.add_error_list(tab.get_filename_str(), line+1, msg, ei)
-                self.ui.show_error_list()
-            self.update_exec_pointer()
-            self.adjust_breakpoints()
+            self.install_code(self.compile(top_tab, options))
+    def compile(self, top_tab, options, params=None, allow_python=True):
+        """Assemble code in top_tab (as for assemble()) into a new Code object, which is returned.  params are
+        values for its ${name} parameters (see Code.assemble()), and allow_python is for Code.allow_python.
+        The currently loaded code is not touched, so this may be called without holding the lock
+        which serializes the I/O processing (assembly of a big program, or slow macros, would
+        otherwise hold off device communication for too long).  Pass the result to install_code().
+        """
+        code = Code()
+        code.allow_python = allow_python
+        code.assemble(top_tab, options, params)
+        return code
+    def link(self, programs, options, params=None, allow_python=True):
+        """As compile(), but link several programs, a list of (name, tab), into one Code object (see Code.link()).
+        """
+        code = Code()
+        code.allow_python = allow_python
+        code.link(programs, options, params)
+        return code
+    def install_code(self, code):
+        """Swap in a Code object returned by compile(), report its errors to the UI and remap
+        breakpoints to its addresses.
+        """
+        self.ui.clear_error_list()
+        self.ui.hide_error_list()
+        self.ui.unhighlight_error()
+        self.code = code
+        self.program_id += 1
+        # Add errors to ui error list (tree view model)
+        for ei in range(0,self.code.semantic_error_count()):
+            line = self.code.get_error_line(ei)
+            msg = self.code.get_error_text(ei)
+            tab = self.code.get_error_tab(ei)
+            self.ui.add_error_list(tab.get_filename_str(), line+1, msg, ei)
+            self.ui.show_error_list()
+        self.update_exec_pointer()
+        self.adjust_breakpoints()
     def make_listing(self, list_tab):
         if self.assembly_valid():
             self.code.make_listing(list_tab)
-    def flash(self):
+    def flash(self, verify=True, diff=True):
         if not self.can_flash():
             return False
+        self.flash_result = {}
         return True
     def cancel_flash(self):
         pass
+    def is_flashing(self):
+        return False
+    def is_flashed(self):
+        return self.assembly_valid()
+    def run_flash(self, addr=0):
+        """Run the program from addr as run from flash.  Dummy devices have no flash, so just run it."""
+        if not self.can_step():
+            return False
+        self.addr = addr
+        self.run_until_break()
+        return True
     def input_sim_update(self, mask):
         pass
 
@@ -549,6 +690,8 @@ class RS485Devices(Devices):
     CMD_ERASE = 12
     CMD_ENDFLASH = 0xFFFF
     CMD_INSIM = 13
+    CMD_NAMES = {0:"estop", 1:"stop", 2:"pause", 3:"resume", 4:"run", 5:"flash", 6:"firmware", 7:"qshort",
+                 8:"qlong", 9:"setpc", 10:"setpage", 11:"readback", 12:"erase", 13:"insim", 0xFF:"endflash"}
 
     # Flash ROM states
     FLASH_NONE = 0          # Not programming
@@ -556,11 +699,17 @@ class RS485Devices(Devices):
     FLASH_WAIT_CAN = 2      # Waiting for cancel response ('P' or 'E' or 'F')
     FLASH_READBACK = 3      # Waiting for readback data (until timeout)
 
+    BURST_SHARE = 0.75      # Fraction of the idle_func() period that one burst of instant insns may take
+    BURST_MIN_INSNS = 4     # ...but always long enough for this many paced commands
+    FLASH_TIMEOUT = 0.5     # Max seconds for the devices to program a page and reply
+    FLASH_BURST_TIME = 0.05 # Max seconds spent flashing per idle_func() pass
+    ESCALATE_AFTER = 3      # Consecutive bad status responses before the bus is re-discovered
+
     def __init__(self):
         super(RS485Devices, self).__init__()
         self._state = Devices.DISCONNECTED
         self.fd = -1    # Serial port file descriptor
-        self.f = None   # Serial port file object
+        self.f = None   # Transport (see transport.py)
         self.fdtags = None
         self.idle_tag = None
         self.r_handler = None
@@ -570,7 +719,18 @@ class RS485Devices(Devices):
         self.pollt = time.time()
         self.flash_state = self.FLASH_NONE
         self.flash_write_time = None
+        self.flash_job = None       # FlashJob in progress (see flash())
+        self.flash_store = FlashImageStore()    # What was last programmed to each bus
+        self.flash_result = None    # Summary of the last flash()
         self.new_insim_state = 0
+        self.write_lock = Lock()    # Held while writing a single command frame to the port
+        self.estop_pending = False  # Set by fast_estop() until reconcile_estop() is done
+        self.estop_wanted = Event() # Set by fast_estop() to cut short the pacing of the frame being written
+        self.estop_latency = None   # Call-to-wire time (seconds) of the last fast_estop()
+        self.resp_timeouts = ResponseTimeouts() # Learned per-command response timeouts (see expect())
+        self.framer = QlongFramer() # Validates and realigns qlong responses
+        self.bad_responses = 0      # Consecutive bad status responses (see _check_response())
+        self.idle_period = 0.02     # Seconds between idle_func() passes (set by whatever calls it)
 
     def target_name(self):
         return "GM215"
@@ -589,18 +749,17 @@ class RS485Devices(Devices):
 
     def log_resp(self, x, typ):
         if self.trace:
-            print(typ, "recv", len(x), ":", ' '.join(["%02X" % c for c in x]))
+            self._log("%s recv %d : %s", typ, len(x), hexbytes(x))
 
     def x_qs_resp(self, x):
         """Handle 4-byte query short response from X axis only"""
         flgs, pc = struct.unpack("<HH", x)
         try:
-            self.devs[0].flags = flgs
-            self.devs[0].pc = pc
+            self._update_device(self.devs[0], flgs, pc)
             self.addr = pc  # Set "overall" address (always have X axis!)
             self.gui_data.actions.append(lambda gui: gui.update_status(0, self.devs[0]))
         except AttributeError:
-            print("Axis 0 discovered by short query")
+            self._log("Axis 0 discovered by short query")
             self._send_qlong(True)
 
     def yzw_qs_resp(self, x):
@@ -609,12 +768,11 @@ class RS485Devices(Devices):
         axisnum = flgs & Device.MASK_AXISNUM
         try:
             dev = self.devs[axisnum]
-            dev.flags = flgs
-            dev.pc = self.devs[0].pc    # Assume others at same PC (avoid off-by-1 errors)
-            self.gui_data.actions.append(lambda gui: gui.update_status(axisnum, dev))
+            self._update_device(dev, flgs, self.devs[0].pc) # Assume others at same PC (avoid off-by-1 errors)
+            self.gui_data.actions.append(lambda gui, n=axisnum, dev=dev: gui.update_status(n, dev))
 
         except AttributeError:
-            print("Axis", flgs & Device.MASK_AXISNUM, "discovered by short query")
+            self._log("Axis %d discovered by short query", flgs & Device.MASK_AXISNUM)
             self._send_qlong(True)
 
     def handle_qshort(self, x):
@@ -639,6 +797,7 @@ class RS485Devices(Devices):
             self._send_qlong()
             return
         self.test_rdy()
+        self._notify_status()
 
     def test_rdy(self):
         if not self.wait_rdy:
@@ -655,35 +814,43 @@ class RS485Devices(Devices):
 
     def handle_qlong(self, x):
         self.log_resp(x, "qlong")
-        x = x[len(x) % 10:]     # Ignore initial part not multiple of 10 length
-        self._handle_qlong(x)
+        x, repaired = self.framer.frame(x, self.devs, self.rx_time, self.n_devs, self.code.get_obj_len())
+        if repaired:
+            self.stats.framing_errors += 1
+            if x:
+                self.stats.realignments += 1
+            # Drop anything left over from the damaged response (without waiting for more), so that it
+            # doesn't turn up at the start of the next one
+            self._read(256, 0.)
+        self._handle_qlong(x, repaired)
 
     def handle_initial_qlong(self, x):
         """Initial qlong response.  This is handled specially (after connecting) in order to create the
         set of devices which are detected on the RS485 bus.
         """
         self.log_resp(x, "initial qlong")
-        x = x[len(x) % 10:]     # Ignore initial part not multiple of 10 length
+        self.framer.reset()
+        x = self.framer.frame(x, None, self.rx_time)[0]
         self.devs = [None]*4
         self.n_devs = 0
         for n in range(0,len(x),10):
             flg, pc = struct.unpack("<HH", x[n:n+4])
             axisnum = flg & Device.MASK_AXISNUM
             if self.devs[axisnum]:
-                print("Duplicate axis", axisnum, "in single response!")
+                self._log("Duplicate axis %d in single response!", axisnum)
 
             else:
                 self.devs[axisnum] = GM215Device("XYZW"[axisnum], axisnum)
                 self.n_devs += 1
-                print("Detected axis", axisnum, "=", self.devs[axisnum].axisname)
+                self._log("Detected axis %d = %s", axisnum, self.devs[axisnum].axisname)
         self._handle_qlong(x)
         for n in range(4):
             if self.devs[n] is None:
-                self.gui_data.actions.append(lambda gui: gui.update_status(n, None))
+                self.gui_data.actions.append(lambda gui, n=n: gui.update_status(n, None))
         if not self.n_devs:
             # Lost contact with all devices.
             self.gui_data.actions.append(lambda gui: gui.device_notify("No response from any device."))
-    def _handle_qlong(self, x):
+    def _handle_qlong(self, x, repaired=False):
         for d in self.devs:
             if d is not None:
                 d.noqresp += 1
@@ -699,54 +866,103 @@ class RS485Devices(Devices):
                 self.addr = pc  # Set "overall" address (always have X axis!)
             try:
                 dev = self.devs[axisnum]
-                dev.flags = flg
-                dev.pc = pc
+                self._update_device(dev, flg, pc)
                 dev.pos = pos
                 dev.vel = vel
                 dev.vin = 0
                 dev.noqresp = 0
             except AttributeError:
                 # Axis added dynamically (currently missing Device object), then handle that case
-                print("Axis", axisnum, "discovered after initial query")
+                self._log("Axis %d discovered after initial query", axisnum)
                 self.handle_initial_qlong(x)
                 return
-            self.gui_data.actions.append(lambda gui: gui.update_status(axisnum, dev))
+            self.gui_data.actions.append(lambda gui, n=axisnum, dev=dev: gui.update_status(n, dev))
         # Check for timely responses
         msg = ''
 
         if self.trace:
             for d in self.devs:
                 if d is not None:
-                    print("Device %s is at program counter 0x%04X, insn_len = 0x%04X\n" % (d.axisname, d.pc, self.insn_len))
+                    self._log("Device %s is at program counter 0x%04X, insn_len = 0x%04X\n", d.axisname, d.pc, self.insn_len)
 
+        stats = self.stats
         for d in self.devs:
             if d is not None:
                 if d.noqresp > 1:
                     msg += "Device %s not responding\n" % (d.axisname,)
+                    stats.not_responding += 1
                 elif d.error_state():
                     msg += "Device %s is signalling %s error\n" % (d.axisname, "-PFB"[d.error_state()])
+                    stats.device_errors += 1
+                elif self.stepping == Devices.RUN_FLASH:
+                    # Each device runs its own stream of insns, so they need not be in step
+                    pass
                 elif d.pc < self.addr-self.insn_len or d.pc > self.addr+self.insn_len:
                     msg += "Device %s is at inconsistent program counter 0x%04X (should be 0x%04X)\n" % \
                         (d.axisname, d.pc, self.addr)
+                    stats.inconsistent_pc += 1
         if msg:
-            # Some error.  Purge any unread data.
-            self.f.timeout = 0.05
-            self.f.read(256)
             self.gui_data.actions.append(lambda gui: gui.device_notify(msg))
-            self.n_devs = 0 # Force initial query
+        self._check_response(bool(msg) or repaired)
 
         self.test_rdy()
+        if self.stepping == Devices.RUN_FLASH:
+            self._check_flash_run()
+        self._notify_status()
+
+    def _check_response(self, bad):
+        """Called after each status response, with whether it was bad (damaged, missing a device, or
+        reporting a problem).  Only after ESCALATE_AFTER bad responses in a row is the bus re-discovered;
+        until then, the next query may well be fine.
+        """
+        if not bad:
+            if self.bad_responses:
+                self.stats.recoveries += 1
+                self.bad_responses = 0
+            return
+        self.bad_responses += 1
+        if self.bad_responses >= self.ESCALATE_AFTER:
+            self.bad_responses = 0
+            self.n_devs = 0 # Force initial query
 
     def handle_poll(self, x):
         self.log_resp(x, "poll")
 
-    def expect(self, n, handler):
+    def _read(self, n, timeout):
+        """Read up to n bytes from the port, waiting up to timeout seconds.  All reads go through
+        here so that they are counted and captured.
+        """
+        x = self.f.read(n, timeout)
+        if x:
+            self.stats.bytes_rx += len(x)
+            if self.capture is not None:
+                self.capture.rx(x)
+        return x
+
+    def _write(self, data):
+        """Write data which is not a command frame (c.f. _send_cmd()) to the port."""
+        self.f.write(data)
+        self.stats.bytes_tx += len(data)
+        if self.capture is not None:
+            self.capture.tx_raw(data)
+
+    def expect(self, n, handler, name="poll"):
         """Called after writing command to serial port.  Specify expected
-        number of bytes to read.
+        number of bytes to read.  name is the command name for stats.
         """
         if n:
-            self.f.timeout = self.ui.get_resp_timeout()
-            x = self.f.read(n)
+            timeout = self.ui.get_resp_timeout()
+            if self.ui.get_adaptive_timeout():
+                # Discovery is a qlong too, so it can go by the qlong response times
+                timeout = self.resp_timeouts.timeout("qlong" if name == "discover" else name, n, timeout)
+            t0 = time.perf_counter()
+            x = self._read(n, timeout)
+            self.rx_time = time.monotonic()
+            elapsed = time.perf_counter() - t0
+            # Discovery queries expect the longest possible response, so short is normal
+            self.stats.record_expect(name, elapsed, n if name != "discover" else len(x), len(x))
+            if name != "discover":
+                self.resp_timeouts.record(name, elapsed, n, len(x))
             handler(x)
 
     def idle_func(self):
@@ -758,18 +974,14 @@ class RS485Devices(Devices):
             # serial port is not connected
             return
 
+        if self.estop_pending:
+            self.reconcile_estop()
+
+        self.stats.record_tick(time.perf_counter())
+
         try:
-            self.f.timeout = 0.005
-            if self.flash_state == self.FLASH_WAIT:
-                x = self.f.read(2)
-                if len(x):
-                    self.handle_flash_resp(x)
-                '''  Not doing this...  always wait for response...
-                if self.flash_write_time is not None and time.time() - self.flash_write_time > 0.03:
-                    # 30ms has passed.  Assume write complete (this if no 'P' received)
-                    self.flash_write_time = None
-                    self.flash_continue()
-                '''
+            if self.flash_job is not None or self.flash_state == self.FLASH_WAIT:
+                self._flash_burst()
                 return True
             elif self.flash_state == self.FLASH_WAIT_CAN:
                 if self.flash_write_time is not None and time.time() - self.flash_write_time > 0.03:
@@ -777,7 +989,7 @@ class RS485Devices(Devices):
                     self.handle_flash_can_resp('EE')
 
             elif self.flash_state == self.FLASH_READBACK:
-                x = self.f.read(256)
+                x = self._read(256, 0.005)
                 if len(x):
                     self.handle_flash_readback(x)
                 else:
@@ -788,21 +1000,30 @@ class RS485Devices(Devices):
                 self._send_insim()
                 return True
             elif self.inst_done:
-                self.wait_rdy = False
-                self.inst_done = False
-                self.addr = self.next_addr
-                self._done()
-                return True
-            self.f.timeout = 0.
-            x = self.f.read(128)
+                if not self._instant_burst():
+                    return True
+                # Else the burst stopped at an insn which needs a status round-trip, so fall
+                # through and send it in this pass rather than waiting for the next one, spaced
+                # from the last as usual.
+                time.sleep(self.ui.get_cmd_delay())
+            x = self._read(128, 0.)
             if len(x):
+                # Most likely the late end of a response.  Re-query, but only re-discover the bus if
+                # this keeps happening.
                 self.log_resp(x, "unsolicited")
-                self._send_qlong(initial=True)
+                self.stats.resyncs += 1
+                self._check_response(True)
+                self._send_qlong()
             else:
                 if self.send_next_command:
                     self.send_next_command = False
                     err = self.send_command(False)
                     if err is None:
+                        if self.inst_done:
+                            # An instant insn (e.g. the one a burst stopped before, for lack of time):
+                            # carry on with a burst from it now, rather than on the next pass.  An insn
+                            # needing a round-trip which ends that waits for the next pass.
+                            self._instant_burst()
                         return True # remain in RUNNING state
                     # Else halt (error)
                     self.stepping = Devices.STOPPED
@@ -818,26 +1039,67 @@ class RS485Devices(Devices):
 
             return True # Reinstate callback
         except serial.SerialException as sx:
-            import traceback
-            traceback.print_exc()
-            print("Serial error:", str(sx))
+            self._log_exc("Serial error: %s", sx)
             self._disconnect()
             return False
         except ValueError as sx:
             # Get this on Windows (usually when setting timeout parameter)
-            import traceback
-            traceback.print_exc()
-            print("Serial error:", str(sx))
+            self._log_exc("Serial error: %s", sx)
             self._disconnect()
             return False
 
+    def _instant_burst(self):
+        """Called from idle_func() when an instant insn has been sent.  Completes it, then keeps
+        sending the following insns back-to-back for as long as they are also instant, instead of
+        sending one per idle pass.  Setup preambles (configure, velocity, vector axes etc.) are
+        typically long runs of these.
+
+        Consecutive commands are spaced by get_cmd_delay(), as for test_rdy().  The burst ends at
+        the first insn needing a status round-trip (send_next_command is left set for it), at a
+        breakpoint, pause or stop, or after get_burst_limit() insns.  It also ends when sending
+        another insn (which takes as long as the last one did, pacing included) would take it past
+        BURST_SHARE of idle_period, or BURST_MIN_INSNS command delays if that is longer, so that
+        the next pass and its status query are not held off.
+
+        Returns True if it ended at an insn needing a status round-trip, which idle_func() may then
+        send straight away.  Otherwise any insn left to send waits for the next pass.
+        """
+        limit = self.ui.get_burst_limit()
+        delay = self.ui.get_cmd_delay()
+        t = time.time()
+        end = t + max(self.idle_period * self.BURST_SHARE, self.BURST_MIN_INSNS * delay)
+        step = delay    # Time taken to send an insn, updated as each one is sent
+        n = 0
+        while True:
+            self.wait_rdy = False
+            self.inst_done = False
+            self.addr = self.next_addr
+            self._done()
+            if not self.send_next_command or self.f is None:
+                return False
+            if not self.code.is_instant_at(self.addr):
+                return True
+            if n >= limit or t + step > end:
+                return False
+            self.send_next_command = False
+            time.sleep(delay)
+            if self.send_command(False) is not None:
+                # Halt (error)
+                self.stepping = Devices.STOPPED
+                self.state = Devices.READY
+                return False
+            n += 1
+            now = time.time()
+            step, t = now - t, now
+
     def _connect(self, devname):
-        """Open serial port with given device node name e.g. /dev/ttyUSB0 on Linux.
+        """Open serial port with given device node name e.g. /dev/ttyUSB0 on Linux, or a TCP connection
+        to a serial bridge given as tcp://host:port.
         Return True if OK (with state set to READY), else post error message dialog then return False.
         """
-        print("Connecting to", devname)
+        self._log("Connecting to %s", devname)
         try:
-            self.f = serial.Serial(devname, 115200, timeout=0.02)
+            self.f = open_transport(devname)
         except serial.SerialException as sx:
             self.conn_error = str(sx)
             return False
@@ -847,10 +1109,13 @@ class RS485Devices(Devices):
         self._send_qlong(True)
         return True
     def _disconnect(self):
-        """Close serial port, set state to DISCONNECTED.
+        """Close serial port, set state to DISCONNECTED.  Unless disconnect() was called, the link was lost,
+        so the state at that point is kept for recover().
         """
         if self.state != Devices.DISCONNECTED:
-            print("Disconnecting", self.devname)
+            if self.lost_snapshot is None:
+                self.lost_snapshot = self._link_snapshot()
+            self._log("Disconnecting %s", self.devname)
             self.state = Devices.DISCONNECTED
             if self.fdtags is not None:
                 self.remove_fd(self.fdtags)
@@ -860,6 +1125,100 @@ class RS485Devices(Devices):
             self.f.close()
             self.f = None
             self.fd = -1
+    # Outcomes of recover()
+    RECOVER_RESUMED = "resumed"
+    RECOVER_PAUSED = "paused"
+    RECOVER_OPERATOR = "operator"
+
+    def _link_snapshot(self):
+        return {
+            'time': time.monotonic(),
+            'state': self.state,
+            'stepping': self.stepping,
+            'addr': self.addr,
+            'insn_len': self.insn_len,
+            'devs': [None if d is None else (d.pc, d.pos, d.offset, d.is_busy()) for d in self.devs],
+            }
+
+    def recover(self, devname):
+        """Re-open the port (as devname) after the link was lost, re-discover the bus, and compare each device with
+        its state when the link was lost, to decide whether the program can carry on.
+        Returns None if the port could not be opened or no devices answered (try again later), else a dict of:
+          outcome:  RECOVER_RESUMED if everything is as it was (allowing for the instruction in progress having
+                    completed meanwhile), and a running program has been resumed;
+                    RECOVER_PAUSED if the devices are intact but some have moved unexpectedly.  A running program is
+                    held in PAUSED state (or an idle one in HOLD): call resume() to carry on;
+                    RECOVER_OPERATOR if a device is missing, new, signalling an error or appears to have been reset.
+                    The program is stopped, and the machine needs checking (e.g. re-homing) before carrying on.
+          problems: list of messages describing what was found
+          seconds:  time from the link being lost to its recovery
+        """
+        snap = self.lost_snapshot
+        if snap is None or not self._connect(devname):
+            return None
+        if self.state == Devices.DISCONNECTED or not self.n_devs:
+            self._disconnect()
+            return None
+        self.lost_snapshot = None
+        running = snap['state'] in (Devices.RUNNING, Devices.PAUSED)
+        lo, hi = snap['addr'], snap['addr'] + snap['insn_len']
+        problems = []
+        moved = serious = False
+        for n in range(4):
+            old = snap['devs'][n]
+            d = self.devs[n]
+            if old is None or d is None:
+                if old is not None or d is not None:
+                    problems.append("Axis %s %s" % ("XYZW"[n], "missing" if d is None else "appeared"))
+                    serious = True
+                continue
+            pc, pos, offset, busy = old
+            d.offset = offset
+            if d.error_state():
+                problems.append("Axis %s is signalling %s error" % (d.axisname, "-PFB"[d.error_state()]))
+                serious = True
+            elif d.pc != pc and not lo <= d.pc <= hi:
+                problems.append("Axis %s program counter went from 0x%04X to 0x%04X (reset?)" % (d.axisname, pc, d.pc))
+                serious = True
+            elif d.pos != pos and not (running and (busy or d.is_busy() or d.pc != pc)):
+                # (A position change is expected if the instruction in progress moved it)
+                problems.append("Axis %s moved from %d to %d" % (d.axisname, pos, d.pos))
+                moved = True
+
+        self.wait_rdy = False
+        self.inst_done = False
+        self.send_next_command = False
+        if serious:
+            outcome = self.RECOVER_OPERATOR
+            self.stepping = Devices.STOPPED
+            self.state = Devices.READY
+        elif moved:
+            outcome = self.RECOVER_PAUSED
+            self.stepping = snap['stepping']
+            if running:
+                # Hold the devices, and carry on from wherever they are once resumed (see _done())
+                self._send_pause()
+                self.wait_rdy = True
+                self.state = Devices.PAUSED
+            else:
+                self.state = Devices.HOLD
+        else:
+            outcome = self.RECOVER_RESUMED
+            self.stepping = snap['stepping']
+            if running:
+                # Carry on once the devices are ready, from wherever they are (so an instruction which didn't get
+                # through is sent again)
+                self.wait_rdy = True
+            self.state = snap['state'] if snap['state'] != Devices.DISCONNECTED else Devices.READY
+        self.stats.reconnects += 1
+        result = {'outcome': outcome, 'problems': problems, 'seconds': time.monotonic() - snap['time']}
+        self._log("Link recovered after %.3f s: %s%s", result['seconds'], outcome,
+                  "".join(["\n  " + p for p in problems]))
+        if problems:
+            msg = "Reconnected, but:\n" + "\n".join(problems) + "\n"
+            self.gui_data.actions.append(lambda gui: gui.device_notify(msg))
+        return result
+
     def get_serport_list(self):
         """Return list of serial ports.
         Note: this is called each time the user drops down the setting->serialPort combo box.
@@ -917,11 +1276,64 @@ class RS485Devices(Devices):
         for d in self.devs:
             if d is not None:
                 d.reset_offset()
+    def fast_estop(self):
+        """Emergency stop fast path.  May be called from any thread, without holding the lock
+        which serializes the other methods, so it is not held up by a blocking read or an
+        assembly in progress.  The ESTOP frame is written straight to the port under write_lock,
+        which is only ever held for the duration of one command frame.  A frame being paced out
+        by _send_cmd() cannot be interrupted (the devices would take ESTOP as one of its operands),
+        so estop_wanted makes it send the rest of its words without the delays.  No more insns
+        are sent after this, and the rest of the state (including stepping) is brought into line
+        by reconcile_estop(), either by the caller (if it can get the lock) or on the next
+        idle_func() pass.
+        Returns call-to-wire latency in seconds, or None if not connected.
+        """
+        t0 = time.perf_counter()
+        self.estop_wanted.set()
+        with self.write_lock:
+            f = self.f
+            if f is None:
+                self.estop_wanted.clear()
+                return None
+            self.estop_pending = True
+            try:
+                s = struct.pack("<H", self.CMD_ESTOP)
+                f.write(s)
+                f.flush()
+                if self.capture is not None:
+                    self.capture.tx(s)
+            except (serial.SerialException, ValueError) as sx:
+                self._log("Serial error sending estop: %s", sx)
+                return None
+        self.estop_latency = time.perf_counter() - t0
+        self._notify_status()
+        return self.estop_latency
+    def reconcile_estop(self):
+        """Update state after fast_estop() (the equivalent of estop(), without re-sending ESTOP).
+        """
+        if not self.estop_pending:
+            return
+        self.estop_pending = False
+        self.estop_wanted.clear()
+        self.wait_rdy = False
+        self.inst_done = False
+        self.send_next_command = False
+        self.flash_state = self.FLASH_NONE
+        for d in self.devs:
+            if d is not None:
+                d.reset_offset()
+        self.stepping = Devices.STOPPED
+        self.state = Devices.READY
+        self._send_pgm_ctr(0)
     def _send_qshort(self):
         self._send_cmd(self.CMD_QSHORT, 6+2*self.n_devs, self.handle_qshort)
         pass
     def _send_qlong(self, initial=False):
+        if self.flash_state != self.FLASH_NONE:
+            # The devices are taking flash data (or sending readback data), so this would be taken as data
+            return
         if initial or not self.n_devs:
+            self.stats.rediscoveries += 1
             self._send_cmd(self.CMD_QLONG, 42, self.handle_initial_qlong)
         else:
             self._send_cmd(self.CMD_QLONG, 2+10*self.n_devs, self.handle_qlong)
@@ -935,6 +1347,12 @@ class RS485Devices(Devices):
         data = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in data]
         self._send_cmd(self.CMD_RUN, 1, self.discard, packfmt="I"*len(data), args=tuple(data))
         self._send_qlong()  # Get updated PC etc.
+    def _send_direct(self, data):
+        """Send insn words (as for _send_run()) to be executed at once, outside the program: nothing waits for
+        them to complete, and the program state is left alone.
+        """
+        data = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in data]
+        self._send_cmd(self.CMD_RUN, 0, packfmt="I"*len(data), args=tuple(data))
     def _poll(self):
         self.expect(100, self.handle_poll)
     def _send_readback(self, axis_num):
@@ -955,24 +1373,39 @@ class RS485Devices(Devices):
             s += bindata
         #self.f.flush(); time.sleep(0.02)   #FIXME testing
         # s is always even length
+        if handler == self.handle_initial_qlong:
+            name = "discover"
+        else:
+            name = self.CMD_NAMES.get(cmd & 0xFF, "cmd%d" % cmd)
         try:
-            for n in range(0,len(s),2):
-                self.f.write(s[n:n+2])
-                self.f.flush()
-                if cmddly > 0. and n+2 < len(s):
-                    time.sleep(cmddly)
-                cmddly = dly
+            with self.write_lock:
+                if self.estop_pending and cmd == self.CMD_RUN:
+                    # Never follow an emergency stop with another insn
+                    return
+                t0 = time.perf_counter()
+                if cmddly <= 0. and dly <= 0.:
+                    # No pacing, so the whole frame can go in one write
+                    self.f.write(s)
+                    self.f.flush()
+                else:
+                    for n in range(0,len(s),2):
+                        self.f.write(s[n:n+2])
+                        self.f.flush()
+                        if cmddly > 0. and n+2 < len(s) and not self.estop_wanted.is_set():
+                            # (Cut short by fast_estop(), which is waiting for write_lock)
+                            self.estop_wanted.wait(cmddly)
+                        cmddly = dly
+            self.stats.record_write(name, time.perf_counter() - t0, len(s))
+            if self.capture is not None:
+                self.capture.tx(s)
             if self.trace:
-                print("sent", len(s), "bytes:", ' '.join(["%02X" % c for c in s]))
-            self.expect(expect, handler)
+                self._log("sent %d bytes: %s", len(s), hexbytes(s))
+            self.expect(expect, handler, name)
         except serial.SerialException as sx:
-            traceback.print_exc()
-            print("Serial error:", str(sx))
+            self._log_exc("Serial error: %s", sx)
             self._disconnect()
         except Exception as ex:
-            traceback.print_exc()
-            print("generic serial error:", str(ex))
-            print("No serial port")
+            self._log_exc("generic serial error: %s\nNo serial port", ex)
             self._disconnect()
 
     def single_step(self):
@@ -982,34 +1415,183 @@ class RS485Devices(Devices):
     def run_until_break(self, typ=None):
         if self.can_step():
             self.stepping = typ or Devices.RUN_UNTIL_BREAK
+            self.halt_error = None
             self.send_command()
+    def execute_immediate(self, insns):
+        """As Devices.execute_immediate().  The insns are sent as for a program insn, and waited for by the usual
+        status queries.
+        """
+        if not self.is_ready():
+            return False
+        self._send_immediate(insns)
+        return True
 
-    def flash(self):
-        """Write object code to devices.
+    def flash(self, verify=True, diff=True):
+        """Write object code to devices.  The work is done a burst at a time by idle_func().
 
+        If diff, only the flash pages which differ from what the devices hold are programmed: going by
+        flash_store if it knows what was last programmed to this bus, else by reading back every page first.
+        If verify, the pages programmed are then read back from each device and compared with the image.
+        The outcome is reported by gui.flash_done(), and summarized in flash_result.
         """
         if not self.can_flash():
             return False
-        self.flash_addr = 0
+        key = self._flash_key()
+        known = self.flash_store.get(key) if diff else False
+        axes = [d.axisnum for d in self.devs if d is not None]
+        self.flash_job = FlashJob(self.code.get_flash_blocks(PAGE_INSNS), known, axes, verify)
+        self.flash_job.started = time.perf_counter()
+        self.flash_job.bytes_tx = self.stats.bytes_tx
+        self.flash_job.bytes_rx = self.stats.bytes_rx
+        # Until it is done, what the devices hold is anyone's guess
+        self.flash_store.forget(key)
+        self.flash_result = None
         self.flash_state = self.FLASH_WAIT
-        block = self.code.get_block(self.flash_addr, 64)
-        self.flash_addr += 64
-        self._send_cmd(self.CMD_FLASH, 2, self.handle_flash_resp, bindata=block)
         return True
     def cancel_flash(self):
+        self.flash_job = None
         self.flash_state = self.FLASH_WAIT_CAN
         self._send_cmd(self.CMD_ENDFLASH, 2, self.handle_flash_can_resp)
 
-    def handle_flash_resp(self, x):
-        self.log_resp(x, "flash")
-        if not len(x):
+    def is_flashing(self):
+        return self.flash_state != self.FLASH_NONE
+    def is_flashed(self):
+        """Whether the devices' flash is known to hold the loaded code (see flash_store)."""
+        if not self.assembly_valid():
+            return False
+        known = self.flash_store.get(self._flash_key())
+        return known is not None and known == [page_hash(b) for b in self.code.get_flash_blocks(PAGE_INSNS)]
+    def run_flash(self, addr=0):
+        """Start the devices running the program in their flash from addr, on their own.  No insns are sent: the
+        status is just monitored until the devices stop at the end of the program (see _check_flash_run()).
+        The loaded code should be what is in flash (see is_flashed()), since it is used to find the end.
+        """
+        if not self.can_step():
+            return False
+        self.wait_rdy = False
+        self.inst_done = False
+        self.send_next_command = False
+        self.stepping = Devices.RUN_FLASH
+        self._send_pgm_ctr(addr)
+        self._send_resume()
+        self.state = Devices.RUNNING
+        return True
+    def _check_flash_run(self):
+        """Status update while running from flash: the program has finished once every device has reached the
+        terminator at the end of the program (or the end of a linked program, see Code.link()), and is idle.
+        """
+        if self.state != Devices.RUNNING:
+            return
+        for d in self.devs:
+            if d is not None and (d.is_busy() or not self.code.is_end_at(d.pc)):
+                return
+        if self.addr < self.code.get_obj_len():
+            # Held at the end of a linked program (see EndInsn)
+            self._send_stop()
+        self.stepping = Devices.STOPPED
+        self.state = Devices.READY
+
+    def _flash_key(self):
+        return (stable_port_path(self.devname or ""), "".join([d.axisname for d in self.devs if d is not None]))
+
+    def _flash_burst(self):
+        """Carry on with the flash job for up to FLASH_BURST_TIME."""
+        job = self.flash_job
+        if job is None or self.flash_state != self.FLASH_WAIT:
+            # Cancelled (e.g. by estop)
+            self.flash_job = None
+            if self.flash_state == self.FLASH_WAIT:
+                self.flash_state = self.FLASH_NONE
             return
-        if x == 'PP':
-            self.flash_continue()
-        elif x.startswith('E'.encode('ASCII')):
-            self.flash_complete()
-        else:  # Don't get this any more.  Error reported in status bit.
-            self.flash_fail()
+        t0 = time.perf_counter()
+        while job.phase != FlashJob.DONE and time.perf_counter() - t0 < self.FLASH_BURST_TIME:
+            if not self._flash_step(job) or self.flash_job is not job:
+                return
+        if job.phase == FlashJob.WRITE:
+            done, total = job.written, len(job.changed)
+        elif job.phase == FlashJob.COMPARE:
+            done, total = job.compared, job.compared + len(job.checks)
+        else:
+            done, total = job.verified, job.verified + len(job.checks)
+        self.gui_data.actions.append(lambda gui: gui.set_flash_progress(done*PAGE_INSNS, total*PAGE_INSNS))
+        if job.phase == FlashJob.DONE:
+            self._flash_finish(job)
+
+    def _flash_step(self, job):
+        """Do one page of the flash job: program it, or read it back.  Returns False if the job failed."""
+        if job.phase == FlashJob.WRITE:
+            nxt = job.next_page()
+            if nxt is None:
+                return True
+            page, first, last = nxt
+            block = job.blocks[page]
+            if first:
+                # Flash programming starts at page 0, unless told otherwise
+                if page or job.page_moved:
+                    self._send_cmd(self.CMD_SETPAGE, 0, packfmt="H", args=(page,))
+                self._send_cmd(self.CMD_FLASH, 0, bindata=block)
+            else:
+                # Programming continues with the next page, once the devices have replied to the last
+                with self.write_lock:
+                    self._write(block)
+            job.written += 1
+            x = self._flash_reply()
+            if job.is_last_page(page):
+                ok = x.startswith(b'E')
+            else:
+                ok = (x == b'PP')
+                if ok and last:
+                    # End of a run of changed pages: leave programming mode, as cancel_flash() does
+                    self._send_cmd(self.CMD_ENDFLASH, 0)
+                    self._flash_reply()
+            if not ok and self.f is not None:
+                self.flash_fail("No programming response for page %d (got %s)" % (page, hexbytes(x) or "nothing"))
+                return False
+        else:
+            page, axis = job.checks.popleft()
+            data = self._flash_read_page(page, axis)
+            job.page_moved = True
+            if len(data) < PAGE_BYTES and self.f is not None:
+                self.flash_fail("No readback data for page %d from axis %s" % (page, "XYZW"[axis]))
+                return False
+            if job.phase == FlashJob.COMPARE:
+                job.compare_result(page, data)
+            else:
+                job.verify_result(page, axis, data)
+        if self.f is None:
+            # Lost the port
+            self.flash_job = None
+            return False
+        return True
+
+    def _flash_reply(self):
+        """Wait for the devices' 2-byte reply to a flash page (or the end of programming)."""
+        t0 = time.perf_counter()
+        x = self._read(2, self.FLASH_TIMEOUT) if self.f is not None else b""
+        self.stats.record_expect("flash", time.perf_counter() - t0, 2, len(x))
+        self.log_resp(x, "flash")
+        return x
+
+    def _flash_read_page(self, page, axis_num):
+        data = []
+        self._send_cmd(self.CMD_SETPAGE, 0, packfmt="H", args=(page,))
+        self._send_cmd(self.CMD_READBACK + (axis_num<<8), PAGE_BYTES, data.append)
+        return data[0] if data else b""
+
+    def _flash_finish(self, job):
+        result = job.result()
+        result['seconds'] = time.perf_counter() - job.started
+        result['bytes_tx'] = self.stats.bytes_tx - job.bytes_tx
+        result['bytes_rx'] = self.stats.bytes_rx - job.bytes_rx
+        self.flash_result = result
+        if result['verify_errors']:
+            self.flash_fail("Verify failed: %s" % ", ".join(["page %d on axis %s" % (p, "XYZW"[a])
+                                                              for p, a in result['verify_errors']]))
+        else:
+            self.flash_store.put(self._flash_key(), job.hashes)
+            self.flash_complete("Programming complete (%d of %d pages written, %.2f s)." %
+                                (result['written'], result['pages'], result['seconds']))
+
     def handle_flash_readback(self, x):
         self.log_resp(x, "readback")    # For now, just log.
     def handle_flash_can_resp(self, x):
@@ -1018,29 +1600,23 @@ class RS485Devices(Devices):
             return
         self.flash_state = self.FLASH_NONE
 
-    def flash_continue(self):
-        # Got 'PP' response.  Send next 256 bytes (64 locations), padding if necessary with GOTO 0.
-        self.gui_data.actions.append(lambda gui: gui.set_flash_progress(self.flash_addr, self.code.get_obj_len()))
-        if self.flash_addr >= self.code.get_obj_len():
-            print("flash sending EOF")
-            self.flash_state = self.FLASH_WAIT
-            self._send_cmd(self.CMD_ENDFLASH, 2, self.handle_flash_resp)
-        else:
-            print("flash sending block addr", self.flash_addr)
-            block = self.code.get_block(self.flash_addr, 64)
-            self.flash_addr += 64
-            self.flash_state = self.FLASH_WAIT
-            #time.sleep(0.003)   # Give a little extra time for all flashes to write (after rx 'P')
-            self.f.write(block)
-            self.flash_write_time = time.time()
-    def flash_complete(self):
-        print("flash complete")
-        self.gui_data.actions.append(lambda gui: gui.flash_done("Programming complete."))
+    def flash_complete(self, msg="Programming complete."):
+        self._log("flash complete: %s", msg)
+        self.gui_data.actions.append(lambda gui: gui.flash_done(msg))
+        self.flash_job = None
         self.flash_state = self.FLASH_NONE
-    def flash_fail(self):
-        print("flash fail")
-        self.gui_data.actions.append(lambda gui: gui.flash_done("Programming error encountered."))
+        self._notify_status()
+    def flash_fail(self, why=None):
+        self._log("flash fail: %s", why)
+        if self.flash_job is not None and self.flash_result is None:
+            self.flash_result = self.flash_job.result()
+        if self.flash_result is not None:
+            self.flash_result['error'] = why
+        msg = "Programming error encountered." if why is None else "Programming error encountered:\n" + why
+        self.gui_data.actions.append(lambda gui: gui.flash_done(msg))
+        self.flash_job = None
         self.flash_state = self.FLASH_NONE
+        self._notify_status()
 
     def input_sim_update(self, mask):
         self.new_insim_state = mask
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Finding which serial port has which motor controllers on it.
+
+discover_buses() probes every candidate port at once, each on its own thread, with one discovery query
+(the same 42-byte qlong RS485Devices sends on connecting) and a short timeout, so finding the buses on a
+host with many USB-serial adapters takes about one timeout however many ports there are:
+
+    for bus in discover_buses():
+        print(bus.port, bus.identity(), bus.rtt)
+
+Results are cached.  On Linux, the cache is kept for as long as the adapters listed under /dev/serial/by-id
+(and the ports they point to) stay the same, so plugging in, unplugging or re-enumerating an adapter makes
+the next call probe again (elsewhere, it is kept for as long as the list of ports stays the same).  Ports
+where nothing answered are probed again each time, since their devices may just not have been powered yet.
+
+Probing writes to the port, so don't probe a port which another program is using (see exclude).
+
+A bus can be identified by its axes, e.g. "axes:XY" for the bus with axes X and Y (see find_bus()), which
+GeckoDriver.connect() accepts in place of a port name.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import os
+import struct
+import sys
+import time
+
+import serial
+
+from .devices import RS485Devices, win32_enumerate_serial_ports, win32_full_port_name, have_lports
+from .framing import QlongFramer, RECORD_LEN, MASK_AXISNUM
+from .transport import open_transport, parse_tcp_url, stable_port_path, BY_ID_DIR
+
+if have_lports:
+    import serial.tools.list_ports as lports
+
+
+PROBE_TIMEOUT = 0.05    # Seconds to wait for a discovery response (the usual response timeout)
+GAP_TIMEOUT = 0.003     # Seconds of silence after which a response is taken to have ended
+MAX_WORKERS = 32        # Ports probed at once
+AXIS_PREFIX = "axes:"
+
+
+class BusInfo(object):
+    """What was found on one port."""
+    __slots__ = ('port', 'stable_port', 'axes', 'pcs', 'rtt', 'error', 'probe_time')
+
+    def __init__(self, port, stable_port, axes=(), pcs=(), rtt=None, error=None, probe_time=None):
+        self.port = port                # Port name as listed
+        self.stable_port = stable_port  # Name which finds the same adapter again (see transport.stable_port_path())
+        self.axes = axes                # Axis names which answered, e.g. "XY"
+        self.pcs = pcs                  # Program counter of each axis in axes
+        self.rtt = rtt                  # Seconds from sending the query to the first byte of the response
+        self.error = error              # Why the port could not be probed, if it couldn't
+        self.probe_time = probe_time    # time.time() of the probe
+
+    def is_responsive(self):
+        """Whether any controllers answered on this port."""
+        return bool(self.axes)
+
+    def identity(self):
+        """Name of this bus by its axes, for find_bus() or GeckoDriver.connect(); None if nothing answered."""
+        return AXIS_PREFIX + self.axes if self.axes else None
+
+    def __repr__(self):
+        if self.error is not None:
+            return "BusInfo(%r, error=%r)" % (self.port, self.error)
+        return "BusInfo(%r, axes=%r, rtt=%s)" % (self.port, self.axes,
+                                                 "%.1f ms" % (self.rtt * 1000.) if self.rtt is not None else None)
+
+
+def candidate_ports():
+    """Return the names of the serial ports on this system (as for RS485Devices.get_serport_list())."""
+    try:
+        if have_lports:
+            return [p[0] for p in lports.comports()]
+        elif sys.platform == 'win32':
+            return [win32_full_port_name(x) for x in win32_enumerate_serial_ports()]
+        else:
+            return [os.path.join(BY_ID_DIR, x) for x in os.listdir(BY_ID_DIR)]
+    except Exception:
+        return []
+
+
+def _by_id_signature():
+    """Something which changes when USB serial adapters come, go or re-enumerate."""
+    try:
+        names = sorted(os.listdir(BY_ID_DIR))
+    except OSError:
+        return None
+    return tuple((name, os.path.realpath(os.path.join(BY_ID_DIR, name))) for name in names)
+
+
+def probe_port(port, timeout=PROBE_TIMEOUT):
+    """Send a discovery query on port, and return a BusInfo of what answered."""
+    info = BusInfo(port, stable_port_path(port), "", (), probe_time=time.time())
+    try:
+        f = open_transport(port)
+    except (serial.SerialException, OSError, ValueError) as ex:
+        info.error = str(ex)
+        return info
+    try:
+        f.read(256, 0.)     # Discard anything left over from before
+        f.write(struct.pack("<H", RS485Devices.CMD_QLONG))
+        f.flush()
+        t0 = time.perf_counter()
+        x = f.read(1, timeout)
+        if x:
+            info.rtt = time.perf_counter() - t0
+            # Up to 2 sync bytes and 4 records, but there is no telling how many axes there are, so rather than
+            # waiting out the timeout for the longest response, stop once the bytes stop coming
+            want = 2 + 4 * RECORD_LEN
+            while len(x) < want:
+                more = f.read(want - len(x), GAP_TIMEOUT)
+                if not more:
+                    break
+                x += more
+        x = QlongFramer().frame(x, None, time.monotonic())[0]
+        axes = []
+        pcs = []
+        for n in range(0, len(x), RECORD_LEN):
+            flg, pc = struct.unpack("<HH", x[n:n+4])
+            name = "XYZW"[flg & MASK_AXISNUM]
+            if name not in axes:
+                axes.append(name)
+                pcs.append(pc)
+        order = sorted(range(len(axes)), key=lambda i: axes[i])
+        info.axes = "".join([axes[i] for i in order])
+        info.pcs = tuple([pcs[i] for i in order])
+    except (serial.SerialException, OSError, ValueError) as ex:
+        info.error = str(ex)
+    finally:
+        f.close()
+    return info
+
+
+_cache_lock = Lock()
+_cache = {}                 # stable port name -> BusInfo
+_cache_signature = None
+
+
+def discover_buses(ports=None, timeout=PROBE_TIMEOUT, refresh=False, exclude=()):
+    """Probe ports (default: all candidate_ports()) concurrently, and return a list of BusInfo, one per port (ports
+    which are different names for the same adapter are probed once).  Cached results are used for ports which
+    answered last time, unless refresh is true or the adapters have changed since (see above).  Ports in exclude
+    (e.g. ones already in use) are not probed, or returned.
+    """
+    global _cache_signature
+    if ports is None:
+        ports = candidate_ports()
+    excluded = set(stable_port_path(p) for p in exclude)
+    wanted = []
+    seen = set()
+    for port in ports:
+        stable = stable_port_path(port)
+        if stable not in seen and stable not in excluded:
+            seen.add(stable)
+            wanted.append((port, stable))
+
+    signature = _by_id_signature() or tuple(sorted(ports))
+    with _cache_lock:
+        if refresh or signature != _cache_signature:
+            _cache.clear()
+            _cache_signature = signature
+        cached = dict(_cache)
+
+    results = {}
+    to_probe = []
+    for port, stable in wanted:
+        info = cached.get(stable)
+        if info is not None and info.is_responsive() and parse_tcp_url(port) is None:
+            results[stable] = info
+        else:
+            to_probe.append(port)
+    if to_probe:
+        with ThreadPoolExecutor(max_workers=min(len(to_probe), MAX_WORKERS)) as pool:
+            for info in pool.map(lambda p: probe_port(p, timeout), to_probe):
+                results[info.stable_port] = info
+        with _cache_lock:
+            if _cache_signature == signature:
+                for stable in results:
+                    _cache[stable] = results[stable]
+    return [results[stable] for port, stable in wanted if stable in results]
+
+
+def find_bus(identity, ports=None, timeout=PROBE_TIMEOUT, exclude=()):
+    """Return the BusInfo of the bus with the given identity: "axes:XY" for the bus whose axes are exactly X and Y.
+    Returns None if no bus matches.  Raises ValueError if more than one does.
+    """
+    if not identity.startswith(AXIS_PREFIX):
+        raise ValueError("%s: expected %s followed by axis names" % (identity, AXIS_PREFIX))
+    axes = "".join(sorted(identity[len(AXIS_PREFIX):].upper()))
+    for refresh in (False, True):
+        found = [info for info in discover_buses(ports, timeout, refresh, exclude) if info.axes == axes]
+        if len(found) > 1:
+            raise ValueError("%s matches %d buses: %s" % (identity, len(found), ", ".join([i.port for i in found])))
+        if found:
+            return found[0]
+    return None
+
+
+def clear_cache():
+    """Forget all cached results."""
+    global _cache_signature
+    with _cache_lock:
+        _cache.clear()
+        _cache_signature = None
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Out-of-process comms engine (see GeckoDriver(out_of_process=True)).
+
+The engine is a child process running an ordinary in-process GeckoDriver, so the comms thread's timing
+does not depend on what the application's threads are doing with the GIL.  The application's GeckoDriver
+forwards calls to it over a pipe (each request is run on its own thread in the engine, so blocking calls
+do not hold up others), and the engine publishes device status after every tick in a shared memory
+StatusBlock, which the application side reads into a RemoteDevices object so that the status getters
+and wait functions work unchanged.  Device events, job progress, watchdog trips and link recoveries are
+forwarded over the pipe too.
+"""
+from collections import deque
+from threading import Thread, Lock, Event
+import multiprocessing
+import traceback
+
+from .devices import Devices, Device
+from .events import DeviceEvent
+from .statusblock import StatusBlock
+from . import asynclog
+
+
+class EngineError(Exception): pass
+
+
+class RemoteDevices(Devices):
+    """Stand-in for the Devices object on the application side of an out-of-process GeckoDriver.  It just
+    holds the status most recently published by the engine.
+    """
+    def __init__(self):
+        super(RemoteDevices, self).__init__()
+        self._state = Devices.DISCONNECTED
+        self.connected = False
+
+    def update(self, snap):
+        self._state = snap.state
+        self.stepping = snap.stepping
+        self._n_devs = snap.n_devs
+        self.addr = snap.addr
+        self.program_id = snap.program_id
+        self.connected = snap.connected
+        for n, axis in enumerate(snap.axes):
+            if axis is None:
+                self.devs[n] = None
+                continue
+            d = self.devs[n]
+            if d is None:
+                d = self.devs[n] = Device("XYZW"[n], n)
+            d.flags, d.pc, d.pos, d.vel, d.offset = axis
+        self._notify_status()
+
+
+class EngineClient(object):
+    """Application side of the engine: starts the engine process, and passes calls and results to and fro."""
+
+    def __init__(self, driver, log_file, simulate, realtime):
+        self.driver = driver
+        self.devices = RemoteDevices()
+        self.block = StatusBlock(create=True)
+        if isinstance(log_file, str) or log_file is None:
+            log_path = log_file
+        else:
+            log_path = getattr(log_file, "name", None)  # Open file: the engine appends to it by name
+        # Not fork: the application may have other threads (holding locks which the engine would inherit held).  A
+        # forkserver is forked early from a clean, single-threaded process, so the engine starts faster than spawned.
+        ctx = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                                          else "spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_engine_main, name="geckomoped-engine",
+                                   args=(child_conn, self.block.name, log_path, simulate, realtime))
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close()
+        self._send_lock = Lock()
+        self._pending = {}      # request id -> [Event, ok, result]
+        self._next_id = 0
+        self._jobs = {}         # engine job id -> GMJob
+        self._closed = False
+        self._receiver = Thread(target=self._receive_loop)
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    def _send(self, msg):
+        with self._send_lock:
+            self.conn.send(msg)
+
+    def call(self, name, args=(), kwargs={}):
+        """Call GeckoDriver method name in the engine, and return its result (or raise its exception)."""
+        if self._closed:
+            raise EngineError("Comms engine has shut down")
+        slot = [Event(), False, None]
+        with self._send_lock:
+            self._next_id += 1
+            req = self._next_id
+            self._pending[req] = slot
+            self.conn.send(('call', req, name, args, kwargs))
+        while not slot[0].wait(.1):     # (not just wait(), so that KeyboardInterrupt gets through)
+            if self._closed:
+                raise EngineError("Comms engine has shut down")
+        if slot[1]:
+            return slot[2]
+        raise slot[2]
+
+    def queue_job(self, job):
+        with self._send_lock:
+            self._next_id += 1
+            job_id = self._next_id
+        self._jobs[job_id] = job    # (before the engine can report any progress)
+        try:
+            self.call('_engine_queue_job', (job_id, job.program))
+        except Exception:
+            del self._jobs[job_id]
+            raise
+        return job
+
+    def _receive_loop(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            try:
+                self._handle(msg)
+            except Exception:
+                traceback.print_exc()
+        self._closed = True
+        for slot in list(self._pending.values()):
+            slot[1] = False
+            slot[2] = EngineError("Comms engine has shut down")
+            slot[0].set()
+
+    def _handle(self, msg):
+        kind = msg[0]
+        drv = self.driver
+        if kind == 'status':
+            snap = self.block.read()
+            if snap is not None:
+                drv._connected = snap.connected
+                self.devices.update(snap)
+            if drv.serial_update_callback is not None:
+                drv.serial_update_callback()
+        elif kind == 'reply':
+            _, req, ok, result = msg
+            slot = self._pending.pop(req, None)
+            if slot is not None:
+                slot[1] = ok
+                slot[2] = result
+                slot[0].set()
+        elif kind == 'event':
+            drv._event_queue.put(DeviceEvent(*msg[1:]))
+        elif kind == 'job':
+            _, job_id, status, error, start_time, end_time = msg
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.status = status
+                job.error = error
+                job.start_time = start_time
+                job.end_time = end_time
+                if status in (job.DONE, job.FAILED, job.CANCELLED):
+                    del self._jobs[job_id]
+                    job._finished.set()
+        elif kind == 'watchdog':
+            if drv._watchdog_callback is not None:
+                drv._watchdog_callback(msg[1])
+        elif kind == 'reconnect':
+            drv.last_recovery = msg[1]
+            if drv._reconnect_callback is not None:
+                drv._reconnect_callback(msg[1])
+
+    def shutdown(self):
+        if not self._closed:
+            try:
+                self.call('shutdown')
+            except EngineError:
+                pass
+        self.process.join(5.)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self._receiver.join(1.)
+        self.block.close()
+
+
+class _EngineServer(object):
+    """Engine side: runs requests from the application against the engine's own GeckoDriver."""
+
+    # Results which can't (or needn't) be sent back
+    NO_RESULT = ('start_metrics_server',)
+
+    def __init__(self, conn, block):
+        self.conn = conn
+        self.block = block
+        self.driver = None
+        self._outbox = deque()
+        self._wake = Event()
+        self._status_pending = False
+        self._jobs = {}         # job id -> [GMJob, last status sent]
+        self._events_forwarded = None
+        self._running = True
+        self._sender = Thread(target=self._send_loop)
+        self._sender.daemon = True
+        self._sender.start()
+
+    def post(self, msg):
+        """Queue a message for the application.  Never blocks, so is safe from the comms thread."""
+        self._outbox.append(msg)
+        self._wake.set()
+
+    def _send_loop(self):
+        while self._running or self._outbox:
+            self._wake.wait(.1)
+            self._wake.clear()
+            while self._outbox:
+                msg = self._outbox.popleft()
+                if msg is None:
+                    # Coalesced status notification (see on_tick())
+                    self._status_pending = False
+                    msg = ('status',)
+                try:
+                    self.conn.send(msg)
+                except (OSError, ValueError):
+                    self._running = False
+                    self._outbox.clear()
+                    return
+                except Exception as ex:
+                    # Couldn't pickle it
+                    if msg[0] == 'reply':
+                        self.conn.send(('reply', msg[1], False, EngineError("Unsendable result: %s" % ex)))
+
+    def on_tick(self):
+        """serial_update_callback of the engine's driver: publish status after every tick."""
+        drv = self.driver
+        if drv is None:
+            return
+        self.block.write(drv.devices, drv.is_connected())
+        for job_id, entry in list(self._jobs.items()):
+            job = entry[0]
+            if job.status != entry[1]:
+                entry[1] = job.status
+                self.post(('job', job_id, job.status, job.error, job.start_time, job.end_time))
+                if job.is_finished():
+                    del self._jobs[job_id]
+        if not self._status_pending:
+            self._status_pending = True
+            self.post(None)
+
+    def _forward_event(self, ev):
+        self.post(('event', ev.kind, ev.axis, ev.n, ev.value, ev.sample_time))
+
+    def _forward_watchdog(self, lateness):
+        self.post(('watchdog', lateness))
+
+    def _forward_reconnect(self, recovery):
+        self.post(('reconnect', recovery))
+
+    # Requests handled by the engine server itself, rather than passed on to the driver
+
+    def _engine_queue_job(self, job_id, program):
+        self._jobs[job_id] = [self.driver.queue_job(program), None]
+
+    def _engine_forward_events(self, enable):
+        if enable and self._events_forwarded is None:
+            self._events_forwarded = self.driver.subscribe(self._forward_event)
+        elif not enable and self._events_forwarded is not None:
+            self.driver.unsubscribe(self._events_forwarded)
+            self._events_forwarded = None
+
+    def _engine_set_watchdog(self, threshold, forward, pause):
+        self.driver.set_watchdog(threshold, self._forward_watchdog if forward else None, pause)
+
+    def _engine_set_auto_reconnect(self, enable, initial_backoff, max_backoff, forward):
+        self.driver.set_auto_reconnect(enable, initial_backoff, max_backoff,
+                                       self._forward_reconnect if forward else None)
+
+    def _run(self, req, name, args, kwargs):
+        try:
+            if name.startswith('_engine_'):
+                result = getattr(self, name)(*args, **kwargs)
+            else:
+                result = getattr(self.driver, name)(*args, **kwargs)
+            if name in self.NO_RESULT:
+                result = None
+            self.post(('reply', req, True, result))
+        except Exception as ex:
+            self.post(('reply', req, False, ex))
+
+    def serve(self):
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                # Application has gone away: stop the motors and exit
+                self.driver.estop()
+                self.driver.shutdown()
+                break
+            _, req, name, args, kwargs = msg
+            if name == 'shutdown':
+                self.driver.shutdown()
+                self.post(('reply', req, True, None))
+                break
+            t = Thread(target=self._run, args=(req, name, args, kwargs))
+            t.daemon = True
+            t.start()
+        self._running = False
+        self._wake.set()
+        self._sender.join(2.)
+        self.block.close()
+
+
+def _engine_main(conn, block_name, log_file, simulate, realtime):
+    # (In case the forkserver inherited a log writer thread's state from whatever it imported)
+    asynclog.reset_default_log()
+    from .gm_api import GeckoDriver
+    server = _EngineServer(conn, StatusBlock(block_name))
+    server.driver = GeckoDriver(log_file, server.on_tick, simulate, realtime)
+    server.serve()
+    asynclog.default_log().flush()
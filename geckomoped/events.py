@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Device status change events.  These are generated by the comms code by comparing each status response
+with the previous one, and delivered to callbacks registered with GeckoDriver.subscribe().
+"""
+
+
+class DeviceEvent(object):
+    """A change in the status of a single device.
+
+    kind is one of the kind constants below, and axis is the axis index (0-3 for X-W).
+    n is the input or output number (1-3) for INPUT and OUTPUT events, otherwise None.
+    value is the new state:
+        INPUT, OUTPUT:  True if now on (input flags are inverted on the wire, this is not)
+        BUSY:           True if now busy, False if now ready
+        ERROR:          new error_state() bits (0 if the error cleared)
+        PC:             new program counter (X axis only, since that defines the overall PC)
+    sample_time is the time.monotonic() time at which the status response containing the change was received.
+    """
+    INPUT = "input"
+    OUTPUT = "output"
+    BUSY = "busy"
+    ERROR = "error"
+    PC = "pc"
+    KINDS = (INPUT, OUTPUT, BUSY, ERROR, PC)
+
+    __slots__ = ('kind', 'axis', 'n', 'value', 'sample_time')
+
+    def __init__(self, kind, axis, n, value, sample_time):
+        self.kind = kind
+        self.axis = axis
+        self.n = n
+        self.value = value
+        self.sample_time = sample_time
+
+    def __repr__(self):
+        return "DeviceEvent(%s, axis=%s, n=%s, value=%r, sample_time=%.6f)" % \
+            (self.kind, "XYZW"[self.axis], self.n, self.value, self.sample_time)
+
+
+# (flag bit, event kind, n, flag is inverted)
+_FLAG_BITS = (
+    (0x80, DeviceEvent.INPUT, 1, True),
+    (0x40, DeviceEvent.INPUT, 2, True),
+    (0x20, DeviceEvent.INPUT, 3, True),
+    (0x1000, DeviceEvent.OUTPUT, 1, False),
+    (0x2000, DeviceEvent.OUTPUT, 2, False),
+    (0x4000, DeviceEvent.OUTPUT, 3, False),
+    (0x04, DeviceEvent.BUSY, None, False),
+    )
+_MASK_ERROR = 0x18
+
+
+def status_events(dev, flags, pc, sample_time):
+    """Return list of DeviceEvents for the differences between dev's current flags and pc, and the newly
+    received flags and pc.  Only called when there is some difference, so this does not need to be quick.
+    """
+    events = []
+    changed = flags ^ dev.flags
+    for bit, kind, n, inverted in _FLAG_BITS:
+        if changed & bit:
+            events.append(DeviceEvent(kind, dev.axisnum, n, (flags & bit == 0) == inverted, sample_time))
+    if changed & _MASK_ERROR:
+        events.append(DeviceEvent(DeviceEvent.ERROR, dev.axisnum, None, (flags & _MASK_ERROR) >> 3, sample_time))
+    if dev.axisnum == 0 and pc != dev.pc:
+        events.append(DeviceEvent(DeviceEvent.PC, 0, None, pc, sample_time))
+    return events
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Planning of flash programming (see RS485Devices.flash()).
+
+The image is programmed in pages of 64 insns (256 bytes, see Code.get_flash_blocks()).  Rather than
+programming every page every time, a FlashJob only programs the pages which differ from what the devices
+already hold, going by either:
+
+  - the page hashes of the image last programmed to the same bus, kept by a FlashImageStore (optionally
+    in a file, so that they survive restarts); or, failing that,
+  - reading back each page from the devices and comparing it with the image.
+
+Pages to program are grouped into runs of consecutive pages, each of which is streamed in one go.  After
+programming, the pages written are read back from each device and compared with the image.
+"""
+from collections import deque
+import hashlib
+import os
+import pickle
+
+
+PAGE_INSNS = 64             # Insns per flash page
+PAGE_BYTES = 4 * PAGE_INSNS
+
+
+def page_hash(block):
+    return hashlib.blake2b(block, digest_size=8).digest()
+
+
+class FlashImageStore(object):
+    """Page hashes of the image last programmed to each bus, keyed by e.g. (port, axes).  If path is given,
+    they are kept in that file too.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.images = {}
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    self.images = pickle.load(f)
+            except Exception:
+                self.images = {}    # no file, probably
+
+    def get(self, key):
+        return self.images.get(key)
+
+    def put(self, key, hashes):
+        self.images[key] = list(hashes)
+        self._save()
+
+    def forget(self, key):
+        """Forget what is on a bus (e.g. after programming failed part way)."""
+        if self.images.pop(key, None) is not None:
+            self._save()
+
+    def _save(self):
+        if self.path is None:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(self.images, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+
+class FlashJob(object):
+    """The work of programming one image.  RS485Devices.flash() does the I/O, working through the phases:
+
+      COMPARE   read back pages (per axis) to find out which differ, when there are no stored hashes
+      WRITE     program each run of changed pages
+      VERIFY    read back the pages written (per axis) and compare them with the image
+    """
+    COMPARE = "compare"
+    WRITE = "write"
+    VERIFY = "verify"
+    DONE = "done"
+
+    def __init__(self, blocks, known, axes, verify=True):
+        """blocks is the image as from Code.get_flash_blocks().  known is the list of page hashes of what the
+        devices hold (None if unknown, in which case the pages are compared by readback from each of axes,
+        or False to program every page).
+        """
+        self.blocks = blocks
+        self.hashes = [page_hash(b) for b in blocks]
+        self.axes = axes
+        self.verify = verify
+        self.changed = set()
+        self.runs = deque()
+        self.run = None             # [next page, last page] of the run being programmed
+        self.checks = deque()       # (page, axis) to read back in COMPARE or VERIFY
+        self.page_moved = False     # Whether a readback has moved the devices' page pointer
+        self.written = 0
+        self.compared = 0
+        self.verified = 0
+        self.verify_errors = []
+        if known is None:
+            # The last page is usually a part page, so just program it rather than comparing it
+            self.checks.extend((p, a) for p in range(len(blocks)) for a in axes
+                               if len(blocks[p]) >= PAGE_BYTES)
+            self.changed.update(p for p in range(len(blocks)) if len(blocks[p]) < PAGE_BYTES)
+            self.phase = self.COMPARE
+            if not self.checks:
+                self._start_write()
+        else:
+            for p in range(len(blocks)):
+                if not known or p >= len(known) or known[p] != self.hashes[p]:
+                    self.changed.add(p)
+            self._start_write()
+
+    def page_differs(self, page, data):
+        """Whether data read back from page differs from the image.  Only the insns of a part page are compared."""
+        block = self.blocks[page]
+        n = len(block) if len(block) >= PAGE_BYTES else len(block) - 2
+        return data[:n] != block[:n]
+
+    def compare_result(self, page, data):
+        self.compared += 1
+        if self.page_differs(page, data):
+            self.changed.add(page)
+        if not self.checks:
+            self._start_write()
+
+    def _start_write(self):
+        pages = sorted(self.changed)
+        runs = []
+        for p in pages:
+            if runs and runs[-1][1] == p - 1:
+                runs[-1][1] = p
+            else:
+                runs.append([p, p])
+        self.runs = deque(runs)
+        self.phase = self.WRITE
+        if not runs:
+            self.phase = self.DONE
+
+    def next_page(self):
+        """Return (page, first, last): the next page to program, whether it starts a run and whether it ends one.
+        Returns None once all runs are done (and moves on to VERIFY).
+        """
+        first = False
+        if self.run is None:
+            if not self.runs:
+                self._start_verify()
+                return None
+            self.run = self.runs.popleft()
+            first = True
+        page, last = self.run
+        if page == last:
+            self.run = None
+        else:
+            self.run[0] += 1
+        return page, first, page == last
+
+    def _start_verify(self):
+        if self.verify:
+            self.checks.extend((p, a) for p in sorted(self.changed) for a in self.axes
+                               if len(self.blocks[p]) > 2)
+        self.phase = self.VERIFY if self.checks else self.DONE
+
+    def verify_result(self, page, axis, data):
+        self.verified += 1
+        if self.page_differs(page, data):
+            self.verify_errors.append((page, axis))
+        if not self.checks:
+            self.phase = self.DONE
+
+    def is_last_page(self, page):
+        """Whether page is the one ending with the terminator, which ends programming."""
+        return page == len(self.blocks) - 1
+
+    def result(self):
+        return {
+            'pages': len(self.blocks),
+            'written': self.written,
+            'skipped': len(self.blocks) - self.written,
+            'compared': self.compared,
+            'verified': self.verified,
+            'verify_errors': list(self.verify_errors),
+            }
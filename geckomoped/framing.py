@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Framing of query-long responses (see RS485Devices.handle_qlong()).
+
+A qlong response is one or two sync bytes, then a 10-byte record from each device on the bus:
+
+    <HHIH   flags, pc, position (in the top 24 bits), velocity (sign-magnitude)
+
+The response has no checksum, so a dropped, extra or corrupted byte has to be detected from the records
+themselves.  QlongFramer checks each record structurally against what is known about the bus: the axis
+number must be one of the known devices, and appear only once; the position must not have moved further
+than the axis could have travelled since its last good record; and the pc must lie within the loaded
+program.  A value which fails the check is accepted if it is seen again in the next response for that
+axis, since a real jump (e.g. the position being zeroed) persists, where corruption does not.
+
+When the records do not all check out at the usual alignment (counting back from the end of the
+response), the framer scans for the next record boundary which does, and carries on from there, rather
+than throwing the whole response away.
+"""
+import struct
+
+
+RECORD = struct.Struct("<HHIH")
+RECORD_LEN = RECORD.size
+MASK_AXISNUM = 0x03
+
+_POS_MOD = 1 << 24
+
+
+class QlongFramer(object):
+    """Validates and realigns qlong responses for one bus."""
+
+    POS_SLEW = 500000.  # Max plausible speed of any axis, in steps per second
+    POS_SLACK = 256     # Steps of movement always allowed, however short the interval
+    PC_SLACK = 2        # Addresses past the end of the program which the pc may plausibly reach
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget the axes' last known positions (e.g. after re-discovering the bus)."""
+        self.last = [None] * 4          # Per axis: (time, pos) of the last accepted record
+        self.rejected = [None] * 4      # Per axis: (pos, pc, response number) of the last rejected record
+        self.responses = 0
+
+    def _check(self, rec, devs, now, pc_limit, aligned, allow_new):
+        """Return axis number if the record is plausible, else None.  aligned is false when scanning for a
+        record boundary, in which case failures are not remembered (since the bytes between the real records
+        of an idle bus repeat too).  allow_new allows an axis which is not in devs.
+        """
+        flg, pc, pos, vel = RECORD.unpack(rec)
+        axis = flg & MASK_AXISNUM
+        if devs is not None and devs[axis] is None:
+            # A newly attached device, if everything else lines up
+            return axis if allow_new else None
+        pos = pos >> 8 & 0xFFFFFF
+        rejected = self.rejected[axis]
+        if rejected is not None and rejected[:2] == (pos, pc) and rejected[2] != self.responses:
+            return axis     # Same again in a later response, so believe it
+        ok = True
+        last = self.last[axis]
+        if last is not None:
+            delta = (pos - last[1] + _POS_MOD // 2) % _POS_MOD - _POS_MOD // 2
+            if abs(delta) > self.POS_SLEW * (now - last[0]) + self.POS_SLACK:
+                ok = False
+        if pc_limit and pc > pc_limit + self.PC_SLACK:
+            ok = False
+        if not ok:
+            if aligned:
+                self.rejected[axis] = (pos, pc, self.responses)
+            return None
+        return axis
+
+    def _accept(self, rec, axis, now):
+        self.rejected[axis] = None
+        self.last[axis] = (now, RECORD.unpack(rec)[2] >> 8 & 0xFFFFFF)
+
+    def frame(self, x, devs, now, expected=None, pc_limit=None):
+        """Return (data, repaired): the plausible records in response x, concatenated, and whether any bytes had
+        to be skipped or records dropped to get them.
+
+        devs is the list of known Devices (by axis number), or None while discovering the bus, in which case
+        any axis is allowed and the records are only taken at the usual alignment.  expected is the number of
+        records expected (None if unknown).  now is the time (seconds) at which x was received, and pc_limit
+        the length of the loaded program (None or 0 if there isn't one).
+        """
+        self.responses += 1
+        n = len(x)
+        start = n % RECORD_LEN
+
+        # Usual case: everything lines up from the end of the response.  An unknown axis is only believed if
+        # there is an extra record for it.
+        allow_new = devs is None or (expected is not None and n // RECORD_LEN > expected)
+        seen = 0
+        good = []
+        for i in range(start, n, RECORD_LEN):
+            rec = x[i:i+RECORD_LEN]
+            axis = self._check(rec, devs, now, pc_limit, True, allow_new)
+            if axis is None or seen & (1 << axis):
+                break
+            seen |= 1 << axis
+            good.append((rec, axis))
+        else:
+            if devs is None or expected is None or len(good) >= expected:
+                for rec, axis in good:
+                    self._accept(rec, axis, now)
+                return b"".join([rec for rec, axis in good]), False
+        if devs is None:
+            # Discovering: no basis for realigning, so take what checked out
+            for rec, axis in good:
+                self._accept(rec, axis, now)
+            return b"".join([rec for rec, axis in good]), True
+
+        # Scan for plausible records at any alignment, resynchronizing after anything which isn't
+        seen = 0
+        out = []
+        i = 0
+        while i + RECORD_LEN <= n:
+            rec = x[i:i+RECORD_LEN]
+            axis = self._check(rec, devs, now, pc_limit, False, False)
+            if axis is not None and not seen & (1 << axis):
+                seen |= 1 << axis
+                self._accept(rec, axis, now)
+                out.append(rec)
+                i += RECORD_LEN
+            else:
+                i += 1
+        return b"".join(out), True
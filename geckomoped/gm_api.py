@@ -1,6 +1,17 @@
 from .devices import Devices, RS485Devices
+from .assemble import CodeError
 from .mockui import MockUI, MockTab, PersistentProject, Persistent
-from threading import Thread, Lock
+from .events import DeviceEvent
+from .stats import CommsStats
+from .scheduler import TickScheduler, raise_thread_priority
+from .transport import stable_port_path
+from .flashing import FlashImageStore
+from .streaming import SpeedStream
+from . import discovery
+from threading import Thread, Lock, Condition, Event
+from collections import deque
+import functools
+import queue
 import time
 import traceback
 
@@ -9,21 +20,75 @@ class GMCompileException(Exception): pass
 # thrown when state-controlling functions are called at invalid times
 class GMInvalidStateException(Exception): pass
 
+# thrown when programming the controllers' flash fails
+class GMFlashException(Exception): pass
+
+def _engine_call(method):
+    """ Decorator for GeckoDriver methods which need the devices (rather than just their status).  When the driver is
+    running out of process, calls are passed on to the engine process, which runs them on its own GeckoDriver. """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._engine is not None:
+            return self._engine.call(method.__name__, args, kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+class GMJob(object):
+    """ Handle for a program queued with GeckoDriver.queue_job(). """
+
+    QUEUED = "queued"       # waiting to be compiled
+    COMPILED = "compiled"   # compiled, waiting for the previous job to finish
+    RUNNING = "running"
+    DONE = "done"           # ran to the end of the program
+    FAILED = "failed"       # did not compile, or halted on an error; error holds the message
+    CANCELLED = "cancelled" # dropped from the queue by clear_jobs(), or stopped by stop() or estop()
+
+    def __init__(self, program:str):
+        self.program = program
+        self.status = GMJob.QUEUED
+        self.error = None
+        self.queue_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self._code = None
+        self._tab = None
+        self._stopped = False   # set by stop() or estop() while running
+        self._finished = Event()
+
+    def is_finished(self):
+        """ Returns true once the job has run to completion, failed to compile, or been cancelled. """
+        return self._finished.is_set()
+
+    def wait(self, timeout:float=None):
+        """ Blocks until the job is finished (see is_finished()).  Returns false if the timeout expired first. """
+        return self._finished.wait(timeout)
+
 class GeckoDriver(object):
 
     # serial_update_callback should be
     # Use it to address new motor controller state info in your function.
-    def __init__(self, log_file:str, serial_update_callback:callable, simulate=False):
+    def __init__(self, log_file:str, serial_update_callback:callable, simulate=False, realtime=False, out_of_process=False):
         """
         Create a GeckoMoped API motor controller driver.
-        :param log_file: File path to send the driver's debug output to.  If it is None, no output will be printed.
+        :param log_file: File path (or open text file) to send the driver's debug output to.  If it is None, no output will be printed.
         :param serial_update_callback: A no-argument function that will be called immediately after the serial tick function.  If it is None, no callback will be issued.
         :param simulate: If true, then a simulated motor controller object will be created.
+        :param realtime: If true, the serial comms thread tries to raise its own scheduling priority (real-time if permitted, else
+        a lower nice value).  Linux only; needs root, CAP_SYS_NICE or a suitable RLIMIT_RTPRIO/RLIMIT_NICE to have any effect.
+        :param out_of_process: If true, the devices and serial comms thread run in a separate engine process, so their timing is
+        not affected by other Python threads in this process holding the GIL.  The API is the same, except that callbacks are
+        called in a thread of this process which relays them from the engine.  The engine is started with a forkserver
+        (or spawned, where there is none), so the main module must be import-safe (i.e. use an 'if __name__ == "__main__":'
+        guard).
         """
 
         self.simulate = simulate
+        self._engine = None
 
         # create mock objects
+        if isinstance(log_file, str):
+            log_file = open(log_file, "a")
         self.mockui = MockUI()
         self.mockui.log_file = log_file
         self.mocktab = MockTab()
@@ -32,13 +97,66 @@ class GeckoDriver(object):
         self.gm_project_prefs = PersistentProject(None, self.gm_global_prefs)
 
         # create GeckoMotion devices object
-        if simulate:
+        if out_of_process:
+            # The real one is in the engine process.  This one just holds the status it publishes.
+            from .engine import EngineClient
+            self._engine = EngineClient(self, log_file, simulate, realtime)
+            self.devices = self._engine.devices
+        elif simulate:
             # "abstract" base class
             self.devices = Devices()
         else:
             self.devices = RS485Devices()
         self.devices.set_ui(self.mockui)
 
+        # job queue (see queue_job())
+        self._jobs = deque()            # queued GMJobs, oldest first
+        self._current_job = None        # GMJob which is running
+        self._job_cond = Condition()    # guards the above; signals the compile thread
+        self._job_compile_thread = None
+        self._jobs_completed = 0
+        self._last_job_end = None
+        self._job_gaps = []             # seconds between each job finishing and the next one starting
+
+        # event subscriptions (see subscribe())
+        self._subscribers = []          # (callback, kinds, axis); replaced rather than modified, so no lock needed to read it
+        self._subscribe_lock = Lock()
+        self._event_queue = queue.Queue()
+        self._event_thread = None
+        self._event_count = 0
+        self._event_latency_sum = 0.
+        self._event_latency_max = 0.
+
+        self._metrics_server = None
+        self._status_block = None       # see publish_status()
+
+        # speed streams (see stream_speed())
+        self._streams = {}              # axis index -> SpeedStream; replaced rather than modified
+        self._stream_samplers = {}      # axis index -> Event which stops the thread sampling its source
+
+        # status polling while running from flash (see run_from_flash())
+        self._flash_poll_interval = .1
+        self._next_flash_poll = 0.
+
+        # comms tick scheduling (see set_watchdog())
+        self._scheduler = TickScheduler(.02)
+        self.devices.idle_period = self._scheduler.period   # (sizes bursts of instant insns)
+        self._scheduler.watchdog = self._watchdog
+        self._watchdog_callback = None
+        self._watchdog_pause = False
+        self._realtime = realtime
+        self.realtime_priority = None   # description of the priority the comms thread got, if realtime
+
+        # reconnection after the link is lost (see set_auto_reconnect())
+        self._auto_reconnect = False    # opt-in: an unattended machine shouldn't carry on by itself
+        self._reconnect_backoff = (.1, 5.)
+        self._reconnect_callback = None
+        self._reconnect_path = None     # port name which finds the same adapter if it re-enumerates
+        self._reconnect_delay = 0.
+        self._next_reconnect = 0.
+        self._reconnect_attempts = 0
+        self.last_recovery = None       # result of the most recent recovery (see set_auto_reconnect())
+
         # create thread
         self.geckomotion_serial_thread = Thread(target=self.internal_serial_thread)
         self.geckomotion_serial_thread.daemon = False
@@ -48,28 +166,60 @@ class GeckoDriver(object):
         self.serial_thread_shutdown_signal = False
         self.serial_update_callback = serial_update_callback
 
-        self.geckomotion_serial_thread.start()
-
         # state variables
         self._connected = False
 
+        if self._engine is None:
+            self.geckomotion_serial_thread.start()
 
+
+    @_engine_call
     def get_serialports(self):
         """ Returns a list of serial port names that exist on the system.
         Pass one of these toconnect()."""
 
-        return (port[0] for port in self.devices.get_serport_list())
+        return [port[0] for port in self.devices.get_serport_list()]
+
+    @_engine_call
+    def discover_buses(self, refresh:bool=False, timeout:float=discovery.PROBE_TIMEOUT):
+        """ Probes all serial ports at once for motor controllers, and returns a list of discovery.BusInfo, one per port,
+        giving which axes answered there (e.g. bus.axes == "XY") and how quickly.  Results are cached until USB serial
+        adapters are plugged in or removed, or refresh is true.  The port this driver is connected to is left alone. """
+
+        exclude = (self.devices.devname,) if self.devices.is_connected() else ()
+        return discovery.discover_buses(None, timeout, refresh, exclude)
 
-    def connect(self, serialport:str):
-        """Connects to motor controllers on a serial port (e.g. "COM3" or "/dev/ttyACM0"), and starts the comms thread.
+    def connect(self, serialport):
+        """Connects to motor controllers on a serial port (e.g. "COM3" or "/dev/ttyACM0"), or through a serial-to-Ethernet
+        bridge given as "tcp://host:port", and starts the comms thread.  Instead of a port name, the bus can be given as a
+        discovery.BusInfo (see discover_buses()), or by its axes as e.g. "axes:XY", in which case the port whose
+        controllers are exactly X and Y is found (raising ValueError if more than one matches).
         Returns true if connection was successful, false if not."""
 
+        if isinstance(serialport, discovery.BusInfo):
+            serialport = serialport.stable_port
+
         # the driver is not thread-safe, so we have to ensure that the background thread is not running when calls to it are made.
         # If we did not use the lock here, it would try to initialize the devices twice, and the binary responses would get
         # all smooshed together.
+        if self._engine is not None:
+            self._connected = self._engine.call('connect', (serialport,))
+            return self._connected
+
+        if serialport.startswith(discovery.AXIS_PREFIX):
+            exclude = (self.devices.devname,) if self.devices.is_connected() else ()
+            bus = discovery.find_bus(serialport, exclude=exclude)
+            if bus is None:
+                self.devices.conn_error = "No bus with %s found" % serialport
+                self._connected = False
+                return False
+            serialport = bus.stable_port
+
         self.serial_control_lock.acquire()
 
         self._connected = self.devices.connect(serialport)
+        self._reconnect_path = stable_port_path(serialport)
+        self._reconnect_delay = 0.
 
         self.serial_control_lock.release()
 
@@ -81,32 +231,155 @@ class GeckoDriver(object):
         It's a good idea to call this before the Python interpreter is shut down.
         NOTE: this call may block for 10-20 ms."""
 
-        self.serial_thread_shutdown_signal = True
-        self.geckomotion_serial_thread.join()
+        if self._engine is not None:
+            # the engine shuts down its own driver, then exits
+            self._engine.shutdown()
+        else:
+            self.serial_thread_shutdown_signal = True
+            self.geckomotion_serial_thread.join()
+
+            with self._job_cond:
+                self._job_cond.notify_all()
+
+            self.stop_metrics_server()
+            self.stop_capture()
+            self.unpublish_status()
 
-    def load_program(self, program:str):
+        if self._event_thread is not None:
+            self._event_queue.put(None)
+            self._event_thread.join()
+
+        self.devices.alog.flush()
+
+    @_engine_call
+    def load_program(self, program:str, params:dict=None, allow_python:bool=True):
         """ Readies the GeckoMotion code contained in "program" to be sent to the controllers.
 
-        If there are compile errors, it will throw a GMCompileException containing the error message."""
+        An operand may be a parameter, ${name} or ${name=default}, e.g. "x velocity ${feed=400}".  params gives
+        their values (overriding the defaults), and set_params() changes them later without compiling again.
 
-        # tell the driver that the source has changed
-        self.devices.mod_asm(True)
+        Compiling runs any {{{ }}} Python sections and {...} macros in the program.  For a program from a source which
+        is not trusted to run code in this process, pass allow_python=False to make them compile errors instead.
+
+        If there are compile errors, it will throw a GMCompileException containing the error message."""
 
         # there is a GeckoMotion bug where the program must end with a newline, or the last line of it is not compiled.
         # Interestingly, this affects the GeckoMotion IDE as well.
         if not program.endswith("\n"):
             program = program + "\n"
 
-        self.mocktab.set_text(program)
+        tab = MockTab()
+        tab.set_text(program)
 
+        # Assemble without holding the lock.  Big programs or slow {{{ }}} macros can take long enough that the
+        # controllers would drop the connection if the comms thread was held off for the duration.
+        code = self.devices.compile(tab, self.gm_project_prefs, params, allow_python)
+
+        # then just swap the new program in
         self.serial_control_lock.acquire()
 
-        self.devices.assemble(self.mocktab, self.gm_project_prefs)
+        self.devices.install_code(code)
 
         self.serial_control_lock.release()
 
-    def run(self):
-        """ Runs the current program from the start.  Throws an exception if not all devices are ready, or if there is no code."""
+        self.mocktab = tab
+
+    @_engine_call
+    def load_programs(self, programs:dict, params:dict=None, allow_python:bool=True):
+        """ Readies several GeckoMotion programs, a dict of source by name, to be sent to the controllers as one
+        linked image.  Any of them can then be started with run(entry=name) (or run_from_flash(entry=name), after
+        flash_program()), which just sets the program counter, with no compile or load in between.
+
+        Each program has its labels to itself (label "loop" of program "cut" is "cut.loop" from outside), and
+        libraries imported by several of them are only included once.  A program which runs off its end stops
+        there, rather than running into the next.  params and allow_python are as for load_program().
+
+        Compile errors are reported as for load_program()."""
+
+        tabs = []
+        for name, program in programs.items():
+            if not program.endswith("\n"):
+                program = program + "\n"
+            tab = MockTab()
+            tab.filename = "<API-Injected Code: %s>" % name
+            tab.set_text(program)
+            tabs.append((name, tab))
+
+        code = self.devices.link(tabs, self.gm_project_prefs, params, allow_python)
+
+        with self.serial_control_lock:
+            self.devices.install_code(code)
+
+        self.mocktab = tabs[0][1] if tabs else None
+
+    @_engine_call
+    def get_entries(self):
+        """ Returns a dict of the start address of each program loaded by load_programs(), by name. """
+
+        return dict(self.devices.code.entries)
+
+    def _entry_address(self, entry):
+        """ Address of entry: an address, a program name (see load_programs()) or a label.  Call with the lock held. """
+
+        if not isinstance(entry, str):
+            return entry
+        addr = self.devices.code.address_of_entry(entry)
+        if addr is None:
+            raise ValueError("No program or label '%s' in the loaded code" % entry)
+        return addr
+
+    @_engine_call
+    def set_params(self, **values):
+        """ Changes the values of parameters of the loaded program (see load_program()), e.g. set_params(feed=250,
+        count=3).  The instructions using them are patched in place, which takes microseconds rather than a compile, so
+        variants of a program can be run without loading it again.  Values are checked as they would be when compiling.
+
+        Throws a GMCompileException if a value is out of range or of the wrong type (in which case nothing is changed),
+        a KeyError if the program has no such parameter, and a GMInvalidStateException if a program is running. """
+
+        with self.serial_control_lock:
+            if self.is_running():
+                raise GMInvalidStateException("Cannot set parameters while a program is running.")
+            try:
+                self.devices.code.set_params(values)
+            except CodeError as e:
+                raise GMCompileException(e.get_all()[0][1])
+            self.devices.program_id += 1    # (the code has changed, as far as status readers are concerned)
+
+    @_engine_call
+    def get_params(self):
+        """ Returns a dict of the current values of the loaded program's parameters (see load_program()). """
+
+        return self.devices.code.get_params()
+
+    @_engine_call
+    def execute_immediate(self, line:str, timeout:float=None):
+        """ Executes a single line of GeckoMotion straight away, e.g. "x+100" or "y out1 on", without touching the loaded
+        program: the line is assembled on its own (a fraction of a millisecond, rather than a compile) and sent to the
+        controllers, and once it completes, the program counter is put back where it was.  Blocks until it completes;
+        returns false if the timeout (in seconds) expires first.
+
+        Throws a GMCompileException if the line does not assemble, or is a label, import or control flow (goto, call,
+        if...), and a GMInvalidStateException if not all devices are in ready state. """
+
+        tab = MockTab()
+        tab.set_text(line + "\n")
+        try:
+            insns = self.devices.compile_line(line, tab)
+        except CodeError as e:
+            raise GMCompileException(e.get_all()[0][1])
+
+        with self.serial_control_lock:
+            self._check_no_streams("execute")
+            if not self.devices.execute_immediate(insns):
+                raise GMInvalidStateException("Cannot execute, not all devices are in ready state.")
+
+        return self._wait_until(lambda: self.devices.stepping != Devices.IMMEDIATE, timeout)
+
+    @_engine_call
+    def run(self, entry=None):
+        """ Runs the current program from the start, or from entry: the name of one of the programs loaded by
+        load_programs(), a label or an address.  Throws an exception if not all devices are ready, or if there is no code."""
 
         self.serial_control_lock.acquire()
 
@@ -118,12 +391,20 @@ class GeckoDriver(object):
             self.serial_control_lock.release()
             raise GMInvalidStateException("Cannot start program, no code has been compiled.")
 
-        self.devices.restart_program()
+        try:
+            self._check_no_streams("start program")
+            addr = self._entry_address(entry) if entry is not None else 0
+        except (GMInvalidStateException, ValueError):
+            self.serial_control_lock.release()
+            raise
+
+        self.devices.restart_program(addr)
         self.devices.run_until_break()
 
         self.serial_control_lock.release()
 
 
+    @_engine_call
     def pause(self):
         """ Pauses the program at its current point.  Will interrupt long-running commands like MOVE.
 
@@ -143,19 +424,25 @@ class GeckoDriver(object):
 
         self.serial_control_lock.release()
 
+    @_engine_call
     def resume(self):
         """ Resumes the program if it was paused.  Throws an InvalidStateException otherwise."""
 
         self.serial_control_lock.acquire()
 
-        if self.is_paused():
+        if not self.is_paused():
             self.serial_control_lock.release()
             raise GMInvalidStateException("Cannot resume, not paused!")
 
+        if self._streams:
+            self.serial_control_lock.release()
+            raise GMInvalidStateException("Cannot resume while speed is being streamed.")
+
         self.devices.resume()
 
         self.serial_control_lock.release()
 
+    @_engine_call
     def stop(self):
         """ Causes execution to end after the current instruction finishes. """
 
@@ -165,23 +452,38 @@ class GeckoDriver(object):
             self.serial_control_lock.release()
             raise GMInvalidStateException("Cannot stop, a program is not running")
 
+        self._stop_current_job()
         self.devices.stop()
 
         self.serial_control_lock.release()
 
+        self.clear_jobs()
+
+    @_engine_call
     def estop(self):
         """ Emergency-stops the motors in the middle of the current instruction.
 
-        Also sets the program back to the start."""
+        Also sets the program back to the start, and cancels any queued jobs.  The ESTOP command goes straight out
+        on the serial port without waiting for the comms thread, so it is not held up by a read or a compile in progress.
+        Returns the time in seconds from the call to the command being written to the port (None if nothing was sent)."""
 
-        # only wait for the mutex for 100 ms, in case the background thread has gotten stuck or something
-        is_locked = self.serial_control_lock.acquire(True, .1)
+        self._stop_current_job()
+        latency = self.devices.fast_estop()
 
-        self.devices.estop()
+        self.clear_jobs()
+        for stop in list(self._stream_samplers.values()):
+            stop.set()
+        self._stream_samplers.clear()
+        self._streams = {}
 
-        if is_locked:
+        # Now bring the driver state up to date.  Only wait for the mutex for 100 ms, in case the background thread
+        # has gotten stuck or something -- if we don't get it, the background thread does this on its next tick.
+        if self.serial_control_lock.acquire(True, .1):
+            self.devices.reconcile_estop()
             self.serial_control_lock.release()
 
+        return latency
+
     def is_connected(self):
         """ Returns true if the serial connection is connected """
 
@@ -194,17 +496,18 @@ class GeckoDriver(object):
         return self.devices.n_devs
 
     def is_running(self):
-        """ Returns true if a command is currently executing."""
+        """ Returns true if a command is currently executing (or the controllers are running a program from flash)."""
 
-        return self.devices.stepping == self.devices.RUN_UNTIL_BREAK
+        return self.devices.stepping in (self.devices.RUN_UNTIL_BREAK, self.devices.RUN_FLASH)
 
     def is_paused(self):
         """ Returns true if the motors are paused and resume() can be legally called """
 
         return self.devices.state == self.devices.PAUSED
 
-    def wait_for_program(self):
-        """ Blocks the current thread until the current program has finished running. """
+    def wait_for_program(self, timeout:float=None):
+        """ Blocks the current thread until the current program has finished running.
+        Returns false if the timeout (in seconds) expires first. """
 
         if not self.simulate:
             # simulated runs finish instantly, so don't freak out if we are simulating and that happens
@@ -212,49 +515,805 @@ class GeckoDriver(object):
                 raise GMInvalidStateException("Cannot wait for program, a program is not running")
 
         try:
-            while self.is_running():
-                time.sleep(.1)
+            return self._wait_until(lambda: not self.is_running(), timeout)
         except GMInvalidStateException as e:
             raise e
         except KeyboardInterrupt as e:
             self.estop()
             raise e
 
+    def wait_for_position(self, axis_index:int, predicate:callable, timeout:float=None):
+        """ Blocks the current thread until predicate(position) returns true for the position of the given axis
+        (as returned by get_axis_position()).  E.g. wait_for_position(0, lambda pos: pos > 50000).
+
+        The predicate is checked each time new status is received from the controllers, so it may miss positions which
+        are passed through between two status updates.  Returns false if the timeout (in seconds) expires first."""
+
+        self._check_axis(axis_index)
+
+        return self._wait_until(lambda: self._axis_sample(axis_index, lambda dev: dev.pos),
+                                timeout, lambda pos: pos is not None and predicate(pos))
+
+    def wait_for_input(self, axis_index:int, input_num:int, state:bool=True, timeout:float=None):
+        """ Blocks the current thread until input input_num (1-3) of the given axis is on (state=True) or off (state=False).
+        Returns false if the timeout (in seconds) expires first."""
+
+        self._check_axis(axis_index)
+        if input_num not in (1, 2, 3):
+            raise ValueError("Input number out of range!")
+
+        return self._wait_until(lambda: self._axis_sample(axis_index, lambda dev: dev.input_active(input_num)),
+                                timeout, lambda active: active is not None and active == state)
+
+    def wait_for_pc(self, addr_or_label, timeout:float=None):
+        """ Blocks the current thread until the controllers' program counter reaches the given address, or the address
+        of the given label in the loaded program.  Returns false if the timeout (in seconds) expires first.
+
+        Note that the program counter is only checked each time new status is received from the controllers, so this
+        may miss instructions which complete quickly."""
+
+        if isinstance(addr_or_label, str):
+            addr = self._label_address(addr_or_label)
+            if addr is None:
+                raise ValueError("No label '%s' in the loaded program" % addr_or_label)
+        else:
+            addr = addr_or_label
+
+        return self._wait_until(lambda: self.devices.addr == addr, timeout)
+
+    @_engine_call
+    def _label_address(self, label:str):
+        return self.devices.code.address_of_label(label)
+
+    @_engine_call
+    def set_flash_cache(self, path:str):
+        """ Keeps a record of what was last programmed into each bus's flash in the given file, so that flash_program()
+        knows what is there after a restart.  Without it, the record only lasts as long as this driver, and the first
+        flash_program() on each bus reads back the whole flash to find what has changed. """
+
+        with self.serial_control_lock:
+            self.devices.flash_store = FlashImageStore(path)
+
+    @_engine_call
+    def flash_program(self, program:str=None, verify:bool=True, diff:bool=True, timeout:float=None):
+        """ Programs the current program (or, if given, loads program first, as for load_program()) into the controllers'
+        flash, so that it can be run with run_from_flash().  Blocks until programming is done.
+
+        If diff is true, only the flash pages which differ from what the controllers hold are programmed, so re-flashing an
+        unchanged program takes next to no time.  If verify is true, the pages programmed are read back from each
+        controller and checked.  Returns a dict of what was done: pages (in the image), written, skipped, compared (pages
+        read back to find changes), verified, seconds, bytes_tx and bytes_rx.  Throws a GMFlashException if programming
+        fails or the timeout (in seconds) expires. """
+
+        if program is not None:
+            self.load_program(program)
+
+        with self.serial_control_lock:
+            if self.is_running():
+                raise GMInvalidStateException("Cannot flash the program while a program is running.")
+            if not self.devices.flash(verify, diff):
+                raise GMInvalidStateException("Cannot flash the program, not all devices are ready or no code has been compiled.")
+
+        if not self._wait_until(lambda: not self.devices.is_flashing(), timeout):
+            with self.serial_control_lock:
+                if self.devices.is_flashing():
+                    self.devices.cancel_flash()
+            raise GMFlashException("Timed out programming flash")
+
+        result = self.devices.flash_result
+        if result is None:
+            raise GMFlashException("Flash programming was cancelled")
+        if result.get('error'):
+            raise GMFlashException(result['error'])
+        return result
+
+    @_engine_call
+    def is_flashed(self):
+        """ Returns true if the controllers' flash is known to hold the current program (see flash_program()). """
+
+        return self.devices.is_flashed()
+
+    @_engine_call
+    def run_from_flash(self, entry=0, poll_interval:float=.1):
+        """ Starts the controllers running the program in their flash, from entry (an address, label, or the name of one
+        of the programs loaded by load_programs()), on their own.  The
+        current program must be the one flashed (see flash_program() and is_flashed()).
+
+        Unlike run(), nothing is sent to the controllers while the program runs: the driver just polls their status every
+        poll_interval seconds, to update the positions and tell when the program reaches its end.  So the bus carries a
+        fraction of the traffic, and the program's timing no longer depends on this process.  is_running(),
+        wait_for_program(), pause(), resume() and stop() work as usual. """
+
+        with self.serial_control_lock:
+            if not self.devices.is_ready():
+                raise GMInvalidStateException("Cannot start program, not all devices are in ready state.")
+            if not self.devices.is_flashed():
+                raise GMInvalidStateException("Cannot run from flash, the current program has not been flashed.")
+            self._check_no_streams("start program")
+            addr = self._entry_address(entry)
+            self._flash_poll_interval = poll_interval
+            self._next_flash_poll = 0.
+            self.devices.run_flash(addr)
+
+    def _check_no_streams(self, what:str):
+        """ Raises GMInvalidStateException if speed is being streamed, as motion may then not be started (e.g. what is
+        "start program").  Call with the lock held. """
+
+        if self._streams:
+            raise GMInvalidStateException("Cannot %s while speed is being streamed." % what)
+
+    def stream_speed(self, axis_index:int, source:callable=None, rate:float=50.):
+        """ Starts streaming SPEED CONTROL settings to an axis, e.g. for closed-loop tension control.  Each setting is sent
+        as a single insn, outside of any program (so no program may be running), on a schedule of rate updates per second
+        interleaved with the status polling.  If source is given, it is called at that rate (from a thread of its own)
+        to get the speed; otherwise, call update_speed() with each new speed.  Speeds are as for "x speed control n".
+
+        Only the latest speed is sent at each deadline, so updates which come faster than the rate, or while the bus is
+        busy, are coalesced rather than queued.  get_stream_stats() reports the achieved rate and the latency from each
+        update to the wire.  Call stop_stream() to stop.  Until then, run(), run_from_flash(), resume() and
+        execute_immediate() are refused, and queued jobs wait. """
+
+        if self._engine is not None:
+            self._engine.call('stream_speed', (axis_index, None, rate))
+        else:
+            self._check_axis(axis_index)
+            if rate <= 0.:
+                raise ValueError("Stream rate must be positive")
+            with self.serial_control_lock:
+                if self.is_running():
+                    raise GMInvalidStateException("Cannot stream speed while a program is running.")
+                streams = dict(self._streams)
+                streams[axis_index] = SpeedStream(axis_index, rate)
+                self._streams = streams
+
+        if source is not None:
+            # sample the source on our side, so it works out of process too
+            stop = Event()
+            old = self._stream_samplers.get(axis_index)
+            if old is not None:
+                old.set()
+            self._stream_samplers[axis_index] = stop
+            sampler = Thread(target=self._sample_speed, args=(axis_index, source, 1. / rate, stop))
+            sampler.daemon = True
+            sampler.start()
+
+    def _sample_speed(self, axis_index, source, period, stop):
+        deadline = time.monotonic()
+        while not stop.is_set():
+            try:
+                self.update_speed(axis_index, source())
+            except Exception:
+                self.devices._log_exc("Error sampling speed for axis %d:", axis_index)
+                stop.set()
+                break
+            deadline += period
+            stop.wait(max(deadline - time.monotonic(), 0.))
+
+    @_engine_call
+    def update_speed(self, axis_index:int, speed:float):
+        """ Sets the speed to send at the next deadline of the axis's speed stream (see stream_speed()).  Throws a
+        ValueError if the speed is out of range. """
+
+        stream = self._streams.get(axis_index)
+        if stream is None:
+            raise GMInvalidStateException("No speed stream for axis %d." % axis_index)
+        stream.update(speed)
+
+    def stop_stream(self, axis_index:int, final_speed:float=0):
+        """ Stops streaming speed to an axis, and sends final_speed (unless None) as its last setting.  Returns the stream's
+        statistics (see get_stream_stats()). """
+
+        stop = self._stream_samplers.pop(axis_index, None)
+        if stop is not None:
+            stop.set()
+        if self._engine is not None:
+            return self._engine.call('stop_stream', (axis_index, final_speed))
+
+        with self.serial_control_lock:
+            streams = dict(self._streams)
+            stream = streams.pop(axis_index, None)
+            self._streams = streams
+            if stream is None:
+                return None
+            if final_speed is not None and self._connected:
+                stream.update(final_speed)
+                pending = stream.take()
+                self.devices._send_direct([pending[0]])
+                stream.sent_at(time.perf_counter(), pending[1])
+        return stream.get_stats()
+
+    @_engine_call
+    def get_stream_stats(self, axis_index:int=None):
+        """ Returns a dict of statistics of an axis's speed stream (or, if axis_index is None, a dict of them by axis index):
+        rate (asked for) and achieved_rate (updates sent per second), updates (received), sent, coalesced (updates replaced
+        by a later one before they were sent), missed_deadlines, speed (the latest), elapsed, and latency (a latency summary,
+        as for get_stats(), of the time from each update to its insn being written). """
+
+        if axis_index is None:
+            return dict((axis, stream.get_stats()) for axis, stream in self._streams.items())
+        stream = self._streams.get(axis_index)
+        return stream.get_stats() if stream is not None else None
+
+    def _stream_tick(self):
+        """ Called from the comms thread (with the lock held): send each speed stream's latest update, if it is due. """
+
+        slack = self._scheduler.period / 2.
+        for stream in self._streams.values():
+            pending = stream.due(time.perf_counter(), slack)
+            if pending is not None:
+                self.devices._send_direct([pending[0]])
+                stream.sent_at(time.perf_counter(), pending[1])
+
+    def _axis_sample(self, axis_index:int, read:callable):
+        """ Returns read(device) for the given axis, or None if it has no device at the moment (e.g. while the devices
+        are being rediscovered after a reconnect). """
+
+        dev = self.devices.devs[axis_index]
+        return None if dev is None else read(dev)
+
+    def _wait_until(self, sample:callable, timeout:float, predicate:callable=bool):
+        """ Blocks until predicate(sample()) returns true.  It is re-evaluated each time the devices report new status
+        (so wakeup latency is bounded by the polling interval).  Returns false if the timeout expires first.
+
+        sample() is called with status_cond held, so it must only copy status out of the devices; predicate() (which
+        may be the caller's) is called after releasing it, as the comms thread takes status_cond while holding
+        serial_control_lock. """
+
+        deadline = None if timeout is None else time.time() + timeout
+        status_cond = self.devices.status_cond
+        while True:
+            with status_cond:
+                seq = self.devices.status_seq
+                value = sample()
+            if predicate(value):
+                return True
+            remaining = 1. if deadline is None else deadline - time.time()
+            if remaining <= 0:
+                return False
+            with status_cond:
+                if self.devices.status_seq == seq:  # (else new status arrived while predicate() was running)
+                    status_cond.wait(remaining)
+
+    def subscribe(self, callback:callable, kinds=None, axis_index:int=None):
+        """ Registers callback(event) to be called with a DeviceEvent each time a device's status changes: an input or
+        output turning on or off, a device becoming busy or ready, an error flag changing, or the program counter moving.
+
+        kinds may be a DeviceEvent kind or a collection of them, to only receive those kinds of events, and axis_index
+        may be given to only receive events from that axis.  Changes are detected by the comms thread as each status
+        response is received, and callbacks are called from a separate dispatcher thread, so they may call other
+        GeckoDriver functions (e.g. pause() when a limit input turns on).  Returns a handle to pass to unsubscribe()."""
+
+        if isinstance(kinds, str):
+            kinds = (kinds,)
+        if kinds is not None:
+            kinds = frozenset(kinds)
+            if not kinds <= frozenset(DeviceEvent.KINDS):
+                raise ValueError("Unknown event kind(s): %s" % ", ".join(kinds - frozenset(DeviceEvent.KINDS)))
+
+        handle = (callback, kinds, axis_index)
+
+        with self._subscribe_lock:
+            self._subscribers = self._subscribers + [handle]
+            if self._event_thread is None:
+                self._event_thread = Thread(target=self.internal_event_thread)
+                self._event_thread.daemon = True
+                self._event_thread.start()
+            if self._engine is not None:
+                # the engine relays its events to our _event_queue
+                self._engine.call('_engine_forward_events', (True,))
+            else:
+                self.devices.event_sink = self._event_queue.put
+
+        return handle
+
+    def unsubscribe(self, handle):
+        """ Removes a callback registered with subscribe(). """
+
+        with self._subscribe_lock:
+            self._subscribers = [s for s in self._subscribers if s is not handle]
+            if not self._subscribers:
+                if self._engine is not None:
+                    self._engine.call('_engine_forward_events', (False,))
+                else:
+                    self.devices.event_sink = None
+
+    def get_event_stats(self):
+        """ Returns a dict of event statistics: number of events dispatched, and the mean and max latency in seconds
+        from the status response which contained each change being received, to the callbacks being called. """
+
+        n = self._event_count
+        return {
+            'event_count': n,
+            'latency_mean': self._event_latency_sum / n if n else None,
+            'latency_max': self._event_latency_max if n else None,
+        }
+
+    @_engine_call
+    def get_stats(self, reset:bool=False):
+        """ Returns a snapshot of the comms statistics as a dict:
+         - counters: commands, bytes_tx, bytes_rx, timeouts, short_reads, resyncs, not_responding, inconsistent_pc,
+           device_errors, rediscoveries, framing_errors, realignments, recoveries,
+           reconnects
+         - write_time, expect_time: dicts mapping command name to a latency summary of the time spent writing the
+           command and waiting for its response
+         - tick_interval, tick_jitter: latency summaries of the comms tick period and its deviation from the mean
+         - start_time, elapsed: when the stats were last reset, and seconds since then
+         - response_timeouts: dict mapping command name to the learned response time estimate (srtt, rttvar and rto,
+           in seconds, and the number of samples).  These are not reset.
+        Each latency summary is a dict of count, sum, mean, min, max, p50, p90, p99 and p999, in seconds.
+
+        If reset is true, the statistics are restarted from zero, and the returned snapshot covers the time since the
+        previous reset.  This does not need the comms lock, so it can be called at any time."""
+
+        stats = self.devices.stats
+        if reset:
+            self.devices.stats = CommsStats()
+        snapshot = stats.snapshot()
+        resp_timeouts = getattr(self.devices, "resp_timeouts", None)
+        snapshot['response_timeouts'] = resp_timeouts.snapshot() if resp_timeouts is not None else {}
+        return snapshot
+
+    @_engine_call
+    def start_metrics_server(self, port:int=9464, host:str="127.0.0.1", unix_socket:str=None, interval:float=1.):
+        """ Starts an HTTP server which serves driver health metrics (connection and run state, per-axis status, and
+        the comms statistics from get_stats()) in Prometheus text format, on http://host:port/metrics or on the
+        unix domain socket path unix_socket.
+
+        The page is re-rendered in the background every interval seconds, so scrapes never wait for the comms lock.
+        Returns the MetricsServer."""
+
+        from .metrics import MetricsServer
+
+        self.stop_metrics_server()
+        self._metrics_server = MetricsServer(self, host, port, unix_socket, interval)
+        self._metrics_server.start()
+        return self._metrics_server
+
+    @_engine_call
+    def stop_metrics_server(self):
+        """ Stops the server started by start_metrics_server(), if any. """
+
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+    @_engine_call
+    def start_capture(self, path:str):
+        """ Starts recording all serial traffic to a binary capture file at path (overwriting it).  The capture can
+        be replayed offline with capture.Replayer (or the gmreplay.py script), e.g. to reproduce a comms problem.
+        Any capture already in progress is stopped first. """
+
+        from .capture import CaptureWriter
+
+        self.stop_capture()
+        self.devices.capture = CaptureWriter(path)
+
+    @_engine_call
+    def stop_capture(self):
+        """ Stops recording serial traffic (see start_capture()), and closes the capture file. """
+
+        capture = self.devices.capture
+        if capture is not None:
+            self.devices.capture = None
+            capture.close()
+
+    @_engine_call
+    def publish_status(self, name:str):
+        """ Starts publishing device status (state, program counter, and each axis' flags, position and velocity) after
+        every serial tick, in a shared memory block with the given name.  Other processes on the same machine can then
+        read it with statusblock.StatusReader(name), without any IPC and without waiting for the comms lock.
+        Any block already being published is removed first.  Returns the block name.  Raises FileExistsError if
+        another process is publishing a block with that name. """
+
+        from .statusblock import StatusBlock
+
+        self.unpublish_status()
+        block = StatusBlock(name, create=True)
+        with self.serial_control_lock:
+            block.write(self.devices, self._connected)
+            self._status_block = block
+        return block.name
+
+    @_engine_call
+    def unpublish_status(self):
+        """ Stops publishing device status (see publish_status()), and removes the shared memory block. """
+
+        with self.serial_control_lock:
+            block, self._status_block = self._status_block, None
+        if block is not None:
+            block.close()
+
+    def internal_event_thread(self):
+        """ Internal function which passes DeviceEvents from the comms thread to subscribed callbacks."""
+        while True:
+            event = self._event_queue.get()
+            if event is None:
+                return
+
+            latency = time.monotonic() - event.sample_time
+            self._event_count += 1
+            self._event_latency_sum += latency
+            if latency > self._event_latency_max:
+                self._event_latency_max = latency
+
+            for callback, kinds, axis_index in self._subscribers:
+                if (kinds is None or event.kind in kinds) and (axis_index is None or event.axis == axis_index):
+                    try:
+                        callback(event)
+                    except Exception:
+                        traceback.print_exc()
+
+    def queue_job(self, program:str):
+        """ Queues a program to be run as soon as the previous job (or program started with run()) has finished.
+
+        Jobs are compiled in the background as soon as they are queued, so the next job can be started within one
+        comms tick of the previous one finishing.  Returns a GMJob which can be used to follow its progress.
+        If it does not compile, its status is set to FAILED and the queue moves on to the next job."""
+
+        if not program.endswith("\n"):
+            program = program + "\n"
+
+        job = GMJob(program)
+
+        if self._engine is not None:
+            return self._engine.queue_job(job)
+
+        with self._job_cond:
+            self._jobs.append(job)
+            if self._job_compile_thread is None:
+                self._job_compile_thread = Thread(target=self.internal_job_compile_thread)
+                self._job_compile_thread.daemon = True
+                self._job_compile_thread.start()
+            self._job_cond.notify_all()
+
+        return job
+
+    @_engine_call
+    def clear_jobs(self):
+        """ Cancels all jobs which have been queued but not started.  The running job (if any) is not affected. """
+
+        with self._job_cond:
+            while self._jobs:
+                job = self._jobs.popleft()
+                job.status = GMJob.CANCELLED
+                job._finished.set()
+
+    def _stop_current_job(self):
+        """ Marks the running job (if any) as stopped, so that it is retired as CANCELLED rather than DONE. """
+
+        with self._job_cond:
+            if self._current_job is not None:
+                self._current_job._stopped = True
+
+    @_engine_call
+    def get_queue_depth(self):
+        """ Returns the number of queued jobs which have not started yet. """
+
+        return len(self._jobs)
+
+    @_engine_call
+    def get_job_stats(self):
+        """ Returns a dict of job queue statistics: queue depth, number of jobs completed, and the min, mean and max
+        gap in seconds between a job finishing and the next queued job starting. """
+
+        gaps = list(self._job_gaps)
+        return {
+            'queue_depth': len(self._jobs),
+            'jobs_completed': self._jobs_completed,
+            'gap_count': len(gaps),
+            'gap_min': min(gaps) if gaps else None,
+            'gap_mean': sum(gaps) / len(gaps) if gaps else None,
+            'gap_max': max(gaps) if gaps else None,
+        }
+
+    @_engine_call
+    def wait_for_jobs(self):
+        """ Blocks the current thread until all queued jobs have finished. """
+
+        while True:
+            with self._job_cond:
+                if self._jobs:
+                    job = self._jobs[-1]
+                elif self._current_job is not None:
+                    job = self._current_job
+                else:
+                    return
+            try:
+                while not job.wait(.1):
+                    pass
+            except KeyboardInterrupt as e:
+                self.estop()
+                raise e
+
+    def internal_job_compile_thread(self):
+        """ Internal function which compiles queued jobs in the background, in the order they were queued."""
+        while not self.serial_thread_shutdown_signal:
+            with self._job_cond:
+                job = next((j for j in self._jobs if j.status == GMJob.QUEUED), None)
+                if job is None:
+                    self._job_cond.wait()
+                    continue
+
+            tab = MockTab()
+            tab.set_text(job.program)
+            code = self.devices.compile(tab, self.gm_project_prefs)
+
+            with self._job_cond:
+                if job.status != GMJob.QUEUED:
+                    continue # cancelled meanwhile
+                if code.semantic_error_count():
+                    job.error = "\n".join(code.get_error_text(ei) for ei in range(code.semantic_error_count()))
+                    job.status = GMJob.FAILED
+                    self._jobs.remove(job)
+                    job._finished.set()
+                else:
+                    code.encode()
+                    job._code = code
+                    job._tab = tab
+                    job.status = GMJob.COMPILED
+
+    def _job_tick(self):
+        """ Called from the comms thread (with the lock held) after each tick.  Retires the running job once it has
+        finished, and starts the next queued one if it is compiled and the devices are ready.  Only a job which ran to
+        the end of its program counts as completed (and towards the gap statistics). """
+
+        with self._job_cond:
+            job = self._current_job
+            if job is not None and not self.is_running():
+                job.end_time = self.devices.state_time
+                self._current_job = None
+                if job._stopped:
+                    job.status = GMJob.CANCELLED
+                    self._last_job_end = None
+                elif self.devices.halt_error is not None:
+                    job.status = GMJob.FAILED
+                    job.error = self.devices.halt_error
+                    self._last_job_end = None
+                else:
+                    job.status = GMJob.DONE
+                    self._jobs_completed += 1
+                    self._last_job_end = job.end_time
+                job._finished.set()
+
+            if self._current_job is not None or not self._jobs or self._jobs[0].status != GMJob.COMPILED:
+                return
+            if self.is_running() or not self.devices.is_ready() or self._streams:
+                return      # (the job waits for any speed streams to be stopped)
+
+            job = self._jobs.popleft()
+            self.devices.install_code(job._code)
+            self.mocktab = job._tab
+            job._code = None
+            self.devices.restart_program()
+            self.devices.run_until_break()
+            job.start_time = time.time()
+            job.status = GMJob.RUNNING
+            self._current_job = job
+
+            # record the gap since the previous job ended, if this one was already waiting for it
+            if self._last_job_end is not None and job.queue_time <= self._last_job_end:
+                self._job_gaps.append(max(job.start_time - self._last_job_end, 0.))
+                del self._job_gaps[:-1000]
+
+    def set_watchdog(self, threshold:float, callback:callable=None, pause:bool=False):
+        """ Arms the comms watchdog: if a serial tick (nominally every 20 ms) starts more than threshold seconds late,
+        callback(lateness) is called from the comms thread, and if pause is true a running program is paused, so that
+        motion does not carry on unsupervised while comms are stalled.  A threshold of None disarms it.
+        The callback is called between ticks, without the comms lock held, so it may call other GeckoDriver functions,
+        but it should return quickly since the next tick waits for it. """
+
+        self._watchdog_callback = callback
+        self._watchdog_pause = pause
+        if self._engine is not None:
+            # the engine relays watchdog trips, if we have a callback for them
+            self._engine.call('_engine_set_watchdog', (threshold, callback is not None, pause))
+        else:
+            self._scheduler.watchdog_threshold = threshold
+
+    def set_auto_reconnect(self, enable:bool=True, initial_backoff:float=.1, max_backoff:float=5., callback:callable=None):
+        """ Controls what happens when the link to the controllers is lost (e.g. a USB adapter is unplugged or
+        resets, or a TCP bridge drops the connection).  By default nothing happens: the driver just reports that it is
+        disconnected until connect() is called again.  If enabled, the comms thread keeps trying to re-open the port,
+        waiting initial_backoff seconds after the first failure and doubling that each time up to max_backoff.  A USB
+        adapter is found again by its /dev/serial/by-id name, if it has one, in case it comes back under a different
+        device name.
+
+        Once the bus answers again, the devices' state is compared with how it was when the link went down, and
+        callback(recovery) is called (from the comms thread, without the lock held) with a dict of:
+            outcome:  "resumed" if everything checked out, and a running program carried on where it was;
+                      "paused" if the devices are intact but an axis moved meanwhile.  The program is paused, and
+                      resume() carries on;
+                      "operator" if a device is missing, new, signalling an error or appears to have been reset.
+                      The program is stopped (and the current job, if any, fails), since the machine needs
+                      attention before carrying on
+            problems: list of messages describing what was found
+            seconds:  time from losing the link to recovering it
+            attempts: number of attempts to re-open the port
+        The most recent one is also available as last_recovery. """
+
+        self._auto_reconnect = enable
+        self._reconnect_backoff = (initial_backoff, max_backoff)
+        self._reconnect_callback = callback
+        if self._engine is not None:
+            # the engine relays recoveries, if we have a callback for them
+            self._engine.call('_engine_set_auto_reconnect', (enable, initial_backoff, max_backoff, callback is not None))
+
+    def _try_reconnect(self):
+        """ Called from the comms thread (with the lock held) while the link is down.  Returns the recovery dict once
+        the link has been recovered, else None. """
+
+        now = time.monotonic()
+        if now < self._next_reconnect:
+            return None
+        self._reconnect_attempts += 1
+        devname = self._reconnect_path or self.devices.devname
+        recovery = self.devices.recover(devname)
+        if recovery is None:
+            initial, limit = self._reconnect_backoff
+            self._reconnect_delay = min(max(self._reconnect_delay * 2., initial), limit)
+            self._next_reconnect = now + self._reconnect_delay
+            return None
+
+        recovery['attempts'] = self._reconnect_attempts
+        self._reconnect_attempts = 0
+        self._reconnect_delay = 0.
+        self.last_recovery = recovery
+        if recovery['outcome'] == RS485Devices.RECOVER_OPERATOR:
+            with self._job_cond:
+                job = self._current_job
+                if job is not None:
+                    job.status = GMJob.FAILED
+                    job.error = "Link to controllers lost: " + "; ".join(recovery['problems'])
+                    job.end_time = time.time()
+                    self._current_job = None
+                    self._last_job_end = None
+                    job._finished.set()
+        return recovery
+
+    @_engine_call
+    def get_tick_stats(self, reset:bool=False):
+        """ Returns a dict of comms tick scheduling statistics: period, number of ticks, deadlines missed entirely,
+        watchdog trips, and latency summaries (as for get_stats()) of how late each tick started and how long it took.
+        If reset is true, the statistics are restarted from zero after taking the snapshot. """
+
+        stats = self._scheduler.get_stats()
+        stats['realtime_priority'] = self.realtime_priority
+        if reset:
+            self._scheduler.reset_stats()
+        return stats
+
+    def _watchdog(self, lateness:float):
+        """ Called by the tick scheduler when a tick is later than the watchdog threshold. """
+
+        self.devices._log("Comms watchdog: tick %.1f ms late", lateness * 1000.)
+        if self._watchdog_pause and self._connected and self.is_running() and not self.is_paused():
+            with self.serial_control_lock:
+                self.devices.pause()
+        if self._watchdog_callback is not None:
+            try:
+                self._watchdog_callback(lateness)
+            except Exception:
+                self.devices._log_exc("Error in watchdog callback:")
+
+    def _drain_gui_actions(self):
+        """ Called from the comms thread (with the lock held).  The devices queue calls to the UI object (in this case
+        the MockUI) in gui_data.actions, e.g. to log each status update.  Hand them over to the log writer thread
+        to be run there. """
+
+        gui_data = self.devices.gui_data
+        if gui_data.actions:
+            actions = gui_data.actions
+            gui_data.actions = []
+            self.devices.alog.call(self._run_gui_actions, actions)
+
+    def _run_gui_actions(self, actions):
+        for action in actions:
+            try:
+                action(self.mockui)
+            except Exception:
+                self.devices._log_exc("Error in UI action:")
+
     def internal_serial_thread(self):
         """ Internal function which ticks the motor controller comms code.  Updates status, and sends the next command if applicable."""
+        if self._realtime:
+            self.realtime_priority = raise_thread_priority()
+            self.devices._log("Comms thread priority: %s", self.realtime_priority or "unchanged (not permitted)")
+
+        self._scheduler.start()
         while not self.serial_thread_shutdown_signal:
 
             # if the serial cable is unplugged, then the GM library will set its internal serial port object to None
             self._connected = (self.devices.get_serport_obj() != None)
 
+            recovery = None
+            if not self._connected and self._auto_reconnect and self.devices.lost_snapshot is not None:
+                with self.serial_control_lock:
+                    try:
+                        recovery = self._try_reconnect()
+                    except Exception:
+                        self.devices._log_exc("Error reconnecting:")
+                    self._connected = (self.devices.get_serport_obj() != None)
+                    self._drain_gui_actions()
+
+            if recovery is not None and self._reconnect_callback is not None:
+                try:
+                    self._reconnect_callback(recovery)
+                except Exception:
+                    self.devices._log_exc("Error in reconnect callback:")
+
             if self._connected:
 
                 self.serial_control_lock.acquire()
 
                 try:
-                    # force query of all devices' state (not calling this is why the GM GUI tends to freeze up)
-                    self.devices._send_qlong()
+                    # force query of all devices' state (not calling this is why the GM GUI tends to freeze up).  While
+                    # running from flash, the devices don't need us, so only poll as often as asked.
+                    if self.devices.stepping != Devices.RUN_FLASH:
+                        self.devices._send_qlong()
+                    elif time.monotonic() >= self._next_flash_poll:
+                        self._next_flash_poll = time.monotonic() + self._flash_poll_interval
+                        self.devices._send_qlong()
 
                     # send queued serial data if needed
                     self.devices.idle_func()
+
+                    # send speed stream updates which are due (see stream_speed())
+                    if self._streams:
+                        self._stream_tick()
+
+                    # start the next queued job if the last one has finished
+                    self._job_tick()
+
+                    # publish status for other processes (see publish_status())
+                    if self._status_block is not None:
+                        self._status_block.write(self.devices, self._connected)
+
+                    # pass status updates etc. to the log writer thread, so that any logging I/O is done there
+                    self._drain_gui_actions()
                 except KeyboardInterrupt:
                     raise
                 except Exception as ex:
-                    traceback.print_exc()
+                    self.devices._log_exc("Error in serial thread:")
                     pass
 
                 self.serial_control_lock.release()
 
+            elif self.simulate:
+                # nothing to talk to, but queued jobs still have to be started (and simulated runs finish instantly)
+                with self.serial_control_lock:
+                    try:
+                        self._job_tick()
+                    except Exception:
+                        self.devices._log_exc("Error in serial thread:")
+
             if not self.serial_update_callback is None:
                 self.serial_update_callback()
 
-            # update every 20ms
-            time.sleep(.02)
+            # update every 20ms (on the dot, as far as possible)
+            self._scheduler.wait()
 
 
 
     # NOTE: axis ordering is X-W correspond to indices 0-3
 
+    def _check_axis(self, axis_index:int):
+        if axis_index < 0 or axis_index > 3 or self.devices.devs[axis_index] is None:
+            raise ValueError("Axis out of range!")
+
+    def get_axis_input(self, axis_index:int, input_num:int):
+        """ Returns true if input input_num (1-3) of the given axis is on, as of the most recent serial tick."""
+
+        self._check_axis(axis_index)
+        if input_num not in (1, 2, 3):
+            raise ValueError("Input number out of range!")
+
+        return self.devices.devs[axis_index].input_active(input_num)
+
+    def get_pc(self):
+        """ Returns the controllers' program counter, as of the most recent serial tick."""
+
+        return self.devices.addr
+
     def get_axis_position(self, axis_index:int):
         """ Returns the number of steps away from the zero point of the given axis, as of the most recent serial tick."""
 
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Optional HTTP endpoint serving driver health metrics in Prometheus text format
+(see GeckoDriver.start_metrics_server()).
+
+The metrics page is rendered by a background thread every few seconds, from values which can be read
+without the comms lock.  Scrapes just return the last rendered page, so however often (or slowly) the
+endpoint is scraped, it never holds up the comms thread.
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread, Event
+import socketserver
+import os
+import time
+import traceback
+
+from .devices import Devices
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_QUANTILES = (("0.5", 'p50'), ("0.9", 'p90'), ("0.99", 'p99'), ("0.999", 'p999'))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.page
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # Don't spam stderr with a line per scrape
+
+
+class _TCPMetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)     # Stale socket left by a previous run
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+class MetricsServer(object):
+    """Serves metrics for a GeckoDriver on http://host:port/metrics, or on a unix domain socket if
+    unix_socket is given.  The page is re-rendered every interval seconds.
+    """
+    def __init__(self, driver, host="127.0.0.1", port=9464, unix_socket=None, interval=1.):
+        self.driver = driver
+        self.interval = interval
+        self.unix_socket = unix_socket
+        self._last_commands = None
+        self._last_time = None
+        self.page = self.render()
+        if unix_socket is not None:
+            self.httpd = _UnixMetricsServer(unix_socket, _MetricsHandler)
+        else:
+            self.httpd = _TCPMetricsServer((host, port), _MetricsHandler)
+        self.httpd.metrics = self
+        self._stop = Event()
+        self._render_thread = None
+        self._serve_thread = None
+
+    def start(self):
+        self._render_thread = Thread(target=self._render_loop)
+        self._render_thread.daemon = True
+        self._render_thread.start()
+        self._serve_thread = Thread(target=self.httpd.serve_forever)
+        self._serve_thread.daemon = True
+        self._serve_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    def _render_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.page = self.render()
+            except Exception:
+                traceback.print_exc()
+
+    def render(self):
+        """Return metrics page as bytes"""
+        drv = self.driver
+        devices = drv.devices
+        stats = drv.get_stats()
+        now = time.time()
+        out = []
+
+        def metric(name, typ, helptext, samples):
+            out.append("# HELP gm_%s %s" % (name, helptext))
+            out.append("# TYPE gm_%s %s" % (name, typ))
+            for labels, value in samples:
+                if value is None:
+                    continue
+                if labels:
+                    out.append("gm_%s{%s} %s" % (name, ",".join('%s="%s"' % kv for kv in labels), _fmt(value)))
+                else:
+                    out.append("gm_%s %s" % (name, _fmt(value)))
+
+        def summary(name, helptext, summaries, label):
+            out.append("# HELP gm_%s %s" % (name, helptext))
+            out.append("# TYPE gm_%s summary" % (name,))
+            for key, s in sorted(summaries.items()):
+                lbl = '%s="%s"' % (label, key) if label else ''
+                for q, field in _QUANTILES:
+                    if s[field] is not None:
+                        out.append('gm_%s{%s%squantile="%s"} %s' % (name, lbl, "," if lbl else "", q, _fmt(s[field])))
+                out.append("gm_%s_sum%s %s" % (name, "{%s}" % lbl if lbl else "", _fmt(s['sum'])))
+                out.append("gm_%s_count%s %s" % (name, "{%s}" % lbl if lbl else "", _fmt(s['count'])))
+
+        metric("connected", "gauge", "Whether the serial port is open.", [((), int(drv.is_connected()))])
+        state = devices.state
+        metric("state", "gauge", "Device chain run state (1 for the current state).",
+               [((("state", name),), int(n == state)) for n, name in enumerate(Devices.states)])
+        metric("devices", "gauge", "Number of devices detected on the bus.", [((), devices.n_devs)])
+
+        devs = [d for d in list(devices.devs) if d is not None]
+        axis = lambda d: (("axis", d.axisname),)
+        metric("axis_noqresp", "gauge", "Consecutive status queries the axis has not responded to.",
+               [(axis(d), d.noqresp) for d in devs])
+        metric("axis_error", "gauge", "Axis error flags (1 = PIC error, 2 = FPGA error).",
+               [(axis(d), d.error_state()) for d in devs])
+        metric("axis_busy", "gauge", "Whether the axis is busy executing an instruction.",
+               [(axis(d), int(d.is_busy())) for d in devs])
+        metric("axis_position", "gauge", "Axis position in steps.",
+               [(axis(d), int(d.pos) + d.offset) for d in devs])
+        metric("axis_velocity", "gauge", "Axis velocity.", [(axis(d), d.vel) for d in devs])
+
+        for c in ('commands', 'bytes_tx', 'bytes_rx', 'timeouts', 'short_reads', 'resyncs', 'not_responding',
+                  'inconsistent_pc', 'device_errors', 'rediscoveries', 'framing_errors', 'realignments', 'recoveries',
+                  'reconnects'):
+            metric(c + "_total", "counter", "Comms %s since the stats were last reset." % c.replace('_', ' '),
+                   [((), stats[c])])
+
+        rate = None
+        if self._last_commands is not None and now > self._last_time:
+            delta = stats['commands'] - self._last_commands
+            if delta < 0:
+                delta = stats['commands']   # Stats have been reset
+            rate = delta / (now - self._last_time)
+        self._last_commands = stats['commands']
+        self._last_time = now
+        metric("commands_per_second", "gauge", "Command frames written per second, over the last render interval.",
+               [((), rate)])
+
+        summary("response_latency_seconds", "Time spent waiting for the response to each command.",
+                stats['expect_time'], "command")
+        summary("write_latency_seconds", "Time spent writing each command frame.", stats['write_time'], "command")
+        summary("tick_interval_seconds", "Time between comms ticks.", {'': stats['tick_interval']}, None)
+        summary("tick_jitter_seconds", "Deviation of the comms tick interval from its running mean.",
+                {'': stats['tick_jitter']}, None)
+
+        ticks = drv.get_tick_stats()
+        summary("tick_lateness_seconds", "How late each comms tick started, relative to its deadline.",
+                {'': ticks['lateness']}, None)
+        metric("tick_missed_total", "counter", "Comms tick deadlines missed entirely.", [((), ticks['missed'])])
+        metric("watchdog_trips_total", "counter", "Comms watchdog trips.", [((), ticks['watchdog_trips'])])
+
+        metric("render_timestamp_seconds", "gauge", "When this page was rendered.", [((), now)])
+        out.append("")
+        return "\n".join(out).encode("utf-8")
+
+
+def _fmt(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
@@ -13,6 +13,7 @@ class MockUI:
 		return False
 	
 	def update_status(self, n, dev):
+		"""Note: called from the log writer thread (see GeckoDriver._drain_gui_actions()), not the comms thread."""
 		if dev is not None:
 			if self.get_verbose() and self.log_file is not None:
 				self.log_file.write("Status update [%s] from axis %d: pos = %d, vel = %d, pc = %x\n" % (datetime.datetime.now(), n, dev.pos, dev.vel, dev.pc))
@@ -70,6 +71,13 @@ devices off and on, then reconnect.
 		"""Post-command word transmit delay in seconds"""
 		#return self.cmd_delay.get_value() * 0.001
 		return 0.002
+	def get_adaptive_timeout(self):
+		"""If true, response timeouts are learned from measured response times (up to get_resp_timeout()),
+		so that a missing or short response does not always cost the full timeout."""
+		return True
+	def get_burst_limit(self):
+		"""Max number of consecutive instant instructions sent in one idle pass (0 to disable)"""
+		return 100
 	def get_poll_rate(self):
 		"""Polling rate in seconds"""
 		#return self.poll_rate.get_value() * 0.001
@@ -79,6 +87,12 @@ devices off and on, then reconnect.
 		"""Whether to poll"""
 		return False
 		
+	def set_flash_progress(self, addr, length):
+		pass
+	
+	def flash_done(self, msg):
+		print(msg, file=sys.stderr)
+	
 	def update_status_button(self, text):
 		#print("Status update: " + text)
 		pass
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Deadline scheduling for the comms thread (see GeckoDriver.internal_serial_thread()).
+
+The devices drop the connection if they are not heard from for too long, so it matters when each tick
+actually runs, not just how long the thread sleeps between ticks.  TickScheduler runs ticks on absolute
+deadlines from the monotonic clock (so time spent in the tick itself, or waiting for the comms lock, does
+not push the schedule back), measures how late each tick starts, and calls a watchdog when that exceeds
+a threshold.
+"""
+import os
+import sys
+import threading
+import time
+
+from .stats import LatencyHistogram
+
+
+class TickScheduler(object):
+    """Schedules periodic ticks on absolute deadlines.
+
+    Call wait() between ticks.  If a tick overruns by more than a whole period, the missed deadlines are
+    skipped (and counted) rather than run back-to-back to catch up.
+    """
+    def __init__(self, period=0.02):
+        self.period = period
+        self.watchdog_threshold = None  # Lateness (seconds) which trips the watchdog, None to disable
+        self.watchdog = None            # Called with the lateness (in the ticking thread) when tripped
+        self.reset_stats()
+        self.deadline = None
+
+    def reset_stats(self):
+        self.lateness = LatencyHistogram()  # How late each tick started, relative to its deadline
+        self.tick_time = LatencyHistogram() # How long each tick took (from wakeup to the next wait())
+        self.ticks = 0
+        self.missed = 0                     # Deadlines skipped due to overrun
+        self.watchdog_trips = 0
+
+    def start(self):
+        self.deadline = time.monotonic() + self.period
+        self._wake_time = None
+
+    def wait(self):
+        """Sleep until the next deadline.  Returns how late (seconds) we woke up."""
+        now = time.monotonic()
+        if self.deadline is None:
+            self.start()
+        if self._wake_time is not None:
+            self.tick_time.record(now - self._wake_time)
+        delay = self.deadline - now
+        if delay > 0.:
+            time.sleep(delay)
+            now = time.monotonic()
+        late = now - self.deadline
+        self._wake_time = now
+        self.ticks += 1
+        self.lateness.record(late)
+
+        # Schedule the next deadline, skipping any we have already missed entirely
+        self.deadline += self.period
+        if now > self.deadline:
+            skip = int((now - self.deadline) / self.period) + 1
+            self.missed += skip
+            self.deadline += skip * self.period
+
+        if self.watchdog_threshold is not None and late > self.watchdog_threshold:
+            self.watchdog_trips += 1
+            if self.watchdog is not None:
+                self.watchdog(late)
+        return late
+
+    def get_stats(self):
+        return {
+            'period': self.period,
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'watchdog_trips': self.watchdog_trips,
+            'lateness': self.lateness.snapshot(),
+            'tick_time': self.tick_time.snapshot(),
+            }
+
+
+def raise_thread_priority(rt_priority=10, nice=-10):
+    """Try to raise the scheduling priority of the calling thread: to SCHED_FIFO at rt_priority if
+    permitted, else to the given nice value.  Only does anything on Linux (elsewhere, and if neither is
+    permitted, e.g. not root and no CAP_SYS_NICE or RLIMIT_RTPRIO, this does nothing).
+    Returns a description of the priority obtained, or None.
+
+    Note that this only gets the thread scheduled promptly when its deadline arrives; it still has to
+    get the GIL from any other Python threads.
+    """
+    if hasattr(os, "sched_setscheduler"):
+        try:
+            # pid 0 = the calling thread, on Linux
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(rt_priority))
+            return "SCHED_FIFO priority %d" % rt_priority
+        except OSError:
+            pass
+    if hasattr(os, "setpriority") and hasattr(threading, "get_native_id") and sys.platform.startswith("linux"):
+        try:
+            # On Linux, the "process" priority of a thread id only affects that thread
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+            return "nice %d" % nice
+        except OSError:
+            pass
+    return None
@@ -0,0 +1,706 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Local server which lets several client processes share one bus (see the gmserver.py script).
+
+Only one process can have the serial port open, so the server owns the GeckoDriver and clients connect to it
+over a unix domain socket (by default DEFAULT_SOCKET, which only its owner may use) or a localhost TCP port.  The
+protocol is one JSON object per line, each way.
+
+A client's first request must be hello, with the server's token if it has one (a TCP server always does: see
+write_token_file()).  A connection is closed at once if it does not start with a valid hello, or sends a line
+which is not a JSON object, so that e.g. an HTTP request from a web page cannot smuggle a request in its body.
+
+Requests are {"id": <any>, "op": <name>, "args": {...}}, and each gets a reply with the same id:
+{"id": ..., "ok": true, "result": ...}, or {"id": ..., "ok": false, "error": <exception type>, "message": ...}.
+The operations are:
+
+    hello       token                       Must be the first request
+    ping
+    load        program, params             Compile a program (as GeckoDriver.load_program())
+                programs, params            ...or link several, by name (as GeckoDriver.load_programs())
+    params      values                      Set the program's parameters (as GeckoDriver.set_params())
+    run         entry                       Run the program, or one of the linked programs (as GeckoDriver.run())
+    pause, resume, stop, estop
+    status                                  Return the status object below
+    wait        what, timeout, ...          Wait for something; returns false on timeout (by default after
+                                            DEFAULT_WAIT_TIMEOUT seconds).  what is one of:
+                                              "program"
+                                              "pc"        target (address or label)
+                                              "input"     axis, n, state (default true)
+                                              "position"  axis, min, max (either may be omitted)
+    subscribe   status, events, kinds, axis Ask for status and/or device event messages (see below)
+    unsubscribe
+
+Programs loaded by clients may not contain Python ({{{ }}} sections or {...} macros), unless the server was
+started with allow_python.
+
+Subscribed clients are also sent status messages, {"type": "status", "time": ..., "connected": ..., "state": ...,
+"running": ..., "pc": ..., "axes": [{"axis": "X", "pos": ..., "vel": ..., "flags": ..., "busy": ...}, ...]},
+whenever the status has changed, at most every status_interval seconds, and event messages,
+{"type": "event", "kind": ..., "axis": ..., "n": ..., "value": ..., "sample_time": ...}, for each DeviceEvent.
+
+Requests from different clients are run in round-robin order, one at a time (waits run on their own threads, up
+to MAX_WAITS at a time per client and MAX_WAITS_TOTAL in all, and end soon after their client disconnects).  estop, stop and pause are not queued behind them: they are run straight away
+on a thread of their own (estop first), so they may overtake requests the same client sent earlier.
+Status is only encoded once per interval however many clients there are, and a client which is slow to read
+only ever has the latest status waiting for it, and a bounded number of events (the oldest are dropped, and it
+is sent {"type": "dropped", "events": n}).  Nothing the server does for clients blocks the comms thread.
+"""
+from collections import deque
+from threading import Thread, Condition, Event, Lock
+import hmac
+import json
+import os
+import secrets
+import selectors
+import socket
+import time
+import traceback
+
+from .devices import Devices
+from .events import DeviceEvent
+
+
+DEFAULT_PORT = 7464
+DEFAULT_SOCKET = os.path.expanduser("~/.gmserver.sock") if hasattr(socket, "AF_UNIX") else None
+DEFAULT_TOKEN_FILE = os.path.expanduser("~/.gmserver.token")
+
+MAX_PENDING = 64            # Requests queued per client before we stop reading from it
+MAX_WAITS = 8               # Waits in progress per client before more are refused
+MAX_WAITS_TOTAL = 64        # ...and for all clients together
+DEFAULT_WAIT_TIMEOUT = 60.  # Seconds, for a wait without a timeout
+WAIT_SLICE = .5             # Waits check this often whether their client is still there
+MAX_EVENTS = 1024           # Events queued per client before the oldest are dropped
+HIGH_WATER = 256 * 1024     # Output buffered per client before we stop queueing more for it
+MAX_LINE = 1024 * 1024      # Longest request line
+
+
+class GMServerError(Exception):
+    """Error reply from a GMServer, for exceptions which don't map to one of the gm_api ones."""
+    def __init__(self, error, message):
+        super(GMServerError, self).__init__("%s: %s" % (error, message))
+        self.error = error
+
+
+# Operations which are run as soon as they are read, not queued behind other requests
+_URGENT_OPS = ('estop', 'stop', 'pause')
+
+# Error replies which GMClient re-raises as the same exception (as well as the gm_api ones)
+_ERRORS = {'ValueError': ValueError, 'TypeError': TypeError, 'KeyError': KeyError}
+
+
+def _encode(msg):
+    return (json.dumps(msg, separators=(',', ':')) + "\n").encode("utf-8")
+
+
+def write_token_file(token, path=DEFAULT_TOKEN_FILE):
+    """Save a server's token where its owner's clients can read it (and nobody else can)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+
+
+def read_token_file(path=DEFAULT_TOKEN_FILE):
+    """Return the token saved by write_token_file(), or None if there isn't one."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def status_dict(driver):
+    """Return the status of driver's devices as a JSON-able dict (without the time)."""
+    devices = driver.devices
+    axes = []
+    for d in list(devices.devs):
+        if d is not None:
+            axes.append({'axis': d.axisname, 'pos': int(d.pos), 'vel': d.vel, 'flags': d.flags, 'busy': d.is_busy()})
+    return {
+        'connected': driver.is_connected(),
+        'state': Devices.states[devices.state],
+        'running': driver.is_running(),
+        'pc': devices.addr,
+        'axes': axes,
+        }
+
+
+class _Client(object):
+    def __init__(self, sock, addr):
+        sock.setblocking(False)
+        self.sock = sock
+        self.addr = addr
+        self.inbuf = bytearray()
+        self.outbuf = bytearray()
+        self.requests = deque()     # parsed requests waiting for the dispatcher
+        self.replies = deque()      # encoded replies waiting to go in outbuf
+        self.events = deque()       # encoded event messages
+        self.events_dropped = 0
+        self.status_line = None     # latest encoded status not yet sent (coalesced)
+        self.want_status = False
+        self.event_filter = None    # (kinds, axis) while subscribed to events
+        self.waits = 0              # waits in progress
+        self.authenticated = False  # once it has sent a valid hello
+        self.closed = False
+        self.registered = 0         # selector events currently registered for
+
+    def fill_outbuf(self):
+        """Move queued messages into the output buffer, replies first, up to the high water mark."""
+        out = self.outbuf
+        while self.replies and len(out) < HIGH_WATER:
+            out += self.replies.popleft()
+        if self.events_dropped and len(out) < HIGH_WATER:
+            n, self.events_dropped = self.events_dropped, 0
+            out += _encode({'type': 'dropped', 'events': n})
+        while self.events and len(out) < HIGH_WATER:
+            out += self.events.popleft()
+        if self.status_line is not None and len(out) < HIGH_WATER:
+            out += self.status_line
+            self.status_line = None
+
+
+class GMServer(object):
+    """Serves a GeckoDriver to clients on the unix domain socket path unix_socket, or on host:port if port is given
+    (or there are no unix domain sockets).  Status is pushed to subscribed clients at most every status_interval
+    seconds.
+
+    Clients must give token in their hello.  A TCP server makes one up if it is not given one: pass server.token to
+    write_token_file() for clients to find.  Programs may only use Python if allow_python (see the module docstring).
+    """
+    def __init__(self, driver, unix_socket=DEFAULT_SOCKET, host="127.0.0.1", port=None, status_interval=.05,
+                 token=None, allow_python=False):
+        self.driver = driver
+        if port is not None:
+            unix_socket = None
+        elif unix_socket is None:
+            port = DEFAULT_PORT
+        self.unix_socket = unix_socket
+        self.status_interval = status_interval
+        if token is None and unix_socket is None:
+            token = secrets.token_hex(16)
+        self.token = token
+        self.allow_python = allow_python
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)     # Stale socket left by a previous run
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            umask = os.umask(0o177)         # Only our user may connect
+            try:
+                self.listener.bind(unix_socket)
+            finally:
+                os.umask(umask)
+            os.chmod(unix_socket, 0o600)
+        else:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind((host, port))
+        self.address = self.listener.getsockname()
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+        self.clients = []               # replaced rather than modified, so other threads can iterate it
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._ready = deque()           # clients with requests waiting, in round-robin order
+        self._work = Condition()
+        self._urgent = deque()          # (client, request) for estop, stop and pause; guarded by _work
+        self._waits = 0                 # waits in progress for all clients; guarded by _work
+        self._stop = Event()
+        self._threads = []
+        self._event_handle = None
+        self.requests_handled = 0
+
+    def start(self):
+        self._selector.register(self.listener, selectors.EVENT_READ, None)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._event_handle = self.driver.subscribe(self._on_event)
+        for target in (self._io_loop, self._dispatch_loop, self._urgent_loop, self._status_loop):
+            t = Thread(target=target)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup()
+        with self._work:
+            self._work.notify_all()
+        for t in self._threads:
+            t.join(2.)
+        if self._event_handle is not None:
+            self.driver.unsubscribe(self._event_handle)
+        for c in self.clients:
+            c.sock.close()
+        self.listener.close()
+        self._wake_r.close()
+        self._wake_w.close()
+        self._selector.close()
+        if self.unix_socket is not None and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+
+    def _wakeup(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass    # Already a wakeup pending (or shutting down)
+
+    # I/O thread: all socket reads and writes
+
+    def _io_loop(self):
+        while not self._stop.is_set():
+            for c in self.clients:
+                self._update_registration(c)
+            for key, mask in self._selector.select(1.):
+                sock = key.fileobj
+                if sock is self.listener:
+                    self._accept()
+                elif sock is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                else:
+                    c = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(c)
+                    if mask & selectors.EVENT_WRITE and not c.closed:
+                        self._write(c)
+
+    def _update_registration(self, c):
+        if c.closed:
+            return
+        c.fill_outbuf()
+        events = 0
+        if len(c.requests) < MAX_PENDING and len(c.outbuf) < HIGH_WATER:
+            events |= selectors.EVENT_READ
+        if c.outbuf:
+            events |= selectors.EVENT_WRITE
+        if events != c.registered:
+            if c.registered == 0:
+                self._selector.register(c.sock, events, c)
+            elif events == 0:
+                self._selector.unregister(c.sock)
+            else:
+                self._selector.modify(c.sock, events, c)
+            c.registered = events
+
+    def _accept(self):
+        try:
+            sock, addr = self.listener.accept()
+        except (BlockingIOError, OSError):
+            return
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients = self.clients + [_Client(sock, addr)]
+
+    def _close(self, c):
+        if c.closed:
+            return
+        c.closed = True     # (its waits see this, and give up)
+        if c.registered:
+            self._selector.unregister(c.sock)
+            c.registered = 0
+        c.sock.close()
+        self.clients = [x for x in self.clients if x is not c]
+
+    def _refuse(self, c, error, message, req_id=None):
+        """Send c an error reply (after anything already queued for it) if it will go straight away, then close it."""
+        c.fill_outbuf()
+        try:
+            c.sock.send(bytes(c.outbuf) + _encode({'id': req_id, 'ok': False, 'error': error, 'message': message}))
+        except OSError:
+            pass
+        self._close(c)
+
+    def _hello(self, c, req):
+        args = req.get('args') or {}
+        token = args.get('token') if isinstance(args, dict) else None
+        if req.get('op') != 'hello':
+            self._refuse(c, 'GMServerError', "Expected hello", req.get('id'))
+        elif self.token is not None and not (isinstance(token, str) and
+                                             hmac.compare_digest(token.encode("utf-8"), self.token.encode("utf-8"))):
+            self._refuse(c, 'GMServerError', "Wrong token", req.get('id'))
+        else:
+            c.authenticated = True
+            self._reply(c, {'id': req.get('id'), 'ok': True, 'result': None})
+
+    def _read(self, c):
+        try:
+            data = c.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(c)
+            return
+        c.inbuf += data
+        queued = False
+        while not c.closed:
+            i = c.inbuf.find(b"\n")
+            if i < 0:
+                if len(c.inbuf) > MAX_LINE:
+                    self._refuse(c, 'ValueError', "Request too long")
+                break
+            line = bytes(c.inbuf[:i])
+            del c.inbuf[:i+1]
+            if not line.strip():
+                continue
+            try:
+                req = json.loads(line.decode("utf-8"))
+                if not isinstance(req, dict):
+                    raise ValueError("Request must be a JSON object")
+            except ValueError as ex:
+                self._refuse(c, 'ValueError', str(ex))
+                break
+            if not c.authenticated:
+                self._hello(c, req)
+                continue
+            if req.get('op') in _URGENT_OPS:
+                with self._work:
+                    if req.get('op') == 'estop':
+                        self._urgent.appendleft((c, req))
+                    else:
+                        self._urgent.append((c, req))
+                    self._work.notify_all()
+                continue
+            c.requests.append(req)
+            queued = True
+        if queued and not c.closed:
+            with self._work:
+                if c not in self._ready:
+                    self._ready.append(c)
+                self._work.notify_all()
+
+    def _write(self, c):
+        try:
+            n = c.sock.send(c.outbuf)
+        except BlockingIOError:
+            return
+        except OSError:
+            self._close(c)
+            return
+        del c.outbuf[:n]
+
+    # Dispatcher thread: runs requests, one per client in turn
+
+    def _dispatch_loop(self):
+        while True:
+            with self._work:
+                while not self._ready and not self._stop.is_set():
+                    self._work.wait()
+                if self._stop.is_set():
+                    return
+                c = self._ready.popleft()
+                req = c.requests.popleft() if c.requests else None
+                if c.requests:
+                    self._ready.append(c)
+            if req is None or c.closed:
+                continue
+            if req.get('op') == 'wait':
+                with self._work:
+                    if c.waits >= MAX_WAITS:
+                        refuse = "Too many waits in progress (at most %d)" % MAX_WAITS
+                    elif self._waits >= MAX_WAITS_TOTAL:
+                        refuse = "Too many waits in progress on the server (at most %d)" % MAX_WAITS_TOTAL
+                    else:
+                        refuse = None
+                        c.waits += 1
+                        self._waits += 1
+                if refuse is not None:
+                    self._reply(c, {'id': req.get('id'), 'ok': False, 'error': 'GMServerError', 'message': refuse})
+                    continue
+                t = Thread(target=self._handle_wait, args=(c, req))
+                t.daemon = True
+                t.start()
+            else:
+                self._handle(c, req)
+
+    # Urgent thread: runs estop, stop and pause requests as soon as they are read
+
+    def _urgent_loop(self):
+        while True:
+            with self._work:
+                while not self._urgent and not self._stop.is_set():
+                    self._work.wait()
+                if self._stop.is_set():
+                    return
+                c, req = self._urgent.popleft()
+            self._handle(c, req)
+
+    def _handle_wait(self, c, req):
+        try:
+            self._handle(c, req)
+        finally:
+            with self._work:
+                c.waits -= 1
+                self._waits -= 1
+
+    def _handle(self, c, req):
+        req_id = req.get('id')
+        try:
+            op = getattr(self, "_op_" + str(req.get('op')), None)
+            if op is None:
+                raise ValueError("Unknown operation %r" % (req.get('op'),))
+            args = req.get('args') or {}
+            reply = {'id': req_id, 'ok': True, 'result': op(c, **args)}
+        except Exception as ex:
+            reply = {'id': req_id, 'ok': False, 'error': type(ex).__name__, 'message': str(ex)}
+        self.requests_handled += 1
+        self._reply(c, reply)
+
+    def _reply(self, c, reply):
+        try:
+            line = _encode(reply)
+        except (TypeError, ValueError) as ex:
+            line = _encode({'id': reply['id'], 'ok': False, 'error': 'TypeError', 'message': str(ex)})
+        c.replies.append(line)
+        self._wakeup()
+
+    # Status and event fan-out
+
+    def _status_loop(self):
+        last = None
+        while not self._stop.wait(self.status_interval):
+            subscribers = [c for c in self.clients if c.want_status]
+            if not subscribers:
+                last = None
+                continue
+            try:
+                status = status_dict(self.driver)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if status == last:
+                continue
+            last = status
+            status = dict(status, type='status', time=time.time())
+            line = _encode(status)
+            for c in subscribers:
+                c.status_line = line    # Replaces any the client hasn't taken yet
+            self._wakeup()
+
+    def _on_event(self, ev):
+        line = None
+        for c in self.clients:
+            f = c.event_filter
+            if f is None or (f[0] is not None and ev.kind not in f[0]) or (f[1] is not None and ev.axis != f[1]):
+                continue
+            if line is None:
+                line = _encode({'type': 'event', 'kind': ev.kind, 'axis': ev.axis, 'n': ev.n, 'value': ev.value,
+                                'sample_time': ev.sample_time})
+            if len(c.events) >= MAX_EVENTS:
+                c.events.popleft()
+                c.events_dropped += 1
+            c.events.append(line)
+        if line is not None:
+            self._wakeup()
+
+    # Operations
+
+    def _op_ping(self, c):
+        return "pong"
+
+    def _op_load(self, c, program=None, params=None, programs=None):
+        if programs is not None:
+            self.driver.load_programs(programs, params, self.allow_python)
+        else:
+            self.driver.load_program(program, params, self.allow_python)
+
+    def _op_params(self, c, values):
+        self.driver.set_params(**values)
+
+    def _op_run(self, c, entry=None):
+        self.driver.run(entry)
+
+    def _op_pause(self, c):
+        self.driver.pause()
+
+    def _op_resume(self, c):
+        self.driver.resume()
+
+    def _op_stop(self, c):
+        self.driver.stop()
+
+    def _op_estop(self, c):
+        self.driver.estop()
+
+    def _op_status(self, c):
+        return dict(status_dict(self.driver), time=time.time())
+
+    def _op_wait(self, c, what, timeout=None, target=None, axis=None, n=None, state=True, min=None, max=None):
+        drv = self.driver
+        if what == "program":
+            wait = lambda t: not drv.is_running() or drv.wait_for_program(t)
+        elif what == "pc":
+            wait = lambda t: drv.wait_for_pc(target, t)
+        elif what == "input":
+            wait = lambda t: drv.wait_for_input(axis, n, state, t)
+        elif what == "position":
+            lo = float("-inf") if min is None else min
+            hi = float("inf") if max is None else max
+            wait = lambda t: drv.wait_for_position(axis, lambda pos: lo <= pos <= hi, t)
+        else:
+            raise ValueError("Unknown wait %r" % (what,))
+        # Wait in slices, so as to give up soon after the client has gone
+        deadline = time.monotonic() + (DEFAULT_WAIT_TIMEOUT if timeout is None else timeout)
+        while True:
+            remaining = deadline - time.monotonic()
+            if wait(WAIT_SLICE if remaining > WAIT_SLICE else remaining if remaining > 0. else 0.):
+                return True
+            if remaining <= WAIT_SLICE or c.closed or self._stop.is_set():
+                return False
+
+    def _op_subscribe(self, c, status=True, events=False, kinds=None, axis=None):
+        if kinds is not None:
+            kinds = frozenset([kinds] if isinstance(kinds, str) else kinds)
+            for k in kinds:
+                if k not in DeviceEvent.KINDS:
+                    raise ValueError("Unknown event kind %r" % (k,))
+        c.want_status = bool(status)
+        c.event_filter = (kinds, axis) if events else None
+
+    def _op_unsubscribe(self, c):
+        c.want_status = False
+        c.event_filter = None
+        c.status_line = None
+
+
+class GMClient(object):
+    """Client for a GMServer, on the unix domain socket path unix_socket, or on host:port if port is given.  token
+    is the server's token; for TCP, it is read with read_token_file() if not given.
+
+    call() sends a request and returns its result, raising the gm_api exception (or GMServerError) for an error
+    reply.  It may be called from several threads at once.  on_status and on_event, if given, are called with
+    each status and event message dict (from the client's receiver thread, so they should not call call()).
+    """
+    def __init__(self, unix_socket=DEFAULT_SOCKET, host="127.0.0.1", port=None, on_status=None, on_event=None,
+                 token=None):
+        if port is not None:
+            unix_socket = None
+        elif unix_socket is None:
+            port = DEFAULT_PORT
+        if unix_socket is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_socket)
+        else:
+            self.sock = socket.create_connection((host, port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.on_status = on_status
+        self.on_event = on_event
+        self.status = None          # most recent status message
+        self.events_dropped = 0
+        self._send_lock = Lock()
+        self._pending = {}          # id -> [Event, reply]
+        self._next_id = 0
+        self._closed = False
+        self._receiver = Thread(target=self._receive_loop)
+        self._receiver.daemon = True
+        self._receiver.start()
+        if token is None and unix_socket is None:
+            token = read_token_file()
+        try:
+            self.call('hello', token=token)
+        except Exception:
+            self.close()
+            raise
+
+    def call(self, op, **args):
+        slot = [Event(), None]
+        with self._send_lock:
+            if self._closed:
+                raise ConnectionError("Connection to server closed")
+            self._next_id += 1
+            req_id = self._next_id
+            self._pending[req_id] = slot
+            self.sock.sendall(_encode({'id': req_id, 'op': op, 'args': args}))
+        slot[0].wait()
+        reply = slot[1]
+        if reply is None:
+            raise ConnectionError("Connection to server closed")
+        if reply['ok']:
+            return reply.get('result')
+        from . import gm_api
+        exc = _ERRORS.get(reply['error']) or getattr(gm_api, reply['error'], None)
+        if isinstance(exc, type) and issubclass(exc, Exception):
+            raise exc(reply['message'])
+        raise GMServerError(reply['error'], reply['message'])
+
+    def _receive_loop(self):
+        f = self.sock.makefile("rb")
+        try:
+            for line in f:
+                msg = json.loads(line.decode("utf-8"))
+                typ = msg.get('type')
+                if typ is None:
+                    slot = self._pending.pop(msg.get('id'), None)
+                    if slot is not None:
+                        slot[1] = msg
+                        slot[0].set()
+                elif typ == 'status':
+                    self.status = msg
+                    if self.on_status is not None:
+                        self.on_status(msg)
+                elif typ == 'event':
+                    if self.on_event is not None:
+                        self.on_event(msg)
+                elif typ == 'dropped':
+                    self.events_dropped += msg['events']
+        except (OSError, ValueError):
+            pass
+        with self._send_lock:
+            self._closed = True
+        for slot in list(self._pending.values()):
+            slot[0].set()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._receiver.join(1.)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Convenience wrappers
+
+    def load_program(self, program, params=None):
+        self.call('load', program=program, params=params)
+
+    def load_programs(self, programs, params=None):
+        self.call('load', programs=programs, params=params)
+
+    def set_params(self, **values):
+        self.call('params', values=values)
+
+    def run(self, entry=None):
+        self.call('run', entry=entry)
+
+    def pause(self):
+        self.call('pause')
+
+    def resume(self):
+        self.call('resume')
+
+    def stop(self):
+        self.call('stop')
+
+    def estop(self):
+        self.call('estop')
+
+    def get_status(self):
+        return self.call('status')
+
+    def wait(self, what, timeout=None, **args):
+        return self.call('wait', what=what, timeout=timeout, **args)
+
+    def subscribe(self, status=True, events=False, kinds=None, axis=None):
+        self.call('subscribe', status=status, events=events, kinds=kinds, axis=axis)
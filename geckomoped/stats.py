@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Low-overhead comms instrumentation (see RS485Devices.stats and GeckoDriver.get_stats()).
+"""
+import time
+
+
+class LatencyHistogram(object):
+    """HDR-style histogram of durations, with microsecond resolution.
+
+    Values below 2**(SUB_BITS+1) us get a bucket each.  Above that, each power of two is split into
+    2**SUB_BITS linear sub-buckets, so the bucket width is never more than 1/16 of the value.  This covers up
+    to about 4 minutes with a fixed list of counts; longer durations land in the last bucket.  Recording
+    a value is a handful of integer operations, so it can be left on all the time.
+    """
+    SUB_BITS = 4
+    SUB_COUNT = 1 << SUB_BITS
+    N_BUCKETS = 384
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    @classmethod
+    def _index(cls, us):
+        if us < 2 * cls.SUB_COUNT:
+            return us
+        shift = us.bit_length() - cls.SUB_BITS - 1
+        return min((shift << cls.SUB_BITS) + (us >> shift), cls.N_BUCKETS - 1)
+
+    @classmethod
+    def _upper_bound(cls, idx):
+        """Largest value (us) which maps to bucket idx"""
+        if idx < 2 * cls.SUB_COUNT:
+            return idx
+        shift = (idx >> cls.SUB_BITS) - 1
+        return (((idx & (cls.SUB_COUNT - 1)) + cls.SUB_COUNT + 1) << shift) - 1
+
+    def record(self, seconds):
+        """Add one duration (in seconds)"""
+        us = int(seconds * 1000000.)
+        if us < 0:
+            us = 0
+        self.counts[self._index(us)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Return duration (seconds) below which fraction q of the recorded values lie, or None if empty.
+        The result is the upper bound of the bucket containing it, capped at the largest recorded value.
+        """
+        if not self.count:
+            return None
+        target = max(1, int(q * self.count + 0.5))
+        n = 0
+        for idx, c in enumerate(self.counts):
+            n += c
+            if n >= target:
+                return min(self._upper_bound(idx) * 0.000001, self.max)
+        return self.max
+
+    def snapshot(self):
+        """Return summary as a dict (all times in seconds)"""
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'p999': self.quantile(0.999),
+            }
+
+
+class CommsStats(object):
+    """Counters and histograms for one RS485Devices object.  These are only updated by the comms thread.
+    Readers take a snapshot(); to reset, replace the whole object (see GeckoDriver.get_stats()).
+    """
+    COUNTERS = (
+        'commands',         # Command frames written
+        'bytes_tx',
+        'bytes_rx',
+        'timeouts',         # Reads which received nothing at all
+        'short_reads',      # Reads which received some, but not all, of the expected bytes
+        'resyncs',          # Unsolicited data received, requiring re-query of the bus
+        'not_responding',   # "Device not responding" detected in a status query
+        'inconsistent_pc',  # "Device at inconsistent program counter" detected in a status query
+        'device_errors',    # Device signalling an error flag
+        'rediscoveries',    # Bus re-queried to find the attached devices
+        'framing_errors',   # Status responses which had to be realigned, or had records dropped, by the framer
+        'realignments',     # ... of which some records were recovered
+        'recoveries',       # Returns to good status responses after bad ones, without re-discovering the bus
+        'reconnects',       # Links re-opened after being lost (see GeckoDriver.set_auto_reconnect())
+        )
+    JITTER_WEIGHT = 1./16   # Weight of each new interval in the running mean used for tick_jitter
+
+    def __init__(self):
+        self.start_time = time.time()
+        for c in self.COUNTERS:
+            setattr(self, c, 0)
+        self.write_time = {}    # Command name -> LatencyHistogram of time spent writing the frame
+        self.expect_time = {}   # Command name -> LatencyHistogram of time spent waiting for the response
+        self.tick_interval = LatencyHistogram()     # Time between comms ticks (idle_func() calls)
+        self.tick_jitter = LatencyHistogram()       # Deviation of tick interval from its running mean
+        self._last_tick = None
+        self._mean_interval = None
+
+    def record_write(self, name, seconds, nbytes):
+        h = self.write_time.get(name)
+        if h is None:
+            h = self.write_time[name] = LatencyHistogram()
+        h.record(seconds)
+        self.commands += 1
+        self.bytes_tx += nbytes
+
+    def record_expect(self, name, seconds, expected, received):
+        h = self.expect_time.get(name)
+        if h is None:
+            h = self.expect_time[name] = LatencyHistogram()
+        h.record(seconds)
+        if not received:
+            self.timeouts += 1
+        elif received < expected:
+            self.short_reads += 1
+
+    def record_tick(self, t):
+        """Call at the start of each tick with time.perf_counter()"""
+        if self._last_tick is not None:
+            interval = t - self._last_tick
+            self.tick_interval.record(interval)
+            if self._mean_interval is None:
+                self._mean_interval = interval
+            else:
+                self.tick_jitter.record(abs(interval - self._mean_interval))
+                self._mean_interval += (interval - self._mean_interval) * self.JITTER_WEIGHT
+        self._last_tick = t
+
+    def snapshot(self):
+        """Return everything as a dict of plain values (times in seconds)"""
+        d = dict((c, getattr(self, c)) for c in self.COUNTERS)
+        d['start_time'] = self.start_time
+        d['elapsed'] = time.time() - self.start_time
+        d['write_time'] = dict((k, h.snapshot()) for k, h in list(self.write_time.items()))
+        d['expect_time'] = dict((k, h.snapshot()) for k, h in list(self.expect_time.items()))
+        d['tick_interval'] = self.tick_interval.snapshot()
+        d['tick_jitter'] = self.tick_jitter.snapshot()
+        return d
+
+
+class RttEstimator(object):
+    """Smoothed round-trip time and its variation, as for TCP's retransmission timer (RFC 6298).
+    Times in seconds.
+    """
+    ALPHA = 1./8
+    BETA = 1./4
+    K = 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.backoff = 1        # Multiplier, doubled after each response which timed out entirely
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.
+        else:
+            self.rttvar += (abs(self.srtt - rtt) - self.rttvar) * self.BETA
+            self.srtt += (rtt - self.srtt) * self.ALPHA
+        self.samples += 1
+        self.backoff = 1
+
+    def rto(self):
+        """Timeout, or None if there have been no samples yet"""
+        if self.srtt is None:
+            return None
+        return (self.srtt + self.K * self.rttvar) * self.backoff
+
+
+class ResponseTimeouts(object):
+    """Per-command response timeouts for RS485Devices.expect(), learned from measured response times.
+
+    Each response time is split into the fixed turnaround (from the end of the command to the first byte of
+    the response, including any USB or network latency) and the time to receive the frame at the bus baud
+    rate.  The turnaround is estimated per command by an RttEstimator, and the timeout for a read is its
+    RTO plus the time to receive the expected number of bytes, between MIN_TIMEOUT and the configured
+    maximum.  Only complete responses are sampled, since a short or missing response just measures the
+    timeout itself.  A read which gets nothing at all doubles that command's timeout (up to the maximum),
+    until the next complete response.
+    """
+    BYTE_TIME = 10. / 115200    # Seconds per byte on the bus (8N1 at 115200 baud)
+    MIN_TIMEOUT = 0.003
+
+    def __init__(self):
+        self.estimators = {}    # Command name -> RttEstimator
+
+    def timeout(self, name, nbytes, max_timeout):
+        est = self.estimators.get(name)
+        rto = est.rto() if est is not None else None
+        if rto is None:
+            return max_timeout
+        return min(max_timeout, max(self.MIN_TIMEOUT, rto + nbytes * self.BYTE_TIME))
+
+    def record(self, name, seconds, expected, received):
+        est = self.estimators.get(name)
+        if est is None:
+            est = self.estimators[name] = RttEstimator()
+        if received >= expected:
+            est.sample(max(0., seconds - received * self.BYTE_TIME))
+        elif not received and est.srtt is not None:
+            est.backoff = min(est.backoff * 2, 64)
+
+    def snapshot(self):
+        return dict((name, {'srtt': est.srtt, 'rttvar': est.rttvar, 'rto': est.rto(), 'samples': est.samples})
+                    for name, est in list(self.estimators.items()))
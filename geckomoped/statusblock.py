@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Device status snapshot in a shared memory block, for reading from other processes without any IPC.
+
+The driver writes the block after every comms tick (see GeckoDriver.publish_status()).  Any process on
+the same machine can read it with a StatusReader, which takes a few microseconds and never involves the
+driver or its comms lock:
+
+    reader = StatusReader("gm_cell1")
+    snap = reader.read()
+    print(snap.time, snap.position(0))
+
+Layout (little-endian, fixed size):
+
+    header  <IIdIBBBBiI magic, seq, time, program_id, connected, state, stepping, n_devs, addr, pid
+    axis    <BxHHxxiii  present, flags, pc, pos, vel, offset        (x4, for axes X-W)
+
+time is the time.time() at which the snapshot was written.  program_id changes each time a new program is
+loaded into the driver.  state and stepping are the Devices state machine values, and addr is the overall
+program counter.  pid is the process which created the block.  Axis fields are as for Device; absent axes
+have present = 0.
+
+seq is a sequence lock: the writer makes it odd before updating the block, and even again afterwards, so
+a reader which sees seq change (or odd) while it was copying the block knows the copy may be torn, and
+tries again.
+"""
+from multiprocessing import shared_memory
+import os
+import struct
+import time
+
+from .devices import Devices, Device
+
+
+MAGIC = 0x474D5333      # "GMS3"
+
+_HEADER = struct.Struct("<IIdIBBBBiI")
+_AXIS = struct.Struct("<BxHHxxiii")
+_SEQ = struct.Struct("<I")
+_SEQ_OFFSET = 4
+
+SIZE = _HEADER.size + 4 * _AXIS.size
+
+
+class StatusSnapshot(object):
+    """One consistent copy of the status block."""
+    __slots__ = ('seq', 'time', 'program_id', 'connected', 'state', 'stepping', 'n_devs', 'addr', 'axes')
+
+    def __init__(self, seq, time, program_id, connected, state, stepping, n_devs, addr, axes):
+        self.seq = seq
+        self.time = time
+        self.program_id = program_id
+        self.connected = connected
+        self.state = state
+        self.stepping = stepping
+        self.n_devs = n_devs
+        self.addr = addr
+        self.axes = axes    # List of 4 (flags, pc, pos, vel, offset) tuples, or None for absent axes
+
+    def state_name(self):
+        return Devices.states[self.state]
+
+    def is_running(self):
+        return self.stepping in (Devices.RUN_UNTIL_BREAK, Devices.RUN_FLASH)
+
+    def _axis(self, axis_index):
+        a = self.axes[axis_index]
+        if a is None:
+            raise ValueError("Axis out of range!")
+        return a
+
+    def position(self, axis_index):
+        """Axis position, as for GeckoDriver.get_axis_position()"""
+        return self._axis(axis_index)[2]
+
+    def velocity(self, axis_index):
+        return self._axis(axis_index)[3]
+
+    def flags(self, axis_index):
+        return self._axis(axis_index)[0]
+
+    def input_active(self, axis_index, n):
+        """Whether input n (1..3) of the axis is on"""
+        return not (self._axis(axis_index)[0] & (Device.FLG_IN1, Device.FLG_IN2, Device.FLG_IN3)[n-1])
+
+    def age(self):
+        """Seconds since the snapshot was written"""
+        return time.time() - self.time
+
+
+def _read_block(buf, retries):
+    for _ in range(retries):
+        seq = _SEQ.unpack_from(buf, _SEQ_OFFSET)[0]
+        if seq & 1:
+            continue
+        data = bytes(buf[:SIZE])
+        if _SEQ.unpack_from(buf, _SEQ_OFFSET)[0] != seq:
+            continue
+        magic, seq, t, program_id, connected, state, stepping, n_devs, addr, pid = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a GeckoMoped status block (or a different version)")
+        axes = []
+        for offset in range(_HEADER.size, SIZE, _AXIS.size):
+            a = _AXIS.unpack_from(data, offset)
+            axes.append(a[1:] if a[0] else None)
+        return StatusSnapshot(seq, t, program_id, bool(connected), state, stepping, n_devs, addr, axes)
+    return None
+
+
+def _untrack(shm):
+    """Before Python 3.13, attaching to a block registers it with this process's resource tracker, as though we
+    had created it, so it would be unlinked (from under its creator) when we exit.  Undo that."""
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+def _is_stale(name):
+    """Whether the existing block name was left behind by a process which has exited.  Blocks which aren't
+    ours (wrong magic), or whose creator can't be checked, are not known to be stale."""
+    if os.name == "nt":
+        return False    # Windows removes a block as soon as nobody has it open, so it can't be stale
+    shm = shared_memory.SharedMemory(name=name)
+    header = _HEADER.unpack_from(shm.buf, 0) if len(shm.buf) >= SIZE else (0, 0)
+    shm.close()
+    magic, pid = header[0], header[-1]
+    if pid == os.getpid():
+        return False    # Ours (so it was already registered with our resource tracker)
+    _untrack(shm)
+    if magic != MAGIC:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        pass        # (e.g. PermissionError: it exists, but belongs to someone else)
+    return False
+
+
+class StatusBlock(object):
+    """Writer's side of the shared memory status block.  Creates the block (with the given name, or a
+    generated one), or attaches to an existing one with create=False.  Only one thread may write.
+    A block created here is removed by close().
+
+    Creating a block which already exists raises FileExistsError, unless it was left behind by a process
+    which has since exited (in which case it is replaced), so that one driver can't take over another's.
+    """
+    def __init__(self, name=None, create=False):
+        if create:
+            try:
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+            except FileExistsError:
+                if not _is_stale(name):
+                    raise FileExistsError("Status block %r is in use by another process" % name)
+                # Left over from a process which didn't shut down cleanly
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+                self.shm = shared_memory.SharedMemory(name=name, create=True, size=SIZE)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.owner = create
+        self.seq = 0
+        if create:
+            self.pid = os.getpid()
+            self.buf[:SIZE] = bytes(SIZE)
+            _HEADER.pack_into(self.buf, 0, MAGIC, 0, 0., 0, 0, 0, 0, 0, 0, self.pid)
+        else:
+            self.pid = _HEADER.unpack_from(self.buf, 0)[-1]
+
+    def write(self, devices, connected):
+        """Publish the current status of devices (a Devices object)."""
+        buf = self.buf
+        self.seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self.seq & 0xFFFFFFFF)    # odd: update in progress
+        _HEADER.pack_into(buf, 0, MAGIC, self.seq & 0xFFFFFFFF, time.time(), devices.program_id & 0xFFFFFFFF,
+                          int(bool(connected)), devices.state, devices.stepping, devices.n_devs, devices.addr,
+                          self.pid)
+        offset = _HEADER.size
+        for d in devices.devs:
+            if d is None:
+                _AXIS.pack_into(buf, offset, 0, 0, 0, 0, 0, 0)
+            else:
+                _AXIS.pack_into(buf, offset, 1, d.flags, d.pc, int(d.pos), d.vel, d.offset)
+            offset += _AXIS.size
+        self.seq += 1
+        _SEQ.pack_into(buf, _SEQ_OFFSET, self.seq & 0xFFFFFFFF)    # even: consistent
+
+    def read(self, retries=100):
+        """Return a consistent StatusSnapshot, or None if the writer was busy for all of the retries."""
+        return _read_block(self.buf, retries)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class StatusReader(object):
+    """Reads a status block published by another process (see GeckoDriver.publish_status()).
+
+    Raises FileNotFoundError if there is no block with that name (yet).
+    """
+    def __init__(self, name):
+        self.shm = shared_memory.SharedMemory(name=name)
+        _untrack(self.shm)
+        self.name = name
+        self.buf = self.shm.buf
+
+    def read(self, retries=1000):
+        """Return a consistent StatusSnapshot, or None if the writer was busy for all of the retries."""
+        return _read_block(self.buf, retries)
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Speed streaming: updating an axis's SPEED CONTROL setting from outside a program, e.g. for closed-loop
+tension control (see GeckoDriver.stream_speed()).
+
+Each update is a single SPEED CONTROL insn, encoded directly (with the same packing as the assembler's
+SpeedControlInsn) and sent for immediate execution.  Updates are not sent as they arrive: the comms thread
+sends the latest one at each deadline of the stream's schedule (between its status queries), so a source
+which updates faster than the stream rate, or while the bus is busy, is coalesced down to one insn per
+deadline rather than queueing up behind it.
+"""
+from threading import Lock
+import time
+
+from .assemble import SpeedControlInsn
+from .stats import LatencyHistogram
+
+
+SPEED_MIN = -0x800000
+SPEED_MAX = 0x7FFFFF
+
+
+def speed_control_word(axis, speed):
+    """Return the insn word for "axis SPEED CONTROL speed" (axis 0..3 for X..W)."""
+    if speed < SPEED_MIN or speed > SPEED_MAX:
+        raise ValueError("Speed control %f out of range" % float(speed))
+    return SpeedControlInsn(None, None, axis, speed).get_binary()
+
+
+class SpeedStream(object):
+    """Schedule and statistics of one axis's speed stream."""
+
+    def __init__(self, axis, rate):
+        self.axis = axis
+        self.rate = rate
+        self.period = 1. / rate
+        self._lock = Lock()
+        self._pending = None            # (word, time.perf_counter() of the update) waiting to be sent
+        self.next_deadline = time.perf_counter()
+        self.start_time = self.next_deadline
+        self.updates = 0
+        self.sent = 0
+        self.coalesced = 0              # Updates replaced by a later one before they could be sent
+        self.missed = 0                 # Deadlines passed without a chance to send
+        self.last_speed = None
+        self.latency = LatencyHistogram()   # From update() to the insn being written
+
+    def update(self, speed):
+        """Set the speed to send at the next deadline.  May be called from any thread."""
+        word = speed_control_word(self.axis, speed)
+        with self._lock:
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (word, time.perf_counter())
+            self.updates += 1
+            self.last_speed = speed
+
+    def due(self, now, slack=0.):
+        """Called by the comms thread each tick.  Returns (word, update time) to send now, or None.  slack is how
+        early a deadline may be met (half the comms tick, so that one just after a tick is met by that tick rather
+        than the next)."""
+        if now < self.next_deadline - slack:
+            return None
+        # Next deadline on the schedule, skipping any which have already passed
+        late = max(int((now - self.next_deadline) / self.period), 0)
+        self.missed += late
+        self.next_deadline += (late + 1) * self.period
+        return self.take()
+
+    def take(self):
+        """Returns the pending (word, update time), or None, regardless of the schedule."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending
+
+    def sent_at(self, t, update_time):
+        self.sent += 1
+        self.latency.record(t - update_time)
+
+    def get_stats(self):
+        elapsed = time.perf_counter() - self.start_time
+        return {
+            'axis': self.axis,
+            'rate': self.rate,
+            'achieved_rate': self.sent / elapsed if elapsed > 0. else 0.,
+            'updates': self.updates,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'missed_deadlines': self.missed,
+            'speed': self.last_speed,
+            'latency': self.latency.snapshot(),
+            'elapsed': elapsed,
+            }
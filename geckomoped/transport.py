@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Byte stream transports between RS485Devices and the bus.
+
+A Transport is what RS485Devices reads and writes: a local serial port (SerialTransport), or a TCP
+connection to a serial-to-Ethernet bridge such as ser2net (TcpTransport).  open_transport() picks one
+from the device name, so "tcp://host:port" (or "socket://host:port", as pyserial spells it) can be used
+wherever a serial port name can.
+
+Reads take an explicit timeout, rather than the caller setting it on the port before each read.  Writes
+may be buffered until flush() (or the next read), so a command frame written in pieces still goes out
+in one packet.
+"""
+import os
+import select
+import socket
+import time
+
+import serial
+
+
+class TransportError(serial.SerialException):
+    """I/O error on a transport.  A SerialException, so that existing serial error handling covers it."""
+    pass
+
+
+class Transport(object):
+    """Base class for transports."""
+    name = None
+
+    def read(self, n, timeout):
+        """Read up to n bytes, waiting at most timeout seconds (0 to only return what has already arrived)
+        for all n to arrive.  Returns the bytes read, possibly fewer than n (or none) on timeout.
+        """
+        raise NotImplementedError()
+
+    def write(self, data):
+        """Write data, or buffer it to be written by flush()."""
+        raise NotImplementedError()
+
+    def flush(self):
+        """Make sure everything written so far is on its way."""
+        pass
+
+    def close(self):
+        pass
+
+
+class SerialTransport(Transport):
+    """Local serial port, via pyserial."""
+
+    def __init__(self, devname, baudrate=115200):
+        self.name = devname
+        self.port = serial.Serial(devname, baudrate, timeout=0.02)
+        self._timeout = 0.02
+
+    def read(self, n, timeout):
+        if timeout != self._timeout:
+            # Setting the timeout reconfigures the port (a tcsetattr() on POSIX), so only do it when it changes
+            self.port.timeout = timeout
+            self._timeout = timeout
+        return self.port.read(n)
+
+    def write(self, data):
+        self.port.write(data)
+
+    def flush(self):
+        self.port.flush()
+
+    def close(self):
+        self.port.close()
+
+
+class TcpTransport(Transport):
+    """TCP connection to a serial-to-Ethernet bridge (raw TCP, e.g. ser2net in raw mode).
+
+    Nagle's algorithm is disabled, since every command waits for a response.  Instead, writes are
+    buffered until flush() or the next read() and then sent together.
+    """
+    RECV_SIZE = 4096
+
+    def __init__(self, host, port, connect_timeout=2.):
+        self.name = "tcp://%s:%d" % (host, port)
+        try:
+            self.sock = socket.create_connection((host, port), connect_timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            self.sock.setblocking(False)
+        except OSError as ex:
+            raise TransportError("Could not connect to %s: %s" % (self.name, ex))
+        self._rxbuf = bytearray()
+        self._txbuf = bytearray()
+
+    def _recv(self):
+        try:
+            data = self.sock.recv(self.RECV_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as ex:
+            raise TransportError("Read from %s failed: %s" % (self.name, ex))
+        if not data:
+            raise TransportError("Connection to %s closed" % (self.name,))
+        self._rxbuf += data
+
+    def read(self, n, timeout):
+        if self._txbuf:
+            self.flush()
+        deadline = None
+        while len(self._rxbuf) < n:
+            if deadline is None:
+                # Take whatever has already arrived first
+                self._recv()
+                if len(self._rxbuf) >= n:
+                    break
+                deadline = time.monotonic() + timeout
+            remaining = deadline - time.monotonic()
+            if remaining <= 0.:
+                break
+            if select.select([self.sock], [], [], remaining)[0]:
+                self._recv()
+        x = bytes(self._rxbuf[:n])
+        del self._rxbuf[:n]
+        return x
+
+    def write(self, data):
+        self._txbuf += data
+
+    def flush(self):
+        if not self._txbuf:
+            return
+        data, self._txbuf = self._txbuf, bytearray()
+        view = memoryview(data)
+        while view:
+            try:
+                sent = self.sock.send(view)
+            except BlockingIOError:
+                select.select([], [self.sock], [], 1.)
+                continue
+            except OSError as ex:
+                raise TransportError("Write to %s failed: %s" % (self.name, ex))
+            view = view[sent:]
+
+    def close(self):
+        try:
+            self.flush()
+        except TransportError:
+            pass
+        self.sock.close()
+
+
+def parse_tcp_url(devname):
+    """Return (host, port) if devname is a tcp:// or socket:// URL, else None."""
+    for prefix in ("tcp://", "socket://"):
+        if devname.startswith(prefix):
+            hostport = devname[len(prefix):].split('?')[0].rstrip('/')
+            host, sep, port = hostport.rpartition(':')
+            if not sep or not port.isdigit():
+                raise TransportError("%s: expected %shost:port" % (devname, prefix))
+            return host.strip('[]'), int(port)
+    return None
+
+
+def open_transport(devname):
+    """Open a transport for devname: a tcp://host:port (or socket://host:port) URL, else a serial port."""
+    addr = parse_tcp_url(devname)
+    if addr is not None:
+        return TcpTransport(*addr)
+    return SerialTransport(devname)
+
+
+BY_ID_DIR = "/dev/serial/by-id"
+
+
+def stable_port_path(devname):
+    """Return a name for the serial port devname which will still find the same adapter if it is unplugged
+    and re-enumerated (e.g. as /dev/ttyUSB1 instead of /dev/ttyUSB0): its link under /dev/serial/by-id,
+    if it has one (Linux only).  Otherwise, returns devname.
+    """
+    if parse_tcp_url(devname) is not None or not os.path.isdir(BY_ID_DIR):
+        return devname
+    if os.path.dirname(os.path.abspath(devname)) == BY_ID_DIR:
+        return devname
+    try:
+        real = os.path.realpath(devname)
+        for name in sorted(os.listdir(BY_ID_DIR)):
+            path = os.path.join(BY_ID_DIR, name)
+            if os.path.realpath(path) == real:
+                return path
+    except OSError:
+        pass
+    return devname
@@ -13,7 +13,7 @@ setup(
 
 	# source info
 	packages=['geckomoped'],
-	scripts=['bin/gmgui.py', 'bin/gmexec.py'],
+	scripts=['bin/gmgui.py', 'bin/gmexec.py', 'bin/gmreplay.py', 'bin/gmserver.py'],
 	url='https://github.com/USCRPL/GeckoMoped',
 	package_data={
 		'': ['geckomoped/gm.glade', 'geckomoped/images/*']
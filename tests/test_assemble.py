@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Code: changing ${name} parameters in place, and linking several programs."""
+import io
+
+import pytest
+
+from geckomoped.assemble import Code, CodeError
+from geckomoped.mockui import MockTab
+
+
+SOURCE = """x velocity ${feed=400}
+y acceleration ${acc}
+top:
+x+${dist=100}, y-${dist}
+x configure: ${amps=2.5} amps, idle at ${pct=50}% after 1.0 seconds
+goto top, loop ${n=2} times
+"""
+
+
+class Options(object):
+    """Just the project settings which the assembler looks at."""
+    libsearch = []      # (set by the link tests)
+
+    class p(object):
+        error_threshold = 100
+
+
+class TabManager(object):
+    """Opens imported files as tabs."""
+    def get_tab(self, filename, open=True):
+        with io.open(filename) as f:
+            return tab(filename, f.read(), self)
+
+
+def tab(filename, text, mgr=None):
+    t = MockTab()
+    t.filename = filename
+    t.set_text(text)
+    t.mgr = mgr or TabManager()
+    return t
+
+
+def assemble(params):
+    code = Code()
+    assert code.assemble(tab("params.gm", SOURCE), Options, params)
+    return code
+
+
+def binary(code):
+    return [insn.get_binary() for insn in code.obj]
+
+
+def test_defaults_and_given_values():
+    code = assemble({'acc': 50, 'feed': 300})
+    assert code.get_params() == dict(feed=300, acc=50, dist=100, amps=2.5, pct=50, n=2)
+
+
+def test_parameter_without_a_value_is_an_error():
+    code = Code()
+    assert not code.assemble(tab("params.gm", SOURCE), Options)
+    errors = [code.get_error_text(i) for i in range(code.semantic_error_count())]
+    assert any("Parameter 'acc' has no value" in e for e in errors)
+
+
+def test_set_params_matches_assembling_again():
+    code = assemble({'acc': 50})
+    code.encode()
+    code.get_image()
+    values = dict(dist=10, feed=200, n=1, amps=3)
+    code.set_params(values)
+    fresh = assemble(dict(values, acc=50))
+    assert binary(code) == binary(fresh)
+    assert code.get_image() == fresh.get_image()
+    assert [code.binary_from_address(a)[0] for a in range(len(code.obj))] == \
+        [fresh.binary_from_address(a)[0] for a in range(len(fresh.obj))]
+    assert code.get_params()['dist'] == 10
+    assert code.get_params()['amps'] == 3.
+
+
+def test_parameter_used_as_float_and_int():
+    source = "x configure: ${a=2} amps, idle at 50% after 1.0 seconds\nx+${a}\n"
+    code = Code()
+    assert code.assemble(tab("mixed.gm", source), Options)
+    code.set_params({'a': 3})
+    fresh = Code()
+    assert fresh.assemble(tab("mixed.gm", source), Options, {'a': 3})
+    assert binary(code) == binary(fresh)
+    assert code.get_params() == fresh.get_params() == {'a': 3}
+
+
+def test_unknown_parameter():
+    code = assemble({'acc': 50})
+    with pytest.raises(KeyError):
+        code.set_params({'nope': 1})
+
+
+@pytest.mark.parametrize("values", [
+    dict(feed="x"),             # wrong type
+    dict(dist=1 << 24),         # out of range
+    dict(n=0),
+    dict(dist=5, amps=9.),      # (dist is valid, but must not be changed either)
+])
+def test_invalid_values_change_nothing(values):
+    code = assemble({'acc': 50})
+    before, params = binary(code), code.get_params()
+    with pytest.raises(CodeError):
+        code.set_params(values)
+    assert binary(code) == before
+    assert code.get_params() == params
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """A library folder with common.gm and util.gm, on the search path."""
+    (tmp_path / "common.gm").write_text("nudge:\nx+5\nreturn\n")
+    (tmp_path / "util.gm").write_text("wiggle:\ny+1\nreturn\n")
+    monkeypatch.setattr(Options, "libsearch", [str(tmp_path)])
+    return tmp_path
+
+
+PROGRAMS = [
+    ("cut", "import 'common.gm' as lib\nimport 'util.gm'\nx+100\ncall lib.nudge\ncall wiggle\ny+7\n"),
+    ("drill", "import 'common.gm' as lib\nimport 'util.gm'\ny-50\ncall lib.nudge\nloop:\ncall wiggle\ngoto loop, loop 2 times\n"),
+    ("plain", "x-10\nloop:\nx+1\n"),
+]
+
+
+def link(programs=PROGRAMS):
+    code = Code()
+    ok = code.link([(name, tab(name, text)) for name, text in programs], Options)
+    return code, ok
+
+
+def test_link(library):
+    code, ok = link()
+    assert ok
+    assert code.entries == dict(cut=0, drill=9, plain=14)
+    assert code.get_obj_len() == 17
+    # Each library (two insns) is located once, after the first program which needs it
+    sources = [insn.get_tab().filename for insn in code.obj]
+    assert sources.count(str(library / "common.gm")) == 2
+    assert sources.count(str(library / "util.gm")) == 2
+    assert sources[5] == str(library / "common.gm")
+
+
+def test_programs_may_use_the_same_labels(library):
+    code, _ = link()
+    assert code.address_of_entry("drill") == 9
+    assert code.address_of_entry("drill.loop") == 11
+    assert code.address_of_entry("plain.loop") == 15
+    assert code.address_of_entry("nope") is None
+
+
+def test_each_program_ends(library):
+    code, _ = link()
+    for end in (4, 13, 16):
+        assert code.is_end_at(end)
+        assert code.binary_from_address(end)[0] is None
+        assert code.err == "End of program at address %d" % end
+        code.err = None
+    assert not code.is_end_at(3)
+    assert code.binary_from_address(3)[0] is not None
+    assert code.is_end_at(code.get_obj_len())
+
+
+def test_duplicate_program_name_is_an_error(library):
+    code, ok = link([("a", "x+1\n"), ("a", "y+1\n")])
+    assert not ok
+    assert code.semantic_error_count()
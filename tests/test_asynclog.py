@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""AsyncLog: logging from the comms path without blocking on the output."""
+import io
+import threading
+import time
+
+from geckomoped.asynclog import AsyncLog, hexbytes
+
+
+class SlowOut(io.StringIO):
+    """Output which takes delay seconds per write, as a slow terminal would."""
+    def __init__(self, delay):
+        super(SlowOut, self).__init__()
+        self.delay = delay
+
+    def write(self, s):
+        time.sleep(self.delay)
+        return super(SlowOut, self).write(s)
+
+
+def test_records_are_written_in_order():
+    out = io.StringIO()
+    log = AsyncLog(out)
+    log.log("sent %d bytes: %s", 2, hexbytes(b"\x01\xAB"))
+    log.log("plain")
+    log.flush()
+    assert out.getvalue() == "sent 2 bytes: 01 AB\nplain\n"
+    assert log.get_stats()['written'] == 2
+
+
+def test_formatting_is_left_to_the_writer():
+    formatted = []
+
+    class Arg(object):
+        def __str__(self):
+            formatted.append(threading.current_thread())
+            return "arg"
+
+    log = AsyncLog(io.StringIO())
+    log.log("%s", Arg())
+    log.flush()
+    assert formatted and formatted[0] is not threading.current_thread()
+
+
+def test_slow_output_does_not_block_the_caller():
+    out = SlowOut(.2)
+    log = AsyncLog(out, capacity=10)
+    log.log("first")
+    time.sleep(.1)          # (the writer is now stuck writing it)
+    t0 = time.perf_counter()
+    for i in range(100):
+        log.log("line %d", i)
+    assert time.perf_counter() - t0 < .05
+    assert log.dropped_full == 90
+    log.flush(2.)
+    assert "[90 log records dropped]" in out.getvalue()
+
+
+def test_rate_limit():
+    out = io.StringIO()
+    log = AsyncLog(out, rate_limit=100, batch_interval=.05)    # 5 records per batch
+    for i in range(20):
+        log.log("line %d", i)
+    log.flush()
+    assert log.written == 5 and log.dropped_rate == 15
+    assert out.getvalue().endswith("[15 log records dropped]\n")
+
+
+def test_exception_has_its_traceback():
+    out = io.StringIO()
+    log = AsyncLog(out)
+    try:
+        raise ValueError("bad thing")
+    except ValueError:
+        log.exception("Error in %s:", "tick")
+    log.flush()
+    assert out.getvalue().startswith("Error in tick:\nTraceback")
+    assert "ValueError: bad thing" in out.getvalue()
+
+
+def test_call_runs_on_the_writer_thread():
+    threads = []
+    log = AsyncLog(io.StringIO())
+    log.call(lambda: threads.append(threading.current_thread()))
+    log.flush()
+    assert threads and threads[0] is not threading.current_thread()
+
+
+def test_formatting_errors_are_counted():
+    out = io.StringIO()
+    log = AsyncLog(out)
+    log.log("%d", "not a number")
+    log.log("after")
+    log.flush()
+    assert log.errors == 1
+    assert out.getvalue().startswith("Log formatting error:")
+    assert out.getvalue().endswith("after\n")
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""RS485Devices sending runs of instant insns in bursts (see _instant_burst())."""
+import struct
+import time
+
+from geckomoped.assemble import Code
+from geckomoped.devices import Devices, GM215Device, RS485Devices
+from geckomoped.mockui import MockTab, MockUI
+
+
+DELAY = .02
+RUN = struct.pack("<H", RS485Devices.CMD_RUN)
+QLONG = struct.pack("<H", RS485Devices.CMD_QLONG)
+
+
+class Options(object):
+    libsearch = []
+
+    class p(object):
+        error_threshold = 100
+
+
+class Port(object):
+    """No devices on it: nothing is ever read back."""
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def read(self, n, timeout=0.):
+        return b""
+
+
+class Frames(object):
+    """Stands in for a CaptureWriter, noting when each command frame was finished."""
+    def __init__(self):
+        self.sent = []
+
+    def tx(self, data):
+        self.sent.append((time.perf_counter(), data[:2]))
+
+    def rx(self, data):
+        pass
+
+    def tx_raw(self, data):
+        pass
+
+    def runs(self):
+        return [t for t, cmd in self.sent if cmd == RUN]
+
+
+class UI(MockUI):
+    log_file = None
+    burst_limit = 100
+
+    def get_cmd_delay(self):
+        return DELAY
+
+    def get_resp_timeout(self):
+        return 0.
+
+    def get_burst_limit(self):
+        return self.burst_limit
+
+
+def devices(program, idle_period=1.):
+    """Devices with just an X axis, ready to run program."""
+    tab = MockTab()
+    tab.filename = "burst.gm"
+    tab.set_text(program)
+    code = Code()
+    assert code.assemble(tab, Options)
+    d = RS485Devices()
+    d.set_ui(UI())
+    d.f = Port()
+    d.capture = Frames()
+    d.code = code
+    d.devs = [GM215Device("X", 0), None, None, None]
+    d.n_devs = 1
+    d.state = Devices.READY
+    d.idle_period = idle_period
+    return d
+
+
+def program(instants):
+    return "".join("x velocity %d\n" % (100 + i) for i in range(instants)) + "x+10\n"
+
+
+def test_burst_then_round_trip_insn_in_one_pass():
+    d = devices(program(6))
+    d.run_until_break()
+    d.idle_func()
+    runs = d.capture.runs()
+    assert len(runs) == 7
+    assert d.capture.sent[-1][1] == QLONG       # (x+10 went out too, with its status query)
+    # Every insn is spaced from the last by the command delay (plus its own pacing), including the one
+    # sent after the burst
+    gaps = [b - a for a, b in zip(runs, runs[1:])]
+    assert min(gaps) > 2 * DELAY * .95
+
+
+def test_burst_limit():
+    d = devices(program(6))
+    d.ui.burst_limit = 2
+    d.run_until_break()
+    counts = []
+    for _ in range(3):
+        d.idle_func()
+        counts.append(len(d.capture.runs()))
+    # The insn the burst stopped before goes in the next pass, which bursts from it
+    assert counts == [3, 6, 7]
+
+
+def test_burst_keeps_to_its_share_of_the_pass():
+    d = devices(program(20), idle_period=.02)
+    d.run_until_break()
+    t0 = time.perf_counter()
+    d.idle_func()
+    elapsed = time.perf_counter() - t0
+    budget = max(.02 * d.BURST_SHARE, d.BURST_MIN_INSNS * DELAY)
+    assert 1 < len(d.capture.runs()) < 20
+    assert elapsed < budget + 4 * DELAY
+    assert d.send_next_command      # (the rest wait for later passes)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""Capture files, and replaying them through RS485Devices."""
+import struct
+
+import pytest
+
+from geckomoped.capture import CaptureReader, CaptureWriter, ReplayPort, Replayer, RX, TX, TX_RAW
+from geckomoped.devices import RS485Devices
+from geckomoped.framing import RECORD
+
+
+QLONG = struct.pack("<H", RS485Devices.CMD_QLONG)
+SYNC = b"\xFF"
+
+
+def record(axis, pos, pc=0, vel=0, flags=0xE0):
+    return RECORD.pack(flags | axis, pc, pos << 8 & 0xFFFFFFFF, vel)
+
+
+def write_capture(path, records):
+    w = CaptureWriter(str(path))
+    for direction, data in records:
+        w.record(direction, data)
+    w.close()
+    return w
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "cap"
+    w = write_capture(path, [(TX, b"\x08\x00"), (RX, b"\xFF\x01"), (TX_RAW, b"\x00" * 300), (RX, b"")])
+    assert w.records == 3       # (empty data is not recorded)
+    recs = CaptureReader(str(path)).read_all()
+    assert [(d, data) for d, t, data in recs] == [(TX, b"\x08\x00"), (RX, b"\xFF\x01"), (TX_RAW, b"\x00" * 300)]
+    assert recs[0][1] <= recs[1][1] <= recs[2][1]
+
+
+def test_truncated_record_is_dropped(tmp_path):
+    path = tmp_path / "cap"
+    write_capture(path, [(TX, b"\x08\x00"), (RX, b"\xFF\x01\x02\x03")])
+    path.write_bytes(path.read_bytes()[:-1])        # (as if the writer died part way through it)
+    assert [data for d, t, data in CaptureReader(str(path))] == [b"\x08\x00"]
+
+
+def test_not_a_capture(tmp_path):
+    path = tmp_path / "cap"
+    path.write_bytes(b"GMCAP\x00\x02\x00")
+    with pytest.raises(ValueError):
+        CaptureReader(str(path)).read_all()
+
+
+def test_replay_port_reads_up_to_the_next_write():
+    port = ReplayPort([(TX, 0, b"a"), (RX, 0, b"123"), (RX, 0, b"45"), (TX, 0, b"b"), (RX, 0, b"6")])
+    assert port.write(b"a") == 1
+    assert port.read(2) == b"12"
+    assert port.read(10) == b"345"      # (short: the rest came after the next write)
+    assert port.read(10) == b""
+    port.write(b"b")
+    assert port.read(10) == b"6"
+    assert port.at_end() and port.divergences == 0 and port.rx_skipped == 0
+
+
+def test_replay_port_divergence():
+    port = ReplayPort([(TX, 0, b"a"), (RX, 0, b"12"), (TX, 0, b"b"), (RX, 0, b"3"), (TX, 0, b"c"), (RX, 0, b"4")])
+    port.write(b"b")            # (skips a, and its response)
+    assert port.divergences == 1
+    assert port.read(10) == b"3"
+    port.write(b"x")            # (matches nothing, so stays put)
+    assert port.divergences == 2
+    assert port.next_direction() == TX
+    port.write(b"c")
+    assert port.read(10) == b"4"
+
+
+def test_replay_updates_the_devices(tmp_path):
+    path = tmp_path / "cap"
+    discover = SYNC + record(0, 4194403) + record(1, 4194253)
+    status = SYNC + record(0, 4194500, pc=1, vel=0x8000 | 25) + record(1, 4194200, pc=1)
+    write_capture(path, [(TX, QLONG), (RX, discover), (TX, QLONG), (RX, status[:7]), (RX, status[7:])])
+    replayer = Replayer(str(path))
+    summary = replayer.run()
+    assert summary['frames'] == 2
+    assert summary['divergences'] == 0 and summary['rx_skipped'] == 0
+    assert summary['stats']['rediscoveries'] == 1
+    d = replayer.devices
+    assert d.n_devs == 2
+    assert (d.devs[0].pos, d.devs[0].vel, d.devs[0].pc) == (4194500, 25, 1)
+    assert (d.devs[1].pos, d.devs[1].vel) == (4194200, 0)
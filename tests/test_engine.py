@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""GeckoDriver(out_of_process=True): calls and status relayed to and from a simulated engine."""
+import time
+
+import pytest
+
+from geckomoped import gm_api
+from geckomoped.engine import EngineError
+
+
+@pytest.fixture(scope="module")
+def driver():
+    driver = gm_api.GeckoDriver(None, None, True, out_of_process=True)
+    assert driver.connect("sim")
+    yield driver
+    driver.shutdown()
+
+
+def wait_for(condition, timeout=2.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+
+def test_engine_is_another_process(driver):
+    assert driver._engine.process.is_alive()
+    assert driver._engine.process.pid != driver._engine.block.pid
+
+
+def test_calls_round_trip(driver):
+    driver.load_program("x velocity ${feed=400}\nx+100\n")
+    assert driver.get_params() == {'feed': 400}
+    driver.set_params(feed=250)
+    assert driver.get_params() == {'feed': 250}
+
+
+def test_exceptions_are_relayed(driver):
+    with pytest.raises(gm_api.GMInvalidStateException):
+        driver.resume()
+    with pytest.raises(KeyError):
+        driver.set_params(nope=1)
+
+
+def test_status_is_mirrored(driver):
+    before = driver.devices.program_id
+    driver.load_program("x+1\n")
+    assert wait_for(lambda: driver.devices.program_id != before)
+    driver.run()
+    driver.wait_for_program(5.)
+    assert wait_for(lambda: not driver.is_running())
+
+
+def test_is_flashed(driver):
+    driver.load_program("x+100\ny+10\n")
+    driver.flash_program()
+    assert driver.is_flashed()      # (read from the engine's devices, not the local mirror)
+
+
+def test_shutdown_stops_the_engine():
+    driver = gm_api.GeckoDriver(None, None, True, out_of_process=True)
+    engine = driver._engine
+    driver.shutdown()
+    assert not engine.process.is_alive()
+    with pytest.raises(EngineError):
+        engine.call('is_connected')
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""RS485Devices.fast_estop() against a frame being paced out to the port."""
+import struct
+import threading
+import time
+
+import pytest
+
+from geckomoped.devices import Devices, RS485Devices
+
+
+ESTOP = struct.pack("<H", RS485Devices.CMD_ESTOP)
+
+
+class Port(object):
+    """Records what is written, as a transport would send it."""
+    def __init__(self):
+        self.written = bytearray()
+
+    def write(self, data):
+        self.written += data
+
+    def flush(self):
+        pass
+
+
+class UI(object):
+    def __init__(self, cmd_delay):
+        self.cmd_delay = cmd_delay
+
+    def get_char_delay(self):
+        return self.cmd_delay
+
+    def get_cmd_delay(self):
+        return self.cmd_delay
+
+
+@pytest.fixture
+def devices():
+    devices = RS485Devices()
+    devices.set_ui(UI(.1))
+    devices.f = Port()
+    return devices
+
+
+def frame(words):
+    data = [(d&0xFFFF)<<16|(d&0xFFFF0000)>>16 for d in words]
+    return struct.pack("<H%dI" % len(data), RS485Devices.CMD_RUN, *data)
+
+
+def test_estop_goes_out_while_a_frame_is_paced(devices):
+    words = [0x01800064, 0x41800007]        # x+100, y+7: five paced words, 0.4 s
+    sender = threading.Thread(target=devices._send_direct, args=(words,))
+    t0 = time.perf_counter()
+    sender.start()
+    time.sleep(.05)
+    latency = devices.fast_estop()
+    sender.join()
+    assert latency is not None and latency < .05
+    assert time.perf_counter() - t0 < .2
+    # The frame is finished (unpaced), as the devices would take ESTOP as an operand of it
+    assert bytes(devices.f.written) == frame(words) + ESTOP
+
+
+def test_no_insns_after_estop(devices):
+    devices.stepping = Devices.RUN_UNTIL_BREAK
+    devices.fast_estop()
+    devices._send_direct([0x01800064])
+    assert bytes(devices.f.written) == ESTOP
+    # Left for reconcile_estop(), under the comms lock
+    assert devices.stepping == Devices.RUN_UNTIL_BREAK
+    assert devices.estop_pending
+
+
+def test_estop_when_not_connected(devices):
+    devices.f = None
+    assert devices.fast_estop() is None
+    assert not devices.estop_pending
+    assert not devices.estop_wanted.is_set()
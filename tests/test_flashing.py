@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""FlashJob planning and FlashImageStore."""
+from geckomoped.flashing import FlashJob, FlashImageStore, PAGE_BYTES, page_hash
+
+
+AXES = [0, 1]
+
+
+def image(n_full, tail=b"\x12\x34\x56\x78\xFF\xFF"):
+    """n_full distinct full pages, then a part page (insns plus terminator)."""
+    return [bytes([p]) * PAGE_BYTES for p in range(n_full)] + [tail]
+
+
+def writes(job):
+    """Run through the WRITE phase as RS485Devices does, returning the (page, first, last) programmed."""
+    out = []
+    while True:
+        step = job.next_page()
+        if step is None:
+            return out
+        job.written += 1
+        out.append(step)
+
+
+def test_nothing_to_do_when_hashes_match():
+    blocks = image(3)
+    job = FlashJob(blocks, [page_hash(b) for b in blocks], AXES)
+    assert job.phase == FlashJob.DONE
+    assert job.result()['skipped'] == 4
+
+
+def test_unknown_contents_programs_everything_in_one_run():
+    blocks = image(3)
+    job = FlashJob(blocks, False, AXES)
+    assert job.phase == FlashJob.WRITE
+    assert writes(job) == [(0, True, False), (1, False, False), (2, False, False), (3, False, True)]
+    assert job.phase == FlashJob.VERIFY
+    assert sorted(job.checks) == [(p, a) for p in range(4) for a in AXES]
+
+
+def test_changed_pages_are_grouped_into_runs():
+    blocks = image(5)
+    known = [page_hash(b) for b in blocks]
+    known[1] = known[2] = known[4] = b"old"
+    job = FlashJob(blocks, known, AXES)
+    assert writes(job) == [(1, True, False), (2, False, True), (4, True, True)]
+    assert job.result()['written'] == 3
+    assert job.result()['skipped'] == 3
+
+
+def test_pages_beyond_the_known_image_are_programmed():
+    blocks = image(3)
+    known = [page_hash(b) for b in blocks[:2]]
+    job = FlashJob(blocks, known, AXES)
+    assert writes(job) == [(2, True, False), (3, False, True)]
+
+
+def test_compare_by_readback_when_no_hashes():
+    blocks = image(3)
+    job = FlashJob(blocks, None, AXES)
+    assert job.phase == FlashJob.COMPARE
+    # Full pages are read back from every axis; the part page is just programmed
+    assert list(job.checks) == [(p, a) for p in range(3) for a in AXES]
+    while job.checks:
+        page, axis = job.checks.popleft()
+        data = blocks[page] if (page, axis) != (1, 1) else b"\x00" * PAGE_BYTES
+        job.compare_result(page, data)
+    assert job.phase == FlashJob.WRITE
+    assert writes(job) == [(1, True, True), (3, True, True)]
+    assert job.result()['compared'] == 6
+
+
+def test_verify_records_mismatches():
+    blocks = image(2)
+    job = FlashJob(blocks, False, AXES)
+    writes(job)
+    while job.checks:
+        page, axis = job.checks.popleft()
+        data = blocks[page] if (page, axis) != (0, 1) else b"\x01" * PAGE_BYTES
+        job.verify_result(page, axis, data)
+    assert job.phase == FlashJob.DONE
+    assert job.result()['verify_errors'] == [(0, 1)]
+    assert job.result()['verified'] == 6
+
+
+def test_no_verify():
+    job = FlashJob(image(2), False, AXES, verify=False)
+    writes(job)
+    assert job.phase == FlashJob.DONE
+
+
+def test_part_page_compares_insns_only():
+    blocks = image(1)
+    job = FlashJob(blocks, False, AXES)
+    tail = blocks[-1]
+    assert not job.page_differs(1, tail[:-2] + b"\x00\x00")
+    assert job.page_differs(1, b"\x00" + tail[1:])
+    assert job.is_last_page(1) and not job.is_last_page(0)
+
+
+def test_image_store_survives_reload(tmp_path):
+    path = str(tmp_path / "flash.images")
+    store = FlashImageStore(path)
+    assert store.get(("/dev/ttyUSB0", "XY")) is None
+    store.put(("/dev/ttyUSB0", "XY"), [b"a", b"b"])
+    assert FlashImageStore(path).get(("/dev/ttyUSB0", "XY")) == [b"a", b"b"]
+    store.forget(("/dev/ttyUSB0", "XY"))
+    assert FlashImageStore(path).get(("/dev/ttyUSB0", "XY")) is None
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""QlongFramer: validating and realigning qlong responses."""
+import pytest
+
+from geckomoped.framing import QlongFramer, RECORD
+
+
+SYNC = b"\xFF"
+DEVS = [object(), object(), None, None]     # X and Y on the bus (the framer only looks for None)
+PROGRAM_LEN = 10
+
+
+def record(axis, pos, pc=1, vel=0, flags=0xE0):
+    return RECORD.pack(flags | axis, pc, pos << 8 & 0xFFFFFFFF, vel)
+
+
+@pytest.fixture
+def framer():
+    """A framer which has seen one good response, with X at 4194403 and Y at 4194253."""
+    framer = QlongFramer()
+    x = SYNC + record(0, 4194403) + record(1, 4194253)
+    assert framer.frame(x, DEVS, 0., 2, PROGRAM_LEN) == (x[1:], False)
+    return framer
+
+
+def test_clean_response(framer):
+    recs = record(0, 4194500, pc=2) + record(1, 4194200, pc=2)
+    assert framer.frame(SYNC + recs, DEVS, .02, 2, PROGRAM_LEN) == (recs, False)
+
+
+def test_two_sync_bytes(framer):
+    recs = record(0, 4194500) + record(1, 4194200)
+    assert framer.frame(b"\x00" + SYNC + recs, DEVS, .02, 2, PROGRAM_LEN) == (recs, False)
+
+
+def test_inserted_byte_is_skipped(framer):
+    x0, y0 = record(0, 4194500), record(1, 4194200)
+    data, repaired = framer.frame(SYNC + x0 + b"\x07" + y0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == x0 + y0
+
+
+def test_dropped_byte_loses_only_that_record(framer):
+    x0, y0 = record(0, 4194500), record(1, 4194200)
+    data, repaired = framer.frame(SYNC + x0[:2] + x0[3:] + y0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == y0
+
+
+def test_corrupted_position_is_rejected(framer):
+    x0, y0 = record(0, 4194403 + 1000000), record(1, 4194200)
+    data, repaired = framer.frame(SYNC + x0 + y0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == y0
+
+
+def test_corrupted_pc_is_rejected(framer):
+    x0, y0 = record(0, 4194500, pc=500), record(1, 4194200)
+    data, repaired = framer.frame(SYNC + x0 + y0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == y0
+
+
+def test_genuine_jump_is_accepted_when_repeated(framer):
+    x0, y0 = record(0, 0), record(1, 4194200)       # (e.g. X position zeroed)
+    assert framer.frame(SYNC + x0 + y0, DEVS, .02, 2, PROGRAM_LEN) == (y0, True)
+    assert framer.frame(SYNC + x0 + y0, DEVS, .04, 2, PROGRAM_LEN) == (x0 + y0, False)
+    # ...and later positions are judged from there
+    x1 = record(0, 100)
+    assert framer.frame(SYNC + x1 + y0, DEVS, .06, 2, PROGRAM_LEN) == (x1 + y0, False)
+
+
+def test_slow_movement_is_plausible_after_a_gap(framer):
+    x0 = record(0, 4194403 + 400000)    # 1 s later, well within POS_SLEW
+    y0 = record(1, 4194253)
+    assert framer.frame(SYNC + x0 + y0, DEVS, 1., 2, PROGRAM_LEN) == (x0 + y0, False)
+
+
+def test_new_axis_is_believed_with_an_extra_record(framer):
+    recs = record(0, 4194500) + record(1, 4194200) + record(2, 4194303)
+    assert framer.frame(SYNC + recs, DEVS, .02, 2, PROGRAM_LEN) == (recs, False)
+
+
+def test_unknown_axis_without_an_extra_record_is_not(framer):
+    x0, z0 = record(0, 4194500), record(2, 4194303)
+    data, repaired = framer.frame(SYNC + x0 + z0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == x0
+
+
+def test_duplicate_axis_is_dropped(framer):
+    x0, y0 = record(0, 4194500), record(1, 4194200)
+    data, repaired = framer.frame(SYNC + x0 + x0 + y0, DEVS, .02, 2, PROGRAM_LEN)
+    assert repaired
+    assert data == x0 + y0
+
+
+def test_discovery_takes_any_axis():
+    framer = QlongFramer()
+    recs = record(0, 4194303) + record(3, 4194303)
+    assert framer.frame(SYNC + recs, None, 0.) == (recs, False)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""TickScheduler, on a simulated clock."""
+import pytest
+
+from geckomoped import scheduler
+from geckomoped.scheduler import TickScheduler
+
+
+class Clock(object):
+    """Stands in for the time module: sleep() just moves the clock on."""
+    def __init__(self):
+        self.now = 100.
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+
+    def work(self, secs):
+        self.now += secs
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(scheduler, "time", clock)
+    return clock
+
+
+def test_ticks_keep_to_absolute_deadlines(clock):
+    sched = TickScheduler(.02)
+    sched.start()
+    wakeups = []
+    for _ in range(5):
+        sched.wait()
+        wakeups.append(round(clock.now - 100., 6))
+        clock.work(.007)        # (the tick itself doesn't push the schedule back)
+    assert wakeups == [.02, .04, .06, .08, .1]
+    assert sched.missed == 0
+    assert sched.get_stats()['ticks'] == 5
+
+
+def test_overrun_skips_missed_deadlines(clock):
+    sched = TickScheduler(.02)
+    sched.start()
+    sched.wait()                # at .02
+    clock.work(.065)            # overruns the deadlines at .04, .06 and .08
+    late = sched.wait()
+    assert late == pytest.approx(.045)
+    assert sched.missed == 2    # (.06 and .08 are skipped; .04 ran late)
+    sched.wait()
+    assert clock.now - 100. == pytest.approx(.1)
+
+
+def test_watchdog(clock):
+    trips = []
+    sched = TickScheduler(.02)
+    sched.watchdog_threshold = .03
+    sched.watchdog = trips.append
+    sched.start()
+    sched.wait()
+    clock.work(.025)            # late, but within the threshold
+    sched.wait()
+    clock.work(.09)
+    sched.wait()
+    assert len(trips) == 1 and trips[0] == pytest.approx(.075)
+    assert sched.watchdog_trips == 1
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""GMServer protocol handling, against a simulated driver."""
+import json
+import os
+import socket
+import stat
+import time
+
+import pytest
+
+from geckomoped import gm_api, server
+from geckomoped.server import GMClient, GMServer, GMServerError
+
+
+@pytest.fixture(scope="module")
+def driver():
+    driver = gm_api.GeckoDriver(None, None, True)
+    assert driver.connect("sim")
+    yield driver
+    driver.shutdown()
+
+
+@pytest.fixture
+def srv(driver, tmp_path):
+    srv = GMServer(driver, unix_socket=str(tmp_path / "gm.sock"))
+    srv.start()
+    yield srv
+    srv.stop()
+
+
+@pytest.fixture
+def tcp_srv(driver):
+    srv = GMServer(driver, port=0)
+    srv.start()
+    yield srv
+    srv.stop()
+
+
+def connect(srv):
+    if srv.unix_socket is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(srv.unix_socket)
+    else:
+        sock = socket.create_connection(srv.address[:2])
+    sock.settimeout(2.)
+    return sock
+
+
+def replies(sock):
+    """Read until the server closes the connection, returning the messages it sent."""
+    data = b""
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return [json.loads(line) for line in data.splitlines()]
+        data += chunk
+
+
+def wait_for(condition, timeout=2.):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(.01)
+    return True
+
+
+def test_unix_socket_is_private(srv):
+    assert stat.S_IMODE(os.stat(srv.unix_socket).st_mode) == 0o600
+    assert srv.token is None
+
+
+def test_tcp_server_has_a_token(tcp_srv):
+    assert tcp_srv.token
+
+
+def test_malformed_line_closes_the_connection(srv):
+    sock = connect(srv)
+    sock.sendall(b'{"id": 1, "op": "hello"}\nnot json\n{"id": 2, "op": "ping"}\n')
+    msgs = replies(sock)
+    assert msgs[0] == {'id': 1, 'ok': True, 'result': None}
+    assert msgs[1]['ok'] is False and msgs[1]['error'] == 'ValueError'
+    assert len(msgs) == 2       # (the ping was never run)
+    assert wait_for(lambda: not srv.clients)
+
+
+def test_first_request_must_be_hello(srv):
+    sock = connect(srv)
+    sock.sendall(b'{"id": 1, "op": "ping"}\n')
+    assert replies(sock) == [{'id': 1, 'ok': False, 'error': 'GMServerError', 'message': "Expected hello"}]
+
+
+def test_wrong_token_is_refused(tcp_srv):
+    with pytest.raises(GMServerError):
+        GMClient(port=tcp_srv.address[1], token="nope")
+    with GMClient(port=tcp_srv.address[1], token=tcp_srv.token) as c:
+        assert c.call("ping") == "pong"
+
+
+def test_cross_protocol_post_runs_nothing(tcp_srv, tmp_path):
+    marker = tmp_path / "pwned"
+    body = json.dumps({'op': 'load', 'args': {'program': "{{{\nopen(%r, 'w')\n}}}\nx+1\n" % str(marker)}}) + "\n"
+    post = "POST / HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n\r\n%s"
+    sock = connect(tcp_srv)
+    sock.sendall((post % (len(body), body)).encode("utf-8"))
+    msgs = replies(sock)
+    assert len(msgs) == 1 and msgs[0]['ok'] is False
+    assert not marker.exists()
+
+
+def test_python_in_programs_is_refused(srv, driver, tmp_path):
+    marker = tmp_path / "pwned"
+    with GMClient(srv.unix_socket) as c:
+        c.load_program("{{{\nopen(%r, 'w')\n}}}\nx+1\n" % str(marker))
+        assert driver.devices.code.semantic_error_count()
+        c.load_program("x+{len('ab')}\n")
+        assert driver.devices.code.semantic_error_count()
+        c.load_program("x velocity ${v=200}\nx+${d=-5}\n")
+        assert not driver.devices.code.semantic_error_count()
+        assert driver.get_params() == {'v': 200, 'd': -5}
+    assert not marker.exists()
+
+
+def test_unknown_op_keeps_the_connection(srv):
+    with GMClient(srv.unix_socket) as c:
+        with pytest.raises(ValueError):
+            c.call("bogus")
+        assert c.call("ping") == "pong"
+
+
+def test_waits_end_when_the_client_disconnects(srv, monkeypatch):
+    monkeypatch.setattr(server, "WAIT_SLICE", .05)
+    sock = connect(srv)
+    sock.sendall(b'{"id": 1, "op": "hello"}\n')
+    for i in range(3):
+        req = {'id': i + 2, 'op': 'wait', 'args': {'what': 'pc', 'target': 1 << 20}}
+        sock.sendall(json.dumps(req).encode("utf-8") + b"\n")
+    assert wait_for(lambda: srv._waits == 3)
+    sock.close()
+    assert wait_for(lambda: srv._waits == 0)
+    assert not srv.clients
+
+
+def test_waits_are_capped(srv, monkeypatch):
+    monkeypatch.setattr(server, "MAX_WAITS_TOTAL", 2)
+    with GMClient(srv.unix_socket) as c1, GMClient(srv.unix_socket) as c2:
+        sock = connect(srv)
+        sock.sendall(b'{"id": 1, "op": "hello"}\n')
+        for i in range(2):
+            req = {'id': i + 2, 'op': 'wait', 'args': {'what': 'pc', 'target': 1 << 20}}
+            sock.sendall(json.dumps(req).encode("utf-8") + b"\n")
+        assert wait_for(lambda: srv._waits == 2)
+        with pytest.raises(GMServerError):
+            c1.wait("pc", target=1 << 20)
+        sock.close()
+        assert wait_for(lambda: srv._waits == 0)
+        assert c2.wait("pc", .1, target=1 << 20) is False
+
+
+def test_wait_timeout(srv):
+    with GMClient(srv.unix_socket) as c:
+        t0 = time.monotonic()
+        assert c.wait("pc", .2, target=1 << 20) is False
+        assert .15 < time.monotonic() - t0 < 1.
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""StatusBlock and StatusReader, and not taking over another process's block."""
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+
+from geckomoped.devices import Devices, Device
+from geckomoped.statusblock import StatusBlock, StatusReader, _SEQ, _SEQ_OFFSET
+
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="Windows removes blocks nobody has open, so none are stale")
+
+# Creates a block, then either exits at once leaving it behind ("leave"), or keeps it until a line comes on stdin
+CREATOR = """
+import sys
+from geckomoped.statusblock import StatusBlock, _untrack
+block = StatusBlock(sys.argv[1], create=True)
+if sys.argv[2] == "leave":
+    _untrack(block.shm)
+    block.shm.close()
+else:
+    print("ready", flush=True)
+    sys.stdin.readline()
+    block.close()
+"""
+
+
+class FakeDevices(object):
+    def __init__(self):
+        self.program_id = 7
+        self.state = Devices.RUNNING
+        self.stepping = Devices.RUN_UNTIL_BREAK
+        self.addr = 12
+        x = Device("X", 0)
+        x.flags, x.pc, x.pos, x.vel, x.offset = 0xE1, 12, 4194403, -25, 100
+        self.devs = [x, None, None, None]
+        self.n_devs = 1
+
+
+@pytest.fixture
+def name():
+    return "gm_test_%s" % uuid.uuid4().hex[:12]
+
+
+def creator(name, mode):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.Popen([sys.executable, "-c", CREATOR, name, mode], env=env,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+
+
+def test_round_trip(name):
+    block = StatusBlock(name, create=True)
+    try:
+        block.write(FakeDevices(), True)
+        with StatusReader(name) as reader:
+            snap = reader.read()
+            assert snap.connected and snap.is_running()
+            assert (snap.program_id, snap.addr, snap.n_devs) == (7, 12, 1)
+            assert snap.position(0) == 4194403 and snap.velocity(0) == -25
+            assert snap.axes[1] is None
+            with pytest.raises(ValueError):
+                snap.position(1)
+    finally:
+        block.close()
+
+
+def test_torn_read_is_retried(name):
+    block = StatusBlock(name, create=True)
+    try:
+        block.write(FakeDevices(), True)
+        _SEQ.pack_into(block.buf, _SEQ_OFFSET, block.seq + 1)     # (as if a write were in progress)
+        assert block.read(retries=10) is None
+    finally:
+        block.close()
+
+
+def test_live_block_is_not_taken_over(name):
+    proc = creator(name, "keep")
+    try:
+        assert proc.stdout.readline().strip() == "ready"
+        with pytest.raises(FileExistsError):
+            StatusBlock(name, create=True)
+        # ...and it is still there for its owner
+        with StatusReader(name) as reader:
+            assert reader.read() is not None
+    finally:
+        proc.communicate("\n", timeout=10)
+    assert proc.returncode == 0
+
+
+def test_stale_block_is_replaced(name):
+    proc = creator(name, "leave")
+    proc.communicate(timeout=10)
+    assert proc.returncode == 0
+    StatusReader(name).close()      # (left behind)
+    block = StatusBlock(name, create=True)
+    try:
+        assert block.pid == os.getpid()
+    finally:
+        block.close()
+    with pytest.raises(FileNotFoundError):
+        StatusReader(name)
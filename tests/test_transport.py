@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2014 Geckodrive Inc.
+
+"""TcpTransport against a loopback socket standing in for a serial-to-Ethernet bridge."""
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from geckomoped.transport import TcpTransport, TransportError, parse_tcp_url
+
+
+@pytest.fixture
+def link():
+    """Yields (transport, bridge): a connected TcpTransport, and the bridge's end of the connection."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    transport = TcpTransport(*listener.getsockname())
+    bridge, _ = listener.accept()
+    bridge.settimeout(2.)
+    listener.close()
+    yield transport, bridge
+    transport.close()
+    bridge.close()
+
+
+def _recv_exactly(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+def test_read_returns_what_has_arrived(link):
+    transport, bridge = link
+    bridge.sendall(b"\x01\x02\x03\x04")
+    assert transport.read(4, 1.) == b"\x01\x02\x03\x04"
+
+
+def test_partial_reads_are_reassembled(link):
+    transport, bridge = link
+    bridge.sendall(b"\x01\x02")
+    time.sleep(.05)
+    assert transport.read(1, 0.) == b"\x01"
+    bridge.sendall(b"\x03\x04\x05")
+    assert transport.read(4, 1.) == b"\x02\x03\x04\x05"
+
+
+def test_read_waits_for_the_rest(link):
+    transport, bridge = link
+    bridge.sendall(b"\xAA")
+    t0 = time.monotonic()
+    sender = threading.Timer(.1, bridge.sendall, (b"\xBB\xCC",))
+    sender.start()
+    try:
+        assert transport.read(3, 1.) == b"\xAA\xBB\xCC"
+    finally:
+        sender.join()
+    assert time.monotonic() - t0 < .9
+
+
+def test_read_deadline(link):
+    transport, bridge = link
+    bridge.sendall(b"\x01")
+    t0 = time.monotonic()
+    assert transport.read(4, .1) == b"\x01"
+    elapsed = time.monotonic() - t0
+    assert .09 <= elapsed < .5
+
+
+def test_zero_timeout_does_not_wait(link):
+    transport, bridge = link
+    t0 = time.monotonic()
+    assert transport.read(4, 0.) == b""
+    assert time.monotonic() - t0 < .05
+
+
+def test_writes_are_coalesced_until_flush(link):
+    transport, bridge = link
+    transport.write(b"\x08\x00")
+    transport.write(b"\x34\x12")
+    bridge.setblocking(False)
+    time.sleep(.05)
+    with pytest.raises(BlockingIOError):
+        bridge.recv(16)
+    transport.flush()
+    bridge.setblocking(True)
+    assert _recv_exactly(bridge, 4) == b"\x08\x00\x34\x12"
+
+
+def test_read_flushes_pending_writes(link):
+    transport, bridge = link
+    transport.write(b"\x07\x00")
+    assert transport.read(2, 0.) == b""
+    assert _recv_exactly(bridge, 2) == b"\x07\x00"
+
+
+def test_read_after_close_raises(link):
+    transport, bridge = link
+    bridge.sendall(b"\x01")
+    bridge.close()
+    assert transport.read(1, 1.) == b"\x01"
+    with pytest.raises(TransportError):
+        transport.read(1, 1.)
+
+
+def test_write_after_reset_raises(link):
+    transport, bridge = link
+    bridge.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    bridge.close()     # (with a zero linger time, sends RST)
+    time.sleep(.05)
+    with pytest.raises(TransportError):
+        for _ in range(100):
+            transport.write(b"\x00" * 1024)
+            transport.flush()
+            time.sleep(.01)
+
+
+def test_connect_failure_raises():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    with pytest.raises(TransportError):
+        TcpTransport("127.0.0.1", port, connect_timeout=.5)
+
+
+def test_parse_tcp_url():
+    assert parse_tcp_url("tcp://bridge.local:4001") == ("bridge.local", 4001)
+    assert parse_tcp_url("socket://[::1]:4001/") == ("::1", 4001)
+    assert parse_tcp_url("/dev/ttyUSB0") is None
+    with pytest.raises(TransportError):
+        parse_tcp_url("tcp://bridge.local")